@@ -5,6 +5,8 @@ import sys
 
 from . import (
     c3d,
+    c3dstore,
+    catalog,
     config,
     eclipse,
     emg,
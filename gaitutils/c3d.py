@@ -19,6 +19,7 @@ from .numutils import center_of_pressure, _change_coords, _is_ascii
 from .events import GaitEvents, GaitEvent
 from .utils import _step_width
 from .envutils import lru_cache_checkfile, _named_tempfile, GaitDataError
+from .config import cfg
 
 
 logger = logging.getLogger(__name__)
@@ -73,11 +74,33 @@ def _get_c3d_metadata_field(acq, field, subfield):
         raise RuntimeError('Unhandled btk meta info type')
 
 
-@lru_cache_checkfile
+def _c3d_cache_bytes():
+    """Return the c3d cache memory budget in bytes, or None if unlimited"""
+    mb = cfg.general.c3d_cache_size
+    return None if mb is None else int(mb * 2**20)
+
+
+def _acq_nbytes(c3dfile, acq):
+    """Estimate the memory used by a btk acquisition.
+
+    btk stores point values (x, y, z + residual) and analog samples as doubles.
+    """
+    n_point_values = 4 * acq.GetPointNumber() * acq.GetPointFrameNumber()
+    n_analog_values = acq.GetAnalogNumber() * acq.GetAnalogFrameNumber()
+    return 8 * (n_point_values + n_analog_values)
+
+
+@lru_cache_checkfile(
+    max_bytes=_c3d_cache_bytes(),
+    check_digest=cfg.general.c3d_cache_check_digest,
+    sizeof=_acq_nbytes,
+)
 def _get_c3dacq(c3dfile):
     """Get a btk c3dacq object.
 
-    Object is returned from cache if filename and digest match.
+    Object is returned from cache if the file has not changed since it was
+    read. Cache statistics can be obtained by _get_c3dacq.cache_info(), and
+    a file can be dropped from the cache by _get_c3dacq.cache_invalidate().
     """
     reader = btk.btkAcquisitionFileReader()
     c3dfile = str(c3dfile)  # accept Path objects too (btk won't eat those)
@@ -182,37 +205,54 @@ def _get_emg_data(c3dfile):
 
 def _get_accelerometer_data(c3dfile):
     """Read accelerometer data from a c3d file"""
-    data = _get_analog_data(c3dfile, 'Accelerometer')
-    # Remove the 'Acceleration.' prefix if inserted by Nexus, so that channel
-    # names match Nexus. This is a bit ugly (not done for EMG which uses fuzzy
-    # matching)
-    for key in data['data']:
+    return _strip_accelerometer_prefix(_get_analog_data(c3dfile, 'Accelerometer'))
+
+
+def _strip_accelerometer_prefix(data):
+    """Remove the 'Acceleration.' prefix from accelerometer channel names.
+
+    The prefix is inserted by Nexus; removing it makes channel names match
+    Nexus. This is a bit ugly (not done for EMG which uses fuzzy matching)
+    """
+    for key in list(data['data']):
         if key.find('Acceleration.') == 0:
             # replace key names
             data['data'][key[13:]] = data['data'].pop(key)
     return data
 
 
-def _get_analog_data(c3dfile, devname):
-    """Read analog data from a c3d file.
+def _get_analog_channels(acq):
+    """Read all analog channels from a btk acquisition.
 
-    devname is matched against channel names.
+    Returns a tuple of (labels, descriptions, data), where data is a
+    (n_channels, n_samples) ndarray.
     """
-    acq = _get_c3dacq(c3dfile)
-    data = dict()
-    chnames = []
-    for i in btk.Iterate(acq.GetAnalogs()):
-        if i.GetDescription().find(devname) >= 0:
-            if (chname := i.GetLabel()) in chnames:
+    labels, descriptions = list(), list()
+    data = np.empty((acq.GetAnalogNumber(), acq.GetAnalogFrameNumber()))
+    for k, ch in enumerate(btk.Iterate(acq.GetAnalogs())):
+        labels.append(ch.GetLabel())
+        descriptions.append(ch.GetDescription())
+        data[k] = np.squeeze(ch.GetValues())
+    return labels, descriptions, data
+
+
+def _select_analog_data(labels, descriptions, data, analograte, devname):
+    """Pick the analog channels for a given device.
+
+    devname is matched against channel descriptions. See _get_analog_data.
+    """
+    chdata = dict()
+    for chname, desc, values in zip(labels, descriptions, data):
+        if desc.find(devname) >= 0:
+            if chname in chdata:
                 raise GaitDataError(
                     'Duplicate channel names in C3D file. Please rename your channels.'
                 )
-            chnames.append(chname)
-            data[chname] = np.squeeze(i.GetValues())
-    if chnames:
+            chdata[chname] = values
+    if chdata:
         return {
-            't': np.arange(len(data[chname])) / acq.GetAnalogFrequency(),
-            'data': data,
+            't': np.arange(data.shape[1]) / analograte,
+            'data': chdata,
         }
     else:
         raise GaitDataError(
@@ -220,24 +260,71 @@ def _get_analog_data(c3dfile, devname):
         )
 
 
+def _get_analog_data(c3dfile, devname):
+    """Read analog data from a c3d file.
+
+    devname is matched against channel names.
+    """
+    acq = _get_c3dacq(c3dfile)
+    labels, descriptions, data = _get_analog_channels(acq)
+    return _select_analog_data(
+        labels, descriptions, data, acq.GetAnalogFrequency(), devname
+    )
+
+
+def _point_data_nbytes(c3dfile, point_data):
+    """Return the memory used by the output of _get_point_data"""
+    return point_data[0].nbytes
+
+
+@lru_cache_checkfile(
+    max_bytes=_c3d_cache_bytes(),
+    check_digest=cfg.general.c3d_cache_check_digest,
+    sizeof=_point_data_nbytes,
+)
+def _get_point_data(c3dfile):
+    """Read all points (markers and model outputs) from a c3d file in one pass.
+
+    Returns a tuple of (data, index), where data is a read-only
+    (n_points, n_frames, 3) ndarray and index is a dict mapping point names to
+    indices along the first dimension. If a name occurs several times, the
+    first occurrence is used (like btk GetPoint() does).
+    """
+    acq = _get_c3dacq(c3dfile)
+    data = np.empty((acq.GetPointNumber(), acq.GetPointFrameNumber(), 3))
+    index = dict()
+    for k, point in enumerate(btk.Iterate(acq.GetPoints())):
+        data[k] = point.GetValues()
+        index.setdefault(point.GetLabel(), k)
+    # the array is shared between callers, so protect it from modification
+    data.flags.writeable = False
+    return data, index
+
+
 def _get_marker_data(c3dfile, markers, ignore_missing=False):
     """Get position data for specified markers.
 
+    The returned arrays are read-only views into the shared point data.
     See read_data.get_marker_data for details.
     """
+    return _marker_data_from_points(
+        _get_point_data(c3dfile), markers, ignore_missing=ignore_missing
+    )
+
+
+def _marker_data_from_points(point_data, markers, ignore_missing=False):
+    """Pick marker data from the output of _get_point_data"""
     if not isinstance(markers, list):  # listify if not already a list
         markers = [markers]
-    acq = _get_c3dacq(c3dfile)
+    data, index = point_data
     mkrdata = dict()
     for marker in markers:
-        try:
-            mkrdata[marker] = np.squeeze(acq.GetPoint(marker).GetValues())
-        except RuntimeError:
-            if ignore_missing:
-                logger.warning(f'Cannot read trajectory {marker} from c3d file')
-                continue
-            else:
-                raise GaitDataError(f'Cannot read trajectory {marker} from c3d file')
+        if marker in index:
+            mkrdata[marker] = np.squeeze(data[index[marker]])
+        elif ignore_missing:
+            logger.warning(f'Cannot read trajectory {marker} from c3d file')
+        else:
+            raise GaitDataError(f'Cannot read trajectory {marker} from c3d file')
     return mkrdata
 
 
@@ -333,20 +420,23 @@ def _get_metadata(c3dfile):
 def _get_model_data(c3dfile, model):
     """Read model output variables (e.g. Plug-in Gait).
 
+    The returned arrays are read-only views into the shared point data.
     See read_data.get_model_data for details.
     """
+    return _model_data_from_points(_get_point_data(c3dfile), model)
+
+
+def _model_data_from_points(point_data, model):
+    """Pick model data from the output of _get_point_data"""
     modeldata = dict()
-    acq = _get_c3dacq(c3dfile)
-    var_dims = (3, acq.GetPointFrameNumber())
+    data, index = point_data
+    var_dims = (3, data.shape[1])
     for var in model.read_vars:
-        try:
-            vals = acq.GetPoint(var).GetValues()
-            modeldata[var] = np.transpose(np.squeeze(vals))
-        except RuntimeError:
+        if var in index:
+            modeldata[var] = np.transpose(np.squeeze(data[index[var]]))
+        else:
             logger.info(f'cannot read model variable {var}, returning nans')
-            data = np.empty(var_dims)
-            data[:] = np.nan
-            modeldata[var] = data
+            modeldata[var] = np.full(var_dims, np.nan)
         # c3d stores scalars as last dim of 3-d array
         if model.read_strategy == 'last':
             modeldata[var] = modeldata[var][2, :]
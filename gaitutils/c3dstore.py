@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+"""
+Compact on-disk store for data decoded from c3d files.
+
+The first read of a c3d file decodes the data via btk and writes it into a
+sidecar .npz file, which is placed next to the c3d file or into the configured
+store directory (cfg.general.c3d_store_dir). Subsequent reads memory-map the
+arrays from the sidecar file instead of parsing the c3d file. The memory-mapped
+pages can be shared between processes. The sidecar file is rebuilt if the c3d
+file has changed (checked by file stats, then by digest).
+
+The module implements the same reader interface as c3d.py. It is used by
+read_data if cfg.general.use_c3d_store is set.
+
+NB: do not use the data readers from this file directly. They are intended to be
+called via the read_data module.
+
+@author: Jussi (jnu@iki.fi)
+"""
+
+from collections import defaultdict
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+import struct
+import zipfile
+import numpy as np
+
+from . import c3d
+from .config import cfg
+from .events import GaitEvents, GaitEvent
+from .envutils import lru_cache_checkfile
+from .numutils import _file_digest
+
+
+logger = logging.getLogger(__name__)
+
+# increment this if the layout of the store changes
+STORE_VERSION = 1
+# forceplate fields that are saved into the store
+FP_FIELDS = ['F', 'Ftot', 'M', 'CoP', 'wR', 'wT', 'plate_corners']
+
+
+def _store_path(c3dfile):
+    """Return the path of the sidecar file for a c3d file"""
+    c3dfile = Path(c3dfile)
+    if cfg.general.c3d_store_dir is None:
+        return c3dfile.with_suffix('.gaitutils.npz')
+    # files from different sessions may have identical names, so tag them
+    # with the digest of the full path
+    path_digest = hashlib.md5(str(c3dfile.resolve()).encode('utf-8')).hexdigest()
+    return Path(cfg.general.c3d_store_dir) / f'{c3dfile.stem}_{path_digest[:12]}.npz'
+
+
+def _c3d_stamp(c3dfile):
+    st = os.stat(c3dfile)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def _decode_c3d(c3dfile):
+    """Decode the data of a c3d file via btk.
+
+    Returns a tuple of (header, arrays), where header is a JSON serializable dict
+    and arrays is a dict of ndarrays.
+    """
+    logger.debug(f'decoding {c3dfile} for the c3d store')
+    meta = c3d._get_metadata(c3dfile)
+    events = [
+        [ev.frame, ev.event_type, ev.context] for ev in meta['events'].get_events()
+    ]
+    meta_ = {
+        key: val
+        for key, val in meta.items()
+        if key not in ['trialname', 'sessionpath', 'events', 'subj_params']
+    }
+    meta_['subj_params'] = dict(meta['subj_params'])
+    points, point_index = c3d._get_point_data(c3dfile)
+    acq = c3d._get_c3dacq(c3dfile)
+    labels, descriptions, analog = c3d._get_analog_channels(acq)
+    arrays = {'points': np.asarray(points), 'analog': analog}
+    forceplates = list()
+    for k, fpdata in enumerate(c3d._get_forceplate_data(c3dfile)):
+        forceplates.append(fpdata['eclipse_key'])
+        for field in FP_FIELDS:
+            arrays[f'fp{k}_{field}'] = fpdata[field]
+    header = {
+        'version': STORE_VERSION,
+        'c3d_stamp': _c3d_stamp(c3dfile),
+        'c3d_digest': _file_digest(c3dfile),
+        'metadata': meta_,
+        'events': events,
+        'point_index': point_index,
+        'analog_labels': labels,
+        'analog_descriptions': descriptions,
+        'forceplates': forceplates,
+    }
+    return header, arrays
+
+
+def _write_store(fn, header, arrays):
+    """Write the store file.
+
+    The file is first written under a temporary name and then renamed, so that
+    readers never see a partially written file.
+    """
+    fn.parent.mkdir(parents=True, exist_ok=True)
+    fn_tmp = fn.with_name(fn.name + '.tmp')
+    with open(fn_tmp, 'wb') as f:
+        # np.savez does not compress, which is required for memory mapping
+        np.savez(f, header=np.array(json.dumps(header)), **arrays)
+    os.replace(fn_tmp, fn)
+
+
+def _read_header(fn):
+    with np.load(fn) as npz:
+        return json.loads(str(npz['header'][()]))
+
+
+def _mmap_npz(fn):
+    """Memory-map the arrays of an uncompressed .npz file.
+
+    np.load ignores mmap_mode for .npz files. However, members of an
+    uncompressed zip archive are stored as contiguous bytes, so the .npy
+    members can be mapped directly at the correct file offsets.
+    """
+    arrays = dict()
+    with zipfile.ZipFile(fn) as zf, open(fn, 'rb') as f:
+        for info in zf.infolist():
+            key = Path(info.filename).stem
+            if key == 'header':
+                continue
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(f'{fn} is compressed, cannot memory-map')
+            # skip the zip local file header to get to the .npy data
+            f.seek(info.header_offset)
+            local_header = f.read(30)
+            name_len, extra_len = struct.unpack('<HH', local_header[26:30])
+            f.seek(info.header_offset + 30 + name_len + extra_len)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            if 0 in shape or not shape:  # cannot mmap empty or 0-d arrays
+                arrays[key] = np.lib.format.read_array(zf.open(info))
+            else:
+                arrays[key] = np.memmap(
+                    fn,
+                    dtype=dtype,
+                    mode='r',
+                    offset=f.tell(),
+                    shape=shape,
+                    order='F' if fortran_order else 'C',
+                ).view(np.ndarray)
+    return arrays
+
+
+def _store_is_valid(header, c3dfile):
+    """Check whether the store header matches the c3d file"""
+    if header.get('version') != STORE_VERSION:
+        return False
+    elif header['c3d_stamp'] == _c3d_stamp(c3dfile):
+        return True
+    else:
+        # the c3d file may have been touched or copied without changes
+        return header['c3d_digest'] == _file_digest(c3dfile)
+
+
+def _store_nbytes(c3dfile, store):
+    header, arrays = store
+    return sum(arr.nbytes for arr in arrays.values())
+
+
+@lru_cache_checkfile(
+    max_bytes=c3d._c3d_cache_bytes(),
+    check_digest=cfg.general.c3d_cache_check_digest,
+    sizeof=_store_nbytes,
+)
+def _get_store(c3dfile):
+    """Get the stored data for a c3d file, (re)building the store if needed.
+
+    Returns a tuple of (header, arrays). The arrays are memory-mapped from the
+    store file if possible.
+    """
+    fn = _store_path(c3dfile)
+    if fn.is_file():
+        try:
+            header = _read_header(fn)
+            if _store_is_valid(header, c3dfile):
+                logger.debug(f'reading c3d data from {fn}')
+                return header, _mmap_npz(fn)
+            logger.info(f'{c3dfile} has changed, rebuilding {fn}')
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            logger.warning(f'cannot read {fn}, rebuilding it')
+    header, arrays = _decode_c3d(c3dfile)
+    try:
+        _write_store(fn, header, arrays)
+    except OSError as e:
+        # e.g. read-only directory, or store file still mapped on Windows
+        logger.warning(f'cannot write c3d store {fn}: {e}')
+        return header, arrays
+    return header, _mmap_npz(fn)
+
+
+def _get_point_data(c3dfile):
+    header, arrays = _get_store(c3dfile)
+    return arrays['points'], header['point_index']
+
+
+def _get_metadata(c3dfile):
+    """Read trial and subject metadata from the store.
+
+    See read_data.get_metadata() for details.
+    """
+    c3dfile = Path(c3dfile)
+    header, _ = _get_store(c3dfile)
+    meta = dict(header['metadata'])
+    meta['trialname'] = c3dfile.stem
+    meta['sessionpath'] = c3dfile.parent
+    meta['subj_params'] = defaultdict(lambda: None, meta['subj_params'])
+    events = GaitEvents()
+    for frame, ev_type, context in header['events']:
+        events.append(GaitEvent(frame, ev_type, context))
+    meta['events'] = events
+    return meta
+
+
+def _get_marker_data(c3dfile, markers, ignore_missing=False):
+    """Get position data for specified markers.
+
+    See read_data.get_marker_data for details.
+    """
+    return c3d._marker_data_from_points(
+        _get_point_data(c3dfile), markers, ignore_missing=ignore_missing
+    )
+
+
+def _get_model_data(c3dfile, model):
+    """Read model output variables (e.g. Plug-in Gait).
+
+    See read_data.get_model_data for details.
+    """
+    return c3d._model_data_from_points(_get_point_data(c3dfile), model)
+
+
+def _get_analog_data(c3dfile, devname):
+    header, arrays = _get_store(c3dfile)
+    return c3d._select_analog_data(
+        header['analog_labels'],
+        header['analog_descriptions'],
+        arrays['analog'],
+        header['metadata']['analograte'],
+        devname,
+    )
+
+
+def _get_emg_data(c3dfile):
+    """Read EMG data from the store.
+
+    See read_data.get_emg_data() for details.
+    """
+    return _get_analog_data(c3dfile, 'EMG')
+
+
+def _get_accelerometer_data(c3dfile):
+    """Read accelerometer data from the store"""
+    return c3d._strip_accelerometer_prefix(_get_analog_data(c3dfile, 'Accelerometer'))
+
+
+def _get_forceplate_data(c3dfile):
+    """Read data of all forceplates from the store.
+
+    See read_data.get_forceplate_data() for details.
+    """
+    header, arrays = _get_store(c3dfile)
+    fpdata = list()
+    for k, eclipse_key in enumerate(header['forceplates']):
+        data = {field: arrays[f'fp{k}_{field}'] for field in FP_FIELDS}
+        data['eclipse_key'] = eclipse_key
+        fpdata.append(data)
+    return fpdata
+
+
+def get_analysis(c3dfile, condition='unknown'):
+    """Get ANALYSIS values from a c3d file.
+
+    The analysis values are not kept in the store, so this reads the c3d file.
+    See c3d.get_analysis() for details.
+    """
+    return c3d.get_analysis(c3dfile, condition=condition)
@@ -0,0 +1,412 @@
+# -*- coding: utf-8 -*-
+"""
+Catalog of sessions and trials across a data root.
+
+The catalog crawls a directory tree for session directories (directories that
+contain trial .enf files) and stores the session and trial information into a
+SQLite database: session dates, patient codes, patient info, Eclipse keys of
+the trials and c3d availability. The catalog can then be queried for e.g.
+all tagged dynamic c3d files of patients of a given age, without scanning the
+filesystem.
+
+The catalog is updated incrementally: a session is re-indexed only if any of
+its trial, c3d or patient info files has been added, removed or modified since
+the last update. Reading the Eclipse keys goes through the session .enf index
+(see eclipse._EnfIndex), if enabled.
+
+Example:
+
+    cat = SessionCatalog('Z:/catalog.sqlite')
+    cat.update('Z:/Userdata_Vicon_Server')
+    c3ds = cat.get_c3ds(tags=['E1'], trial_type='dynamic', age=(6, 10),
+                        since='2020-01-01')
+
+@author: Jussi (jnu@iki.fi)
+"""
+
+import datetime
+import fnmatch
+import json
+import logging
+import os
+from pathlib import Path
+import sqlite3
+
+from ulstools.num import age_from_hetu
+
+from . import sessionutils
+from .eclipse import get_eclipse_keys, _get_enf_index
+from .config import cfg
+from .envutils import GaitDataError
+
+logger = logging.getLogger(__name__)
+
+# increment this if the database schema changes
+CATALOG_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    name TEXT NOT NULL,
+    date TEXT,
+    patient_code TEXT,
+    description TEXT,
+    fullname TEXT,
+    hetu TEXT,
+    session_description TEXT,
+    age INTEGER,
+    stamp TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS trials (
+    id INTEGER PRIMARY KEY,
+    session_id INTEGER NOT NULL REFERENCES sessions(id) ON DELETE CASCADE,
+    enf TEXT NOT NULL,
+    trial_type TEXT,
+    eclipse_keys TEXT NOT NULL,
+    has_c3d INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_date ON sessions(date);
+CREATE INDEX IF NOT EXISTS sessions_age ON sessions(age);
+CREATE INDEX IF NOT EXISTS sessions_patient ON sessions(patient_code);
+CREATE INDEX IF NOT EXISTS trials_session ON trials(session_id);
+"""
+
+# files that determine the catalog entry of a session
+_ENF_PATTERN = '*Trial*.enf'
+_STAMP_PATTERNS = [_ENF_PATTERN, '*.c3d', '*.x1d', 'patient_info.json']
+
+
+def _iso_date(d):
+    """Convert a date, datetime or 'YYYY-MM-DD' string into an ISO date string"""
+    if d is None or isinstance(d, str):
+        return d
+    elif isinstance(d, datetime.datetime):
+        return d.date().isoformat()
+    elif isinstance(d, datetime.date):
+        return d.isoformat()
+    else:
+        raise ValueError(f'invalid date: {d}')
+
+
+def _find_sessions(root):
+    """Find the session directories under root.
+
+    Yields tuples of (sessionpath, filenames, stamp), where filenames is the set
+    of files in the session directory and stamp is a JSON string of the sizes
+    and modification times of the files that are relevant for the catalog.
+    Session directories are not searched for further sessions.
+    """
+    dirs = [Path(os.path.abspath(root))]
+    while dirs:
+        dirpath = dirs.pop()
+        try:
+            with os.scandir(dirpath) as it:
+                entries = list(it)
+        except OSError as e:
+            logger.warning(f'cannot read directory {dirpath}: {e}')
+            continue
+        files = {e.name: e for e in entries if e.is_file()}
+        if any(fnmatch.fnmatch(name, _ENF_PATTERN) for name in files):
+            stamp = list()
+            for name in sorted(files):
+                if any(fnmatch.fnmatch(name, pat) for pat in _STAMP_PATTERNS):
+                    st = files[name].stat()
+                    stamp.append([name, st.st_size, st.st_mtime_ns])
+            yield dirpath, set(files), json.dumps(stamp)
+        else:
+            subdirs = [
+                Path(e.path) for e in entries if e.is_dir(follow_symlinks=False)
+            ]
+            dirs.extend(sorted(subdirs, reverse=True))
+
+
+def _session_record(sessionpath):
+    """Get the session level catalog fields for a session.
+
+    Returns a dict of the session table columns (except for id and stamp).
+    """
+    try:
+        date, code, desc = sessionutils._parse_name(sessionpath.name)
+    except ValueError:
+        code, desc = None, None
+        try:
+            date = sessionutils.get_session_date(sessionpath)
+        except GaitDataError:
+            logger.warning(f'cannot determine date for session {sessionpath}')
+            date = None
+    try:
+        info = sessionutils.load_info(sessionpath) or sessionutils.default_info()
+    except GaitDataError:
+        logger.warning(f'cannot load patient info for session {sessionpath}')
+        info = sessionutils.default_info()
+    age = None
+    if info['hetu'] and date is not None:
+        try:
+            age = age_from_hetu(info['hetu'], date.date())
+        except ValueError:
+            logger.warning(f'invalid hetu in patient info for session {sessionpath}')
+    return {
+        'path': str(sessionpath),
+        'name': sessionpath.name,
+        'date': _iso_date(date),
+        'patient_code': code,
+        'description': desc,
+        'fullname': info['fullname'],
+        'hetu': info['hetu'],
+        'session_description': info['session_description'],
+        'age': age,
+    }
+
+
+def _session_enf_keys(sessionpath):
+    """Get the Eclipse keys (including empty ones) of the session .enf files.
+
+    Files that cannot be read or parsed are skipped.
+    """
+    if cfg.eclipse.use_enf_index:
+        index = _get_enf_index(sessionpath)
+        enfs = [sessionpath / enf.name for enf in index.scan(_ENF_PATTERN)]
+        read_keys = index.get_eclipse_keys
+    else:
+        enfs = sessionutils._get_session_enfs(sessionpath)
+        read_keys = get_eclipse_keys
+    enf_keys = dict()
+    for enf in enfs:
+        try:
+            enf_keys[enf] = read_keys(enf, return_empty=True)
+        except (GaitDataError, OSError) as e:
+            logger.warning(f'skipping trial {enf}: {e}')
+    return enf_keys
+
+
+class SessionCatalog:
+    """SQLite catalog of sessions and trials.
+
+    Parameters
+    ----------
+    db_file : str | Path
+        The database file. It is created if it does not exist.
+    """
+
+    def __init__(self, db_file):
+        self.db_file = Path(db_file)
+        self._conn = sqlite3.connect(str(self.db_file))
+        self._conn.execute('PRAGMA foreign_keys = ON')
+        self._init_schema()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Close the database connection"""
+        self._conn.close()
+
+    def _init_schema(self):
+        """Create the tables, or recreate them if the schema has changed"""
+        with self._conn:
+            self._conn.executescript(_SCHEMA)
+            row = self._conn.execute(
+                "SELECT value FROM meta WHERE key = 'version'"
+            ).fetchone()
+            if row is not None and int(row[0]) != CATALOG_VERSION:
+                logger.info(f'catalog {self.db_file} is outdated, recreating it')
+                self._conn.executescript(
+                    'DROP TABLE trials; DROP TABLE sessions; DROP TABLE meta;'
+                )
+                self._conn.executescript(_SCHEMA)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('version', ?)",
+                (str(CATALOG_VERSION),),
+            )
+
+    def update(self, root):
+        """Crawl a data root and update the catalog.
+
+        Only new and changed sessions are indexed. Sessions under root that no
+        longer exist are removed from the catalog.
+
+        Parameters
+        ----------
+        root : str | Path
+            The root directory. It is searched recursively for sessions.
+
+        Returns
+        -------
+        int
+            Number of sessions that were (re)indexed.
+        """
+        root = Path(os.path.abspath(root))
+        stamps = dict(self._conn.execute('SELECT path, stamp FROM sessions'))
+        n_indexed = 0
+        found = set()
+        with self._conn:
+            for sessionpath, filenames, stamp in _find_sessions(root):
+                found.add(str(sessionpath))
+                if stamps.get(str(sessionpath)) != stamp:
+                    logger.debug(f'indexing {sessionpath}')
+                    try:
+                        self._index_session(sessionpath, filenames, stamp)
+                    except (GaitDataError, OSError) as e:
+                        logger.warning(f'cannot index session {sessionpath}: {e}')
+                        continue
+                    n_indexed += 1
+            for path in set(stamps) - found:
+                if Path(path) == root or root in Path(path).parents:
+                    logger.debug(f'removing {path} from catalog')
+                    self._conn.execute('DELETE FROM sessions WHERE path = ?', (path,))
+        return n_indexed
+
+    def _index_session(self, sessionpath, filenames, stamp):
+        """Write the catalog entries for a session.
+
+        The session data is read before anything is written, so that a failed
+        read does not leave partial entries.
+        """
+        rec = _session_record(sessionpath)
+        rec['stamp'] = stamp
+        enf_keys = _session_enf_keys(sessionpath)
+        self._conn.execute('DELETE FROM sessions WHERE path = ?', (rec['path'],))
+        cols = ', '.join(rec)
+        placeholders = ', '.join('?' * len(rec))
+        cur = self._conn.execute(
+            f'INSERT INTO sessions ({cols}) VALUES ({placeholders})',
+            tuple(rec.values()),
+        )
+        session_id = cur.lastrowid
+        trials = list()
+        for enf, keys in enf_keys.items():
+            c3d = sessionutils.enf_to_trialfile(enf, 'c3d')
+            trials.append(
+                (
+                    session_id,
+                    str(enf),
+                    keys.get('TYPE'),
+                    json.dumps(keys),
+                    c3d.name in filenames,
+                )
+            )
+        self._conn.executemany(
+            'INSERT INTO trials (session_id, enf, trial_type, eclipse_keys, has_c3d) '
+            'VALUES (?, ?, ?, ?, ?)',
+            trials,
+        )
+
+    @staticmethod
+    def _session_conditions(patient_code, hetu, age, since, until):
+        """Build the SQL conditions for the session level query arguments"""
+        conds, args = list(), list()
+        if patient_code is not None:
+            conds.append('sessions.patient_code = ?')
+            args.append(patient_code)
+        if hetu is not None:
+            conds.append('sessions.hetu = ?')
+            args.append(hetu)
+        if age is not None:
+            age_min, age_max = age
+            conds.append('sessions.age BETWEEN ? AND ?')
+            args.extend([age_min, age_max])
+        if since is not None:
+            conds.append('sessions.date >= ?')
+            args.append(_iso_date(since))
+        if until is not None:
+            conds.append('sessions.date <= ?')
+            args.append(_iso_date(until))
+        return conds, args
+
+    def get_sessions(
+        self, patient_code=None, hetu=None, age=None, since=None, until=None
+    ):
+        """Get cataloged sessions.
+
+        Parameters
+        ----------
+        patient_code : str, optional
+            The patient code (parsed from the session name).
+        hetu : str, optional
+            The patient hetu (from the session patient info).
+        age : tuple, optional
+            (min, max) age of the patient at the time of the session, inclusive.
+            Sessions with unknown patient age are excluded.
+        since : datetime.date | str, optional
+            Earliest session date. Strings must be in 'YYYY-MM-DD' format.
+        until : datetime.date | str, optional
+            Latest session date.
+
+        Returns
+        -------
+        list
+            Session paths, sorted by date.
+        """
+        conds, args = self._session_conditions(patient_code, hetu, age, since, until)
+        where = f"WHERE {' AND '.join(conds)}" if conds else ''
+        rows = self._conn.execute(
+            f'SELECT path FROM sessions {where} ORDER BY date, path', args
+        )
+        return [Path(row[0]) for row in rows]
+
+    def get_enfs(
+        self,
+        tags=None,
+        trial_type=None,
+        has_c3d=None,
+        patient_code=None,
+        hetu=None,
+        age=None,
+        since=None,
+        until=None,
+    ):
+        """Get cataloged trial .enf files.
+
+        Tags and trial type are matched as in sessionutils.get_enfs().
+        For the session level arguments, see get_sessions().
+
+        Parameters
+        ----------
+        tags : list, optional
+            List of Eclipse tags to filter for. An empty list or None disables
+            filtering by tags.
+        trial_type : str, optional
+            Trial type (Eclipse TYPE field), e.g. 'static' or 'dynamic'.
+        has_c3d : bool, optional
+            If True, return only trials that have a c3d file. If False, return
+            only trials without a c3d file.
+
+        Returns
+        -------
+        list
+            List of enf files.
+        """
+        conds, args = self._session_conditions(patient_code, hetu, age, since, until)
+        if has_c3d is not None:
+            conds.append('trials.has_c3d = ?')
+            args.append(bool(has_c3d))
+        where = f"WHERE {' AND '.join(conds)}" if conds else ''
+        rows = self._conn.execute(
+            'SELECT trials.enf, trials.eclipse_keys FROM trials '
+            'JOIN sessions ON trials.session_id = sessions.id '
+            f'{where} ORDER BY sessions.date, sessions.path, trials.enf',
+            args,
+        )
+        enf_keys = {Path(enf): json.loads(keys) for enf, keys in rows}
+        enfs = iter(enf_keys)
+        if trial_type is not None:
+            enfs = sessionutils._filter_by_type(enfs, trial_type, enf_keys)
+        if tags:
+            enfs = sessionutils._filter_by_tags(enfs, tags, enf_keys)
+        return list(enfs)
+
+    def get_c3ds(self, tags=None, trial_type=None, **kwargs):
+        """Get cataloged trial c3d files.
+
+        Similar to get_enfs(), but returns only trials that have a c3d file.
+        """
+        enfs = self.get_enfs(tags=tags, trial_type=trial_type, has_c3d=True, **kwargs)
+        return list(sessionutils._filter_to_c3ds(enfs))
@@ -8,16 +8,39 @@ Eclipse (database) hacks.
 """
 import logging
 import io
+import json
+import os
+from pathlib import Path
+import tempfile
+import threading
 import configobj
 from configobj import ConfigObj
 from collections import defaultdict
 
 from .numutils import _isint
 from .envutils import GaitDataError
+from .config import cfg
 
 logger = logging.getLogger(__name__)
 
 
+def _read_enf_text(fname_enf):
+    """Read an .enf file as text.
+
+    The file is read only once, also if it needs to be decoded as latin-1.
+    """
+    with io.open(fname_enf, 'rb') as f:
+        data = f.read()
+    # Eclipse switched from latin-1 to utf-8 at some point...
+    try:
+        text = data.decode('utf8')
+    except UnicodeDecodeError:
+        logger.warning(f'Cannot interpret {fname_enf} as utf-8, trying latin-1')
+        text = data.decode('latin-1')
+    # translate newlines, as reading in text mode would do
+    return text.replace('\r\n', '\n').replace('\r', '\n')
+
+
 class FileFilter:
     """Filter class for configobj.
 
@@ -30,22 +53,16 @@ class FileFilter:
 
     replace = {'\n=\n': '\n'}
 
-    def __init__(self, fname):
+    def __init__(self, fname, text=None):
         self.fname = fname
+        self.text = text
 
     def read(self):
         """Read data.
 
         ConfigObj seems to use only this method.
         """
-        # Eclipse switched from latin-1 to utf-8 at some point...
-        try:
-            self.fp = io.open(self.fname, encoding='utf8')
-            data = self.fp.read()
-        except UnicodeDecodeError:
-            logger.warning(f'Cannot interpret {self.fname} as utf-8, trying latin-1')
-            self.fp = io.open(self.fname, encoding='latin-1')
-            data = self.fp.read()
+        data = _read_enf_text(self.fname) if self.text is None else self.text
         # filter
         for val, newval in FileFilter.replace.items():
             data = data.replace(val, newval)
@@ -54,12 +71,15 @@ class FileFilter:
         return data
 
     def close(self):
-        self.fp.close()
+        pass
 
 
-def _enf_reader(fname_enf):
-    """Return enf reader (ConfigObj instance)."""
-    fp = FileFilter(fname_enf)
+def _enf_reader(fname_enf, text=None):
+    """Return enf reader (ConfigObj instance).
+
+    If text is given, it is used instead of reading the file.
+    """
+    fp = FileFilter(fname_enf, text=text)
     # do not listify comma-separated values
     # logger.debug('loading %s' % fname_enf)
     try:
@@ -71,6 +91,81 @@ def _enf_reader(fname_enf):
     return cp
 
 
+def _filtered_enf_lines(text):
+    """Yield the lines of .enf text, filtered as by FileFilter.
+
+    This is a lazy equivalent of the FileFilter string operations, followed
+    by the line splitting done by ConfigObj.
+    """
+    lines = text.split('\n')
+    last = len(lines) - 1
+    seen = set()
+    prev_removed = False
+    for k, line in enumerate(lines):
+        # emulate str.replace('\n=\n', '\n'); the matches cannot overlap, so
+        # only every other line of successive '=' lines is removed
+        if line == '=' and 0 < k < last and not prev_removed:
+            prev_removed = True
+            continue
+        prev_removed = False
+        # remove all duplicate lines
+        if line in seen:
+            continue
+        seen.add(line)
+        # ConfigObj uses str.splitlines(), which also splits at some other
+        # characters, and then strips newlines
+        for line_ in line.splitlines(True):
+            yield line_.rstrip('\r\n')
+
+
+def _parse_trial_info(text):
+    """Parse the TRIAL_INFO section of .enf text.
+
+    A fast alternative to parsing the whole file with ConfigObj. It uses the
+    ConfigObj syntax, but stops after the TRIAL_INFO section. Returns None if
+    the text has constructs that this parser does not handle (e.g. multiline
+    values or nested sections); ConfigObj should be used for those.
+    """
+    trial_info = None
+    for line in _filtered_enf_lines(text):
+        sline = line.strip()
+        if not sline or sline.startswith('#'):
+            continue
+        mat = ConfigObj._sectionmarker.match(line)
+        if mat is not None:
+            _, sect_open, sect_name, sect_close, _ = mat.groups()
+            if sect_open.count('[') != 1 or sect_close.count(']') != 1:
+                return None
+            if trial_info is not None:
+                break  # done with TRIAL_INFO
+            if sect_name[0] == sect_name[-1] and sect_name[0] in ('"', "'"):
+                sect_name = sect_name[1:-1]
+            if sect_name == 'TRIAL_INFO':
+                trial_info = dict()
+            continue
+        if trial_info is None:
+            continue
+        mat = ConfigObj._keyword.match(line)
+        if mat is None:
+            return None
+        _, key, value = mat.groups()
+        if value[:3] in ['"""', "'''"]:
+            return None
+        mat = ConfigObj._nolistvalue.match(value)
+        if mat is None:
+            return None
+        value = mat.group(1)  # strip inline comments, but no unquoting
+        if key[0] == key[-1] and key[0] in ('"', "'"):
+            key = key[1:-1]
+        # duplicate keys are errors, and % may trigger value interpolation
+        if key in trial_info or '%' in value:
+            return None
+        trial_info[key] = value
+    if trial_info is None:
+        raise GaitDataError('No trial info in .enf file')
+    return trial_info
+
+
 def get_eclipse_keys(fname_enf, return_empty=False):
     """Read key/value pairs from enf file.
 
@@ -89,13 +184,176 @@ def get_eclipse_keys(fname_enf, return_empty=False):
         Dict of the eclipse keys and values.
     """
     di = defaultdict(lambda: '')
-    cp = _enf_reader(fname_enf)
+    text = _read_enf_text(fname_enf)
+    trial_info = _parse_trial_info(text)
+    if trial_info is None:
+        trial_info = _enf_reader(fname_enf, text=text)['TRIAL_INFO']
     di.update(
-        {key: val for key, val in cp['TRIAL_INFO'].items() if val != '' or return_empty}
+        {key: val for key, val in trial_info.items() if val != '' or return_empty}
     )
     return di
 
 
+class _EnfIndex:
+    """Index of the Eclipse keys of the .enf files in a session directory.
+
+    The TRIAL_INFO keys of each .enf file are stored along with the file
+    size and mtime into a JSON file in the session directory. An .enf file is
+    parsed only if it is not in the index, or if it has changed since it was
+    indexed. This avoids repeated parsing of the same files, which is slow
+    especially on network drives.
+    """
+
+    INDEX_FILENAME = '.gaitutils_enf_index.json'
+    INDEX_VERSION = 1
+
+    def __init__(self, sessionpath):
+        self.sessionpath = Path(sessionpath)
+        self.fname = self.sessionpath / self.INDEX_FILENAME
+        self._entries = dict()
+        self._dirty = False
+        self._lock = threading.RLock()
+        self._load()
+
+    def _load(self):
+        if not self.fname.is_file():
+            return
+        try:
+            with io.open(self.fname, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            logger.warning(f'cannot read .enf index {self.fname}')
+            return
+        if index.get('version') == self.INDEX_VERSION:
+            self._entries = index['enfs']
+
+    def save(self):
+        """Write the index, if it has changed"""
+        with self._lock:
+            if not self._dirty:
+                return
+            index = {'version': self.INDEX_VERSION, 'enfs': self._entries}
+            # several processes may write the index of the same session, so
+            # each writer needs its own temporary file
+            fname_tmp = None
+            try:
+                with tempfile.NamedTemporaryFile(
+                    'w',
+                    encoding='utf-8',
+                    dir=self.sessionpath,
+                    prefix=self.INDEX_FILENAME,
+                    suffix='.tmp',
+                    delete=False,
+                ) as f:
+                    fname_tmp = f.name
+                    json.dump(index, f, ensure_ascii=False)
+                os.replace(fname_tmp, self.fname)
+            except OSError as e:
+                # e.g. a read-only session directory; the index is optional
+                logger.warning(f'cannot write .enf index {self.fname}: {e}')
+                if fname_tmp is not None and os.path.isfile(fname_tmp):
+                    os.remove(fname_tmp)
+            self._dirty = False
+
+    def _get_entry(self, fname_enf, stat=None):
+        """Get the index entry for an .enf file, (re)parsing it if needed.
+
+        If the file cannot be parsed, the entry records the error instead of
+        the keys, so that the file is parsed again only if it changes.
+        """
+        fname_enf = Path(fname_enf)
+        if stat is None:
+            stat = fname_enf.stat()
+        stamp = [stat.st_size, stat.st_mtime_ns]
+        with self._lock:
+            entry = self._entries.get(fname_enf.name)
+            if entry is None or entry['stamp'] != stamp:
+                try:
+                    keys = dict(get_eclipse_keys(fname_enf, return_empty=True))
+                    entry = {'stamp': stamp, 'keys': keys}
+                except GaitDataError as e:
+                    entry = {'stamp': stamp, 'keys': None, 'error': str(e)}
+                self._entries[fname_enf.name] = entry
+                self._dirty = True
+            return entry
+
+    def invalidate(self, fname_enf):
+        """Remove an .enf file from the index"""
+        with self._lock:
+            if self._entries.pop(Path(fname_enf).name, None) is not None:
+                self._dirty = True
+
+    def get_eclipse_keys(self, fname_enf, return_empty=False, stat=None):
+        """Get Eclipse keys for an .enf file in the session.
+
+        See get_eclipse_keys() for details.
+        """
+        entry = self._get_entry(fname_enf, stat=stat)
+        keys = entry['keys']
+        if keys is None:
+            raise GaitDataError(entry['error'])
+        di = defaultdict(lambda: '')
+        di.update({key: val for key, val in keys.items() if val != '' or return_empty})
+        return di
+
+    def scan(self, pattern='*Trial*.enf'):
+        """Index all .enf files in the session.
+
+        Entries for files that no longer exist are removed. Returns a dict of
+        Eclipse keys (including empty ones) keyed by .enf path. Files that
+        cannot be read or parsed are logged and have no keys.
+        """
+        enf_stats = dict()
+        for fn in sorted(self.sessionpath.glob(pattern)):
+            try:
+                if fn.is_file():
+                    enf_stats[fn] = fn.stat()
+            except OSError:  # e.g. deleted after the glob
+                pass
+        with self._lock:
+            for name in set(self._entries) - set(fn.name for fn in enf_stats):
+                del self._entries[name]
+                self._dirty = True
+            keys = dict()
+            for fn, st in enf_stats.items():
+                try:
+                    keys[fn] = self.get_eclipse_keys(fn, return_empty=True, stat=st)
+                except (GaitDataError, OSError) as e:
+                    logger.warning(f'cannot read Eclipse keys from {fn}: {e}')
+                    keys[fn] = defaultdict(lambda: '')
+        self.save()
+        return keys
+
+
+_enf_indexes = dict()
+_enf_indexes_lock = threading.Lock()
+
+
+def _get_enf_index(sessionpath):
+    """Get the (in-memory) .enf index instance for a session"""
+    # abspath() instead of resolve(), since resolving paths can be slow on
+    # network drives
+    sessionpath = Path(os.path.abspath(sessionpath))
+    with _enf_indexes_lock:
+        if sessionpath not in _enf_indexes:
+            _enf_indexes[sessionpath] = _EnfIndex(sessionpath)
+        return _enf_indexes[sessionpath]
+
+
+def _get_eclipse_keys_indexed(fname_enf, return_empty=False):
+    """Read key/value pairs from enf file, using the session .enf index.
+
+    Falls back to parsing the file if the index is disabled in the config.
+    See get_eclipse_keys() for details.
+    """
+    if not cfg.eclipse.use_enf_index:
+        return get_eclipse_keys(fname_enf, return_empty=return_empty)
+    index = _get_enf_index(Path(fname_enf).parent)
+    keys = index.get_eclipse_keys(fname_enf, return_empty=return_empty)
+    index.save()
+    return keys
+
+
 def _eclipse_forceplate_keys(eclipse_keys):
     """Filter that returns Eclipse forceplate keys/values as a dict."""
     return {
@@ -133,5 +391,10 @@ def set_eclipse_keys(fname_enf, eclipse_dict, update_existing=False):
         outu = [str(line, encoding='utf8') + '\n' for line in out]
         with io.open(fname_enf, 'w', encoding='utf8') as fp:
             fp.writelines(outu)
+        # the file may be rewritten within the mtime resolution of the
+        # filesystem, so do not rely on the stat check of the index
+        sessionpath = Path(os.path.abspath(Path(fname_enf).parent))
+        if sessionpath in _enf_indexes:
+            _enf_indexes[sessionpath].invalidate(fname_enf)
     else:
         logger.debug('did not set any keys')
@@ -38,8 +38,11 @@ class EMG:
         else:
             self.sessionpath = None
             self.trialname = None
+        self._processed = dict()
         self.passband = cfg.emg.passband
         self._data = None
+        self._chdata = None
+        self._ch_index = None
         self.t = None
         self.sfrate = None
         self.correction_factor = correction_factor
@@ -56,6 +59,19 @@ class EMG:
         """
         nexus._check_nexus_trial_identity(self.sessionpath, self.trialname)
 
+    @property
+    def passband(self):
+        """The EMG passband (f1, f2), or None for no filtering.
+
+        Setting the passband discards previously processed data.
+        """
+        return self._passband
+
+    @passband.setter
+    def passband(self, passband):
+        self._passband = passband
+        self._processed.clear()
+
     @property
     def data(self):
         """Get the EMG data.
@@ -67,7 +83,8 @@ class EMG:
         -------
         dict
             The EMG data, keyed by channel name. Values are shape (N,) ndarrays
-            of sample values.
+            of sample values. They are read-only views into a single
+            (n_channels, N) array.
         """
         if self._data is None:
             if self._source_is_nexus:
@@ -81,8 +98,36 @@ class EMG:
         logger.debug(f"reading EMG from {meta['trialname']}")
         self.sfrate = meta['analograte']
         emgdi = read_data.get_emg_data(self.source)
-        self._data = emgdi['data']
         self.t = emgdi['t']
+        # store all channels in a contiguous array, so that they can be
+        # processed in a single vectorized call
+        chnames = list(emgdi['data'])
+        if chnames:
+            self._chdata = np.stack([emgdi['data'][ch] for ch in chnames])
+        else:
+            self._chdata = np.zeros((0, len(self.t)))
+        self._chdata.flags.writeable = False
+        self._ch_index = {ch: ind for ind, ch in enumerate(chnames)}
+        self._data = {ch: self._chdata[ind] for ch, ind in self._ch_index.items()}
+
+    def _get_processed_data(self, envelope):
+        """Return data of all channels processed as in get_channel_data().
+
+        The processing is done for all channels at once and the result is
+        cached. Returns a read-only (n_channels, N) array, indexed as
+        self._chdata.
+        """
+        key = self._processing_key(envelope)
+        if key not in self._processed:
+            data = self._chdata
+            if envelope:
+                data = numutils.envelope(data, self.sfrate, axis=1)
+            elif self.passband:  # no filtering for RMS data
+                data = numutils._filtfilt(data, self.passband, self.sfrate, axis=1)
+            data = data * self.correction_factor
+            data.flags.writeable = False
+            self._processed[key] = data
+        return self._processed[key]
 
     def _edf_export(self, filename):
         """Export the EMG data to EDF format.
@@ -158,7 +203,9 @@ class EMG:
         'Voltage.LGas8_filtered' would be matches, and the former would be
         returned.
 
-        Data is returned filtered if self.passband is set.
+        Data is returned filtered if self.passband is set. All channels are
+        processed at once and the result is cached, so repeated calls are cheap.
+        The returned array is a read-only view.
 
         Parameters
         ----------
@@ -174,15 +221,21 @@ class EMG:
             The data, shape (N,).
         """
         ch = self._match_name(chname)
-        data = self.data[ch]
+        return self._get_processed_data(envelope)[self._ch_index[ch]]
+
+    def _processing_key(self, envelope):
+        """Return a hashable description of the processing applied by
+        get_channel_data(), to be used as a cache key"""
+        passband = tuple(self.passband) if self.passband else None
         if envelope:
-            data = numutils.envelope(data, self.sfrate)
-        elif self.passband:  # no filtering for RMS data
-            # filtered data is currently not cached; _filtfilt() call typically
-            # takes less than 1 ms, so this should not be a problem, unless a
-            # huge number of calls are made
-            data = numutils._filtfilt(data, self.passband, self.sfrate)
-        return data * self.correction_factor
+            env_params = (
+                cfg.emg.envelope_method,
+                cfg.emg.linear_envelope_lowpass,
+                cfg.emg.rms_win,
+            )
+        else:
+            env_params = None
+        return bool(envelope), passband, env_params, self.correction_factor
 
     def has_channel(self, chname):
         """Check whether a channel exists in the data.
@@ -17,7 +17,9 @@ import hashlib
 import os
 import tempfile
 from pathlib import Path
-from functools import lru_cache
+from functools import update_wrapper
+from collections import OrderedDict, namedtuple
+import threading
 
 from .gui._windows import error_exit
 
@@ -119,37 +121,179 @@ def _register_gui_exception_handler(full_traceback=False):
         sys.excepthook = _my_excepthook
 
 
-def lru_cache_checkfile(fun):
+CacheInfo = namedtuple(
+    'CacheInfo', ['hits', 'misses', 'evictions', 'invalidations', 'entries', 'nbytes']
+)
+
+
+class FileCache:
+    """A memory-bounded LRU cache for results computed from files.
+
+    Cached results are validated against the (path, size, mtime_ns) stamp of the
+    file, so a cache lookup costs a single stat() call. If check_digest is True,
+    the md5 digest of the file contents is also included in the stamp. This is
+    slower, since the whole file needs to be read on every lookup, but detects
+    changes that do not affect the size or modification time (e.g. on
+    filesystems with coarse timestamps).
+
+    The cache is bounded by the total estimated size of the stored results in
+    bytes. Least recently used entries are evicted when the budget is exceeded.
+    A result larger than the whole budget is returned but not stored.
+
+    Parameters
+    ----------
+    fun : function
+        A function that takes a filename as its only argument.
+    max_bytes : int | None
+        Memory budget for the cache. If None, the cache is unbounded. If 0,
+        nothing is cached.
+    check_digest : bool
+        Whether to validate entries by file digest in addition to file stats.
+    sizeof : function | None
+        Function that takes (filename, result) and returns the estimated size
+        of the result in bytes. By default, the size of the file on disk is
+        used.
+    """
+
+    def __init__(self, fun, max_bytes=None, check_digest=False, sizeof=None):
+        self.fun = fun
+        self.max_bytes = max_bytes
+        self.check_digest = check_digest
+        self.sizeof = sizeof
+        self._entries = OrderedDict()  # key -> (stamp, result, nbytes)
+        self._nbytes = 0
+        self._hits = self._misses = self._evictions = self._invalidations = 0
+        self._lock = threading.RLock()
+        update_wrapper(self, fun)
+
+    @staticmethod
+    def _key(filename):
+        return str(Path(filename).resolve())
+
+    def _stamp(self, filename):
+        st = os.stat(filename)
+        stamp = (st.st_size, st.st_mtime_ns)
+        if self.check_digest:
+            with open(filename, 'rb') as f:
+                stamp += (hashlib.md5(f.read()).hexdigest(),)
+        return stamp
+
+    def __call__(self, filename):
+        key = self._key(filename)
+        stamp = self._stamp(filename)
+        with self._lock:
+            if key in self._entries:
+                cached_stamp, result, _ = self._entries[key]
+                if cached_stamp == stamp:
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return result
+                # file has changed since it was cached
+                self._remove(key)
+                self._invalidations += 1
+            self._misses += 1
+        result = self.fun(filename)
+        nbytes = (
+            self.sizeof(filename, result) if self.sizeof is not None else stamp[0]
+        )
+        with self._lock:
+            if self.max_bytes is not None and nbytes > self.max_bytes:
+                logger.debug(f'{filename} exceeds cache size, not caching')
+                return result
+            if key in self._entries:  # may have been cached by another thread
+                self._remove(key)
+            self._entries[key] = (stamp, result, nbytes)
+            self._nbytes += nbytes
+            self._evict()
+        return result
+
+    def _remove(self, key):
+        _, _, nbytes = self._entries.pop(key)
+        self._nbytes -= nbytes
+
+    def _evict(self):
+        """Drop least recently used entries until we are within budget"""
+        if self.max_bytes is None:
+            return
+        while self._nbytes > self.max_bytes and self._entries:
+            key = next(iter(self._entries))
+            logger.debug(f'evicting {key} from cache')
+            self._remove(key)
+            self._evictions += 1
+
+    def resize(self, max_bytes):
+        """Change the memory budget, evicting entries if necessary"""
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def cache_invalidate(self, filename):
+        """Remove a file from the cache. Return True if it was cached."""
+        key = self._key(filename)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+                self._invalidations += 1
+                return True
+            return False
+
+    def cache_clear(self):
+        """Remove all entries and reset the statistics"""
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+            self._hits = self._misses = self._evictions = self._invalidations = 0
+
+    def cache_info(self):
+        """Return cache statistics as a CacheInfo namedtuple"""
+        with self._lock:
+            return CacheInfo(
+                self._hits,
+                self._misses,
+                self._evictions,
+                self._invalidations,
+                len(self._entries),
+                self._nbytes,
+            )
+
+
+def lru_cache_checkfile(fun=None, *, max_bytes=None, check_digest=False, sizeof=None):
     """Cache function results, unless the argument file has changed.
 
     A lru_cache -style decorator for functions that take a file name argument.
     Makes sense for functions that read a file and take a long time to process
-    the data (anything that takes significantly longer than the md5 digest).
-    Works by computing the md5 digest for the input file and passing that on to
-    lru_cache, so the cache is invalidated if file contents have changed.
+    the data. The cache is invalidated if the file size or modification time
+    (or optionally, the contents) have changed. See FileCache for details.
+
+    Can be used either as @lru_cache_checkfile or with keyword arguments, e.g.
+    @lru_cache_checkfile(max_bytes=2**30).
 
     Parameters
     ----------
     fun : function
         The function to cache.
+    max_bytes : int | None
+        Memory budget for the cache in bytes. None for unbounded.
+    check_digest : bool
+        Whether to also validate cached results by md5 digest of the file.
+    sizeof : function | None
+        Function of (filename, result) that estimates the size of a result in
+        bytes. Default is the file size.
 
     Returns
     -------
-    function
+    FileCache
         The cached function.
     """
 
-    @lru_cache()
-    def cached_fun(filename, md5sum):
-        return fun(filename)
-
-    def wrapper(filename):
-        with open(filename, 'rb') as f:
-            data = f.read()
-        md5sum = hashlib.md5(data).hexdigest()
-        return cached_fun(filename, md5sum)
+    def decorator(fun):
+        return FileCache(
+            fun, max_bytes=max_bytes, check_digest=check_digest, sizeof=sizeof
+        )
 
-    return wrapper
+    if fun is None:
+        return decorator
+    return decorator(fun)
 
 
 def _named_tempfile(suffix=None):
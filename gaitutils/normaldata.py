@@ -12,6 +12,7 @@ from pathlib import Path
 import json
 import io
 import logging
+import os
 
 from .config import cfg
 from .envutils import GaitDataError
@@ -47,6 +48,31 @@ def _read_configured_model_normaldata(age=None):
     return model_normaldata
 
 
+def _normaldata_files():
+    """Return all normal data files referred to by the config"""
+    files = cfg.general.normaldata_files
+    files = list(files) if isinstance(files, list) else [files]
+    files.extend(cfg.general.normaldata_age.values())
+    files.extend([cfg.general.timedist_normaldata, cfg.emg.normaldata_file])
+    return [fn for fn in files if fn]
+
+
+def _normaldata_version():
+    """Return the version of the configured normal data.
+
+    The version is a list of [filename, size, mtime_ns] for the normal data
+    files. It changes whenever any of the files is modified.
+    """
+    version = list()
+    for fn in _normaldata_files():
+        try:
+            st = os.stat(fn)
+        except OSError:
+            continue
+        version.append([str(fn), st.st_size, st.st_mtime_ns])
+    return version
+
+
 def _read_session_normaldata(session):
     """Read model normal data according to patient in given session.
 
@@ -8,6 +8,7 @@ Misc numerical utils
 """
 
 
+from functools import lru_cache
 import logging
 import numpy as np
 import hashlib
@@ -161,10 +162,19 @@ def outliers(x, axis=0, single_mad=None, p_threshold=1e-3):
     tuple
         Indexes of rejected values (np.where output)
     """
+    return np.where(outlier_mask(x, axis=axis, single_mad=single_mad, p_threshold=p_threshold))
+
+
+def outlier_mask(x, axis=0, single_mad=None, p_threshold=1e-3):
+    """Robustly detect outliers assuming a normal distribution.
+
+    As outliers(), but returns a boolean mask of the same shape as the data,
+    with True for outliers.
+    """
     zs = modified_zscore(x, axis=axis, single_mad=single_mad)
     z_threshold = np.sqrt(2) * erfcinv(p_threshold)
     logger.debug(f'Z threshold: {z_threshold:.2f}')
-    return np.where(abs(zs) > z_threshold)
+    return abs(zs) > z_threshold
 
 
 def _files_digest(files):
@@ -423,6 +433,23 @@ def _linear_envelope(data, sfrate, axis=None):
     return _filtfilt(data_rect, [0, cfg.emg.linear_envelope_lowpass], sfrate, axis=axis)
 
 
+@lru_cache(maxsize=64)
+def _butter_sos(buttord, passband, sfrate):
+    """Design a Butterworth filter for _filtfilt().
+
+    The filter is returned in second-order sections form, which is numerically
+    more robust than the (b, a) form for high orders and low normalized cutoff
+    frequencies. The designs are cached, so repeated filtering with the same
+    parameters does not redesign the filter. passband must be hashable, e.g. a
+    tuple.
+    """
+    passbandn = 2 * np.array(passband) / sfrate
+    if passbandn[0] > 0:  # bandpass
+        return signal.butter(buttord, passbandn, 'bandpass', output='sos')
+    else:  # lowpass
+        return signal.butter(buttord, passbandn[1], output='sos')
+
+
 def _filtfilt(data, passband, sfrate, buttord=5, axis=None):
     """Forward-backward filter.
     Filter data into given passband, e.g. [1, 40].
@@ -430,15 +457,11 @@ def _filtfilt(data, passband, sfrate, buttord=5, axis=None):
     Implemented as pure lowpass, if highpass freq = 0.
     """
     if axis is None:
-        axis = -1  # filtfilt() default
+        axis = -1  # sosfiltfilt() default
     if passband is None:
         return data
-    passbandn = 2 * np.array(passband) / sfrate
-    if passbandn[0] > 0:  # bandpass
-        b, a = signal.butter(buttord, passbandn, 'bandpass')
-    else:  # lowpass
-        b, a = signal.butter(buttord, passbandn[1])
-    return signal.filtfilt(b, a, data, axis=axis)
+    sos = _butter_sos(buttord, tuple(passband), sfrate)
+    return signal.sosfiltfilt(sos, data, axis=axis)
 
 
 def _get_local_max(data):
@@ -460,3 +483,61 @@ def _get_local_min(data):
         return np.nan, np.nan
     else:
         return ind, -val
+
+
+def _get_local_max_2d(data, start=None, stop=None):
+    """Get local maximum (peak) of each row of 2-D data.
+
+    Vectorized version of _get_local_max(). Gives the same results as calling
+    _get_local_max(data[k, start[k]:stop[k]]) for each row k, including the
+    handling of flat peaks.
+
+    Parameters
+    ----------
+    data : ndarray
+        The data, shape (N, T).
+    start : ndarray, optional
+        Shape (N,) array of segment start indices for each row. Default is 0.
+    stop : ndarray, optional
+        Shape (N,) array of segment stop indices for each row. Default is T.
+
+    Returns
+    -------
+    tuple
+        Tuple of (inds, vals) of shape (N,) ndarrays. The indices refer to the
+        full rows, not the segments. Rows without a peak yield nan values.
+    """
+    data = np.asarray(data, dtype=float)
+    nrows, npts = data.shape
+    start = np.zeros((nrows, 1), dtype=int) if start is None else np.reshape(start, (-1, 1))
+    stop = np.full((nrows, 1), npts) if stop is None else np.reshape(stop, (-1, 1))
+    inds = np.arange(npts)
+    # find the last index of the run of equal values (a possible flat peak)
+    # that each sample belongs to; runs are also cut at the end of the segment
+    is_run_end = np.ones(data.shape, dtype=bool)
+    is_run_end[:, :-1] = data[:, 1:] != data[:, :-1]
+    is_run_end |= inds == stop - 1
+    run_end = np.where(is_run_end, inds, npts)
+    run_end = np.minimum.accumulate(run_end[:, ::-1], axis=1)[:, ::-1]
+    # a peak is a rising edge followed by a falling edge after the run
+    rising = np.zeros(data.shape, dtype=bool)
+    rising[:, 1:] = data[:, :-1] < data[:, 1:]
+    after_run = np.take_along_axis(data, np.minimum(run_end + 1, npts - 1), axis=1)
+    is_peak = rising & (after_run < data) & (inds > start) & (run_end <= stop - 2)
+    # select the highest peak (the first one, if several)
+    best = np.where(is_peak, data, -np.inf).argmax(axis=1)
+    has_peak = is_peak.any(axis=1)
+    rows = np.arange(nrows)
+    # for flat peaks, the middle index is returned, as in signal.find_peaks()
+    peak_inds = np.where(has_peak, (best + run_end[rows, best]) // 2, np.nan)
+    peak_vals = np.where(has_peak, data[rows, best], np.nan)
+    return peak_inds, peak_vals
+
+
+def _get_local_min_2d(data, start=None, stop=None):
+    """Get local minimum (peak) of each row of 2-D data.
+
+    See _get_local_max_2d() for details.
+    """
+    inds, vals = _get_local_max_2d(-np.asarray(data), start=start, stop=stop)
+    return inds, -vals
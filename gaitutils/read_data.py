@@ -11,7 +11,7 @@ from collections import defaultdict
 import numpy as np
 import logging
 
-from . import nexus, c3d
+from . import nexus, c3d, c3dstore, utils
 from .config import cfg
 
 
@@ -23,7 +23,8 @@ def _reader_module(source):
     if nexus._is_vicon_instance(source):
         return nexus
     elif c3d._is_c3d_file(source):
-        return c3d
+        # the store decodes the c3d file once and memory-maps it afterwards
+        return c3dstore if cfg.general.use_c3d_store else c3d
     else:
         raise RuntimeError(f'Unknown type for data source {source}')
 
@@ -131,13 +132,16 @@ def get_marker_data(source, markers, ignore_missing=False):
     -------
     dict
         Marker data dict. Keys are marker names and values are Nx3 ndarrays of
-        x,y,z data.
+        x,y,z data. For c3d sources, the arrays are read-only views into cached
+        data and must be copied before modifying them. The dict caches averaged
+        marker data computed by utils.avg_markerdata().
     """
-    return _reader_module(source)._get_marker_data(
+    mkrdata = _reader_module(source)._get_marker_data(
         source,
         markers,
         ignore_missing=ignore_missing,
     )
+    return utils._MarkerData(mkrdata)
 
 
 def get_emg_data(source):
@@ -217,13 +221,14 @@ def get_model_data(source, model):
     -------
     dict
         The model data. Keys are model variable names and values are ndarrays of
-        data.
+        data. For c3d sources, the arrays may be read-only views into cached
+        data and must be copied before modifying them.
     """
     modeldata = _reader_module(source)._get_model_data(source, model)
     for var in model.read_vars:
         # convert Moment variables into SI units
         if var.find('Moment') > 0:
-            modeldata[var] /= 1.0e3  # Nmm -> Nm
+            modeldata[var] = modeldata[var] / 1.0e3  # Nmm -> Nm
         # split 3D arrays into x,y,z variables
         if model.read_strategy == 'split_xyz':
             if modeldata[var].shape[0] == 3:
@@ -251,5 +256,5 @@ def get_model_data(source, model):
                     tibt /= np.pi / 180
                 if np.abs(tibt) > 1e-2:  # do not add insignificant values
                     logger.info(f'adding {ctxt} tibial torsion: {tibt:g} deg')
-                    modeldata[var_knee] += tibt
+                    modeldata[var_knee] = modeldata[var_knee] + tibt
     return modeldata
@@ -1,3 +1,4 @@
+from . import batch
 from . import pdf
 from . import text
 from . import web
@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+"""
+Create single-session pdf reports for many sessions without the GUI.
+
+The reports are created in parallel worker processes. The results are written
+into a JSON manifest, which records the status, the timing and a digest of the
+inputs of each report. On subsequent runs, sessions whose inputs (trial files,
+patient info, configuration and normal data) have not changed since the last
+successful run are skipped.
+
+Example (from the command line):
+
+    gaitutils_batch_report "Z:/Userdata_Vicon_Server/*/20*" -j 4
+
+@author: Jussi (jnu@iki.fi)
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import datetime
+import glob
+import hashlib
+import io
+import json
+import logging
+import os
+from pathlib import Path
+import time
+import traceback
+
+from configdot import dump_config
+
+from .. import sessionutils, normaldata
+from ..config import cfg
+from . import pdf
+
+logger = logging.getLogger(__name__)
+
+# increment this if the manifest format changes
+MANIFEST_VERSION = 1
+MANIFEST_FILENAME = 'gaitutils_batch_report.json'
+# session files that affect the report
+_SESSION_INPUT_PATTERNS = [
+    '*Trial*.enf',
+    '*.c3d',
+    'patient_info.json',
+    'quirks.json',
+]
+
+
+def _expand_sessions(patterns):
+    """Expand session paths or glob patterns into a list of session dirs"""
+    sessions = list()
+    for pattern in patterns:
+        # glob is needed, since Windows shells do not expand wildcards
+        matches = sorted(glob.glob(str(pattern))) or [pattern]
+        for match in matches:
+            match = Path(match)
+            if match.is_dir():
+                sessions.append(match)
+            else:
+                logger.warning(f'{match} is not a directory, skipping')
+    return list(dict.fromkeys(sessions))  # remove duplicates, keep order
+
+
+def _file_stamps(files):
+    """Return a list of [filename, size, mtime_ns] for existing files"""
+    stamps = list()
+    for fn in files:
+        try:
+            st = os.stat(fn)
+        except OSError:
+            continue
+        stamps.append([str(fn), st.st_size, st.st_mtime_ns])
+    return stamps
+
+
+def _config_digest():
+    """Digest of the config and the normal data files.
+
+    Any change to these (potentially) affects all reports.
+    """
+    h = hashlib.md5(dump_config(cfg).encode('utf-8'))
+    h.update(json.dumps(normaldata._normaldata_version()).encode('utf-8'))
+    return h.hexdigest()
+
+
+def _session_digest(sessionpath, config_digest):
+    """Digest of the report inputs for a session"""
+    files = sorted(
+        fn for pattern in _SESSION_INPUT_PATTERNS for fn in sessionpath.glob(pattern)
+    )
+    h = hashlib.md5(config_digest.encode('utf-8'))
+    h.update(json.dumps(_file_stamps(files)).encode('utf-8'))
+    return h.hexdigest()
+
+
+def _report_path(sessionpath, destdir):
+    """The pdf file that create_report() writes for a session"""
+    return (destdir or sessionpath) / f'{sessionpath.name}.pdf'
+
+
+def _create_report_worker(sessionpath, destdir):
+    """Create the report for a session.
+
+    This is run in a worker process. Exceptions are not propagated to the main
+    process, but reported in the result dict.
+    """
+    t0 = time.perf_counter()
+    try:
+        info = sessionutils.load_info(sessionpath) or sessionutils.default_info()
+        msg = pdf.create_report(
+            sessionpath,
+            info=info,
+            destdir=destdir,
+            write_timedist=True,
+            write_extracted=True,
+        )
+        status = 'ok'
+    except Exception as e:
+        msg = f'{type(e).__name__}: {e}'
+        logger.debug(traceback.format_exc())
+        status = 'failed'
+    return {
+        'status': status,
+        'message': msg,
+        'time': time.perf_counter() - t0,
+    }
+
+
+def _load_manifest(fn):
+    """Load a previous manifest, or return an empty one"""
+    try:
+        with io.open(fn, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('version') == MANIFEST_VERSION:
+            return manifest
+        logger.info(f'ignoring manifest {fn} of incompatible version')
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError):
+        logger.warning(f'cannot read manifest {fn}, ignoring it')
+    return {'version': MANIFEST_VERSION, 'sessions': dict()}
+
+
+def _save_manifest(fn, manifest):
+    """Write the manifest via a temporary file, so that it is never partial"""
+    fn_tmp = fn.with_name(fn.name + '.tmp')
+    with io.open(fn_tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(fn_tmp, fn)
+
+
+def batch_report(sessions, destdir=None, n_jobs=None, manifest=None, force=False):
+    """Create single-session pdf reports for several sessions.
+
+    Parameters
+    ----------
+    sessions : list
+        Session paths or glob patterns matching session paths.
+    destdir : str | Path, optional
+        Destination directory for the reports. If None, each report is written
+        into its session directory.
+    n_jobs : int, optional
+        Maximum number of reports to create in parallel. If None, use the
+        number of CPUs.
+    manifest : str | Path, optional
+        The JSON manifest file. If None, MANIFEST_FILENAME in destdir (or the
+        current directory) is used.
+    force : bool, optional
+        If True, create all reports, even if their inputs have not changed.
+
+    Returns
+    -------
+    dict
+        The results of the given sessions, keyed by session path. Each result
+        is a dict with the status ('ok', 'failed' or 'skipped'), a message, the
+        time spent on the report, the report file and the digest of the report
+        inputs. The same results are written into the manifest, which also keeps
+        the results of sessions from previous runs.
+    """
+    sessions = _expand_sessions(sessions)
+    if destdir is not None:
+        destdir = Path(destdir)
+        destdir.mkdir(parents=True, exist_ok=True)
+    if manifest is None:
+        manifest = (destdir or Path.cwd()) / MANIFEST_FILENAME
+    manifest_fn = Path(manifest)
+    manifest = _load_manifest(manifest_fn)
+    manifest['created'] = datetime.datetime.now().isoformat(timespec='seconds')
+    results = dict()
+    config_digest = _config_digest()
+
+    todo = dict()
+    for sessionpath in sessions:
+        key = str(sessionpath)
+        digest = _session_digest(sessionpath, config_digest)
+        output = _report_path(sessionpath, destdir)
+        prev = manifest['sessions'].get(key, dict())
+        if (
+            not force
+            and prev.get('status') in ('ok', 'skipped')
+            and prev.get('digest') == digest
+            and output.is_file()
+        ):
+            logger.info(f'{sessionpath} has not changed, skipping')
+            results[key] = dict(
+                prev, status='skipped', message='inputs have not changed', time=0.0
+            )
+        else:
+            todo[sessionpath] = digest
+
+    if n_jobs is None:
+        n_jobs = os.cpu_count()
+    n_workers = max(1, min(n_jobs, len(todo)))
+    logger.info(f'creating {len(todo)} reports using {n_workers} workers')
+    manifest['sessions'].update(results)
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        futures = {
+            executor.submit(_create_report_worker, sessionpath, destdir): sessionpath
+            for sessionpath in todo
+        }
+        for k, future in enumerate(as_completed(futures), 1):
+            sessionpath = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:  # e.g. the worker process was killed
+                result = {'status': 'failed', 'message': repr(e), 'time': 0.0}
+            result['output'] = str(_report_path(sessionpath, destdir))
+            result['digest'] = todo[sessionpath]
+            results[str(sessionpath)] = manifest['sessions'][str(sessionpath)] = result
+            logger.info(
+                f"{k}/{len(todo)}: {sessionpath}: {result['status']} "
+                f"({result['time']:.1f} s) {result['message']}"
+            )
+            # save after each report, so that an interrupted run can be resumed
+            _save_manifest(manifest_fn, manifest)
+    _save_manifest(manifest_fn, manifest)
+    return results
+
+
+def main(argv=None):
+    """Command line entry point for batch report generation"""
+    parser = argparse.ArgumentParser(
+        description='Create single-session pdf reports for several sessions.'
+    )
+    parser.add_argument(
+        'sessions', nargs='+', help='session directories or glob patterns'
+    )
+    parser.add_argument(
+        '-o', '--destdir', help='directory for the reports (default: session dirs)'
+    )
+    parser.add_argument(
+        '-j', '--jobs', type=int, help='number of parallel reports (default: n of CPUs)'
+    )
+    parser.add_argument(
+        '-m', '--manifest', help=f'manifest file (default: {MANIFEST_FILENAME})'
+    )
+    parser.add_argument(
+        '-f',
+        '--force',
+        action='store_true',
+        help='recreate all reports, even if their inputs have not changed',
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(format="%(levelname)s: %(name)s: %(message)s")
+    root_logger = logging.getLogger()
+    root_logger.setLevel(logging.__dict__[cfg.general.logging_level])
+    logging.getLogger('matplotlib').setLevel(logging.WARNING)
+
+    results = batch_report(
+        args.sessions,
+        destdir=args.destdir,
+        n_jobs=args.jobs,
+        manifest=args.manifest,
+        force=args.force,
+    )
+    n_failed = sum(res['status'] == 'failed' for res in results.values())
+    logger.info(f'{len(results)} sessions processed, {n_failed} failed')
+    return 1 if n_failed else 0
@@ -11,12 +11,17 @@ import dash
 from dash.dependencies import Input, Output, State
 import flask
 from flask import request
+from concurrent.futures import Future, ThreadPoolExecutor
 import logging
-import base64
+from functools import lru_cache
+import hashlib
+import json
 import pickle
 import os
+import threading
 from pathlib import Path
 
+from configdot import dump_config
 from ulstools.num import age_from_hetu
 
 from .. import (
@@ -28,7 +33,7 @@ from .. import (
 )
 from ..config import cfg
 from ..envutils import GaitDataError
-from ..sessionutils import enf_to_trialfile
+from ..sessionutils import enf_to_trialfile, get_c3ds
 from ..trial import Trial
 from ..viz.plot_plotly import plot_trials, plot_extracted_box
 from ..viz import timedist, layouts
@@ -44,6 +49,178 @@ except ImportError:
 
 logger = logging.getLogger(__name__)
 
+# increment this if the format of the cached figure data changes
+FIGURE_CACHE_VERSION = 1
+# config sections that do not affect the figures, or are accounted for
+# separately in the figure keys
+_FIGURE_KEY_IGNORED_SECTIONS = ['general', 'layouts', 'web_report']
+# configured layouts used by the special page layouts
+_SPECIAL_LAYOUTS = {
+    'static_kinematics': 'lb_kinematics',
+    'static_emg': 'std_emg',
+    'emg_auto': 'std_emg',
+    'kinematics_average': 'lb_kinematics',
+}
+
+
+class _ReportCanceled(Exception):
+    """Raised when report creation is canceled while loading trials"""
+
+
+class _TrialLoadError(Exception):
+    """Raised when a report trial cannot be loaded.
+
+    The original error is the __cause__. Failures to load trials are not
+    failures of single figures, so the figures are not cached as unavailable.
+    """
+
+
+class _FigureCache:
+    """On-disk cache of report figures.
+
+    Each figure is stored into a separate file, named by a digest of everything
+    that affects the figure. Thus stale figures are never found in the cache and
+    do not need to be invalidated. When the total size of the cache exceeds
+    max_bytes, the least recently used figures are evicted. The cache also keeps
+    the digests of the input files, so that they need not be read if all the
+    figures are found in the cache.
+    """
+
+    DIGESTS_FILENAME = 'file_digests.json'
+    # unavailable figures are cached as None
+    _PICKLED_NONE = pickle.dumps(None, protocol=-1)
+
+    def __init__(self, cache_dir, max_bytes=None):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+
+    def _path(self, key):
+        return self.cache_dir / f'{key}.pkl'
+
+    def file_digests(self, files):
+        """Return the md5 digests of the given files, keyed by filename.
+
+        The digests are stored in the cache directory along with the file sizes
+        and modification times, so that unchanged files are not read again.
+        """
+        fn_index = self.cache_dir / self.DIGESTS_FILENAME
+        try:
+            with open(fn_index, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            index = dict()
+        except (OSError, ValueError):
+            logger.warning(f'cannot read {fn_index}, recreating it')
+            index = dict()
+        digests = dict()
+        changed = False
+        for fn in files:
+            st = os.stat(fn)
+            stamp = [st.st_size, st.st_mtime_ns]
+            entry = index.get(str(fn))
+            if entry is None or entry[:2] != stamp:
+                entry = stamp + [numutils._file_digest(fn)]
+                index[str(fn)] = entry
+                changed = True
+            digests[fn] = entry[2]
+        if changed:
+            # drop entries for files that no longer exist
+            index = {fn: entry for fn, entry in index.items() if os.path.isfile(fn)}
+            fn_tmp = fn_index.with_name(fn_index.name + '.tmp')
+            try:
+                self.cache_dir.mkdir(parents=True, exist_ok=True)
+                with open(fn_tmp, 'w', encoding='utf-8') as f:
+                    json.dump(index, f)
+                os.replace(fn_tmp, fn_index)
+            except OSError as e:
+                logger.warning(f'cannot write {fn_index}: {e}')
+        return digests
+
+    def get(self, key):
+        """Return the cached figure data. Raises KeyError if not cached."""
+        fn = self._path(key)
+        try:
+            with open(fn, 'rb') as f:
+                figdata = pickle.load(f)
+        except FileNotFoundError:
+            raise KeyError(key)
+        except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+            logger.warning(f'cannot read cached figure {fn}')
+            raise KeyError(key)
+        try:  # mark as recently used
+            os.utime(fn)
+        except OSError:
+            pass
+        return figdata
+
+    def is_unavailable(self, key):
+        """Return True if the figure is cached as unavailable (None).
+
+        This does not unpickle the figure data, so it is cheap to call for all
+        the figures.
+        """
+        fn = self._path(key)
+        try:
+            if fn.stat().st_size != len(self._PICKLED_NONE):
+                return False
+            return fn.read_bytes() == self._PICKLED_NONE
+        except OSError:
+            return False
+
+    def put(self, key, figdata):
+        """Store figure data into the cache"""
+        fn = self._path(key)
+        fn_tmp = fn.with_name(fn.name + '.tmp')
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            with open(fn_tmp, 'wb') as f:
+                pickle.dump(figdata, f, protocol=-1)
+            os.replace(fn_tmp, fn)
+        except OSError as e:
+            logger.warning(f'cannot write cached figure {fn}: {e}')
+            return
+        self._evict()
+
+    def _evict(self):
+        """Remove least recently used figures until the cache fits max_bytes"""
+        if self.max_bytes is None:
+            return
+        files = list()
+        for fn in self.cache_dir.glob('*.pkl'):
+            try:
+                st = fn.stat()
+            except OSError:  # removed by another process
+                continue
+            files.append((st.st_mtime_ns, st.st_size, fn))
+        total_bytes = sum(size for _, size, _ in files)
+        for _, size, fn in sorted(files):
+            if total_bytes <= self.max_bytes:
+                break
+            logger.debug(f'evicting cached figure {fn}')
+            try:
+                fn.unlink()
+            except OSError:
+                continue
+            total_bytes -= size
+
+
+def _figure_cache_dir(sessions):
+    """Return the directory for cached report figures"""
+    if cfg.web_report.figure_cache_dir is not None:
+        return Path(cfg.web_report.figure_cache_dir)
+    # by default, the figures are cached into the alphabetically first session
+    return sorted(sessions)[0] / 'web_report_cache'
+
+
+def _figure_config_digest():
+    """Digest of the config sections that may affect the figures"""
+    cfg_txt = ''.join(
+        dump_config(section)
+        for secname, section in cfg
+        if secname not in _FIGURE_KEY_IGNORED_SECTIONS
+    )
+    return hashlib.md5(cfg_txt.encode('utf-8')).hexdigest()
+
 
 def _make_dropdown_lists(options):
     """Helper for dcc.Dropdown.
@@ -91,6 +268,7 @@ def dash_report(
     signals=None,
     recreate_plots=None,
     video_only=None,
+    lazy=None,
 ):
     """Create a gait report dash app.
 
@@ -113,10 +291,20 @@ def dash_report(
         report. If None, a dummy one will be created.
     recreate_plots : bool
         If True, force recreation of the report figures. Otherwise, cached
-        figure data will be used, unless the report c3d files have changed (a
-        checksum mechanism is used to verify this).
+        figures will be used if available. The figures are cached individually,
+        keyed by the digests of their input c3d files, the layout, the plotting
+        config and the normal data, so only figures whose inputs have changed
+        are recreated. The c3d files are loaded only if some figures need to be
+        created.
     video_only : bool
         If True, create a video-only report (no gait curves).
+    lazy : bool
+        If True, create (or load) each figure only when it is first selected in
+        the report. Only the initially shown figure is created before the report
+        is returned; the rest are prefetched in a background thread. Figures
+        that are cached as unavailable are disabled in the menus; figures that
+        cannot be created when selected are shown as a "Figure not available"
+        placeholder. If None, taken from config.
 
     Returns
     -------
@@ -136,6 +324,13 @@ def dash_report(
     if video_only is None:
         video_only = False
 
+    if lazy is None:
+        lazy = cfg.web_report.lazy_figures
+
+    # the page initially shown in the graph panels
+    initial_page = 'Kinematics'
+    prefetch_executor = None
+
     # relative width of left panel (1-12)
     # uncomment to use narrower video panel for 3-session comparison
     # LEFT_WIDTH = 8 if len(sessions) == 3 else 7
@@ -277,106 +472,175 @@ def dash_report(
             raise GaitDataError(
                 f'c3d files missing for following trials: {missing_trials}'
             )
-        # see whether we can load report figures from disk
-        digest = numutils._files_digest(data_c3ds)
-        logger.debug(f'report data digest: {digest}')
-        # the cached data is always saved into alphabetically first session
-        data_dir = sorted(sessions)[0]
-        data_fn = data_dir / f'web_report_{digest}.dat'
-        if data_fn.is_file() and not recreate_plots:
-            logger.info(f'loading saved report data from {data_fn}')
-            signals.progress.emit('Loading saved report...', 0)
-            try:
-                with open(data_fn, 'rb') as f:
-                    saved_report_data = pickle.load(f)
-            except UnicodeDecodeError:
-                logger.warning('cannot open report (probably made with legacy version)')
-                logger.warning('recreating...')
-                saved_report_data = dict()
-        else:
-            saved_report_data = dict()
-            logger.info('no saved data found or recreate forced')
-
-        # make Trial instances for all dynamic and static trials
-        # this is currently necessary even if saved figures are used
-        trials_dyn = list()
-        trials_dyn_dict = dict()  # also organize dynamic trials by session
-        trials_static = list()
+        # the figures are cached individually, keyed by the inputs of each figure
+        fig_cache = _FigureCache(
+            _figure_cache_dir(sessions), cfg.web_report.figure_cache_size * 1024**2
+        )
+        signals.progress.emit('Checking trial files...', 0)
+        # timedist.plot_comparison() reads all the tagged dynamic trials of the
+        # sessions, not only the ones shown in the report
+        c3ds_timedist = {
+            session: get_c3ds(session, tags=cfg.eclipse.tags, trial_type='dynamic')
+            for session in sessions
+        }
+        # the digests are computed once here, since file_digests() may rewrite
+        # the digest index and is not safe to call from several threads
+        c3d_digests = fig_cache.file_digests(
+            data_c3ds + [c3dfile for c3ds in c3ds_timedist.values() for c3dfile in c3ds]
+        )
+        timedist_inputs = [
+            (session.name, [(fn.name, c3d_digests[fn]) for fn in c3ds])
+            for session, c3ds in c3ds_timedist.items()
+        ]
+
+        def _trial_key(session, tag, c3dfile):
+            """Identify a trial for the figure keys"""
+            return session.name, tag, c3dfile.name, c3d_digests[c3dfile]
+
+        # collect the c3d files for dynamic and static trials
+        c3ds_dyn = dict()  # organized by session
+        c3ds_static = list()
+        trial_keys_dyn = list()
+        trial_keys_static = list()
         for session in sessions:
-            trials_dyn_dict[session] = list()
+            c3ds_dyn[session] = list()
             for tag in dyn_tags:
                 if enfs[session]['dynamic'][tag]:
-                    if signals.canceled:
-                        return None
                     c3dfile = enf_to_trialfile(enfs[session]['dynamic'][tag][0], 'c3d')
-                    tri = Trial(c3dfile)
-                    trials_dyn.append(tri)
-                    trials_dyn_dict[session].append(tri)
+                    c3ds_dyn[session].append(c3dfile)
+                    trial_keys_dyn.append(_trial_key(session, tag, c3dfile))
             if enfs[session]['static'][static_tag]:
                 c3dfile = enf_to_trialfile(enfs[session]['static']['Static'][0], 'c3d')
-                tri = Trial(c3dfile)
-                trials_static.append(tri)
-
-        emg_auto_layout = None
-
-        # stuff that's needed to (re)create the figures
-        if not saved_report_data:
-            age = None
-            if info['hetu'] is not None:
-                # compute subject age at session time
-                session_dates = [
-                    sessionutils.get_session_date(session) for session in sessions
-                ]
-                ages = [age_from_hetu(info['hetu'], d) for d in session_dates]
+                c3ds_static.append(c3dfile)
+                trial_keys_static.append(_trial_key(session, static_tag, c3dfile))
+
+        # make Trial instances for the dynamic and static trials
+        # they are only needed for creating figures, so if all figures are
+        # found in the cache, no c3d files are read
+        trials_loaded = dict()  # Trial instances or loading errors by c3d file
+
+        def _load_trial(c3dfile):
+            """Load a trial, unless report creation has been canceled.
+
+            Errors are remembered, so that a broken trial is read only once.
+            """
+            if c3dfile not in trials_loaded:
+                if signals.canceled:
+                    raise _ReportCanceled
                 try:
-                    age = max(ages)
-                except TypeError:
-                    age = None
+                    trials_loaded[c3dfile] = Trial(c3dfile)
+                except Exception as e:
+                    trials_loaded[c3dfile] = e
+            trial = trials_loaded[c3dfile]
+            if isinstance(trial, Exception):
+                raise _TrialLoadError(f'cannot load {c3dfile.name}') from trial
+            return trial
+
+        @lru_cache(maxsize=None)
+        def _get_trials_dyn_dict():
+            """Dynamic trials, organized by session"""
+            signals.progress.emit('Loading dynamic trials...', 0)
+            return {
+                session: [_load_trial(c3dfile) for c3dfile in c3ds]
+                for session, c3ds in c3ds_dyn.items()
+            }
 
-            # create Markdown text for patient info
-            patient_info_text = '##### %s ' % (
-                info['fullname'] if info['fullname'] else 'Name unknown'
-            )
-            if info['hetu']:
-                patient_info_text += f"({info['hetu']})"
-            patient_info_text += '\n\n'
-            # if age:
-            #     patient_info_text += 'Age at measurement time: %d\n\n' % age
-
-            # load normal data for gait models; we have to do it here instead of
-            # leaving it up to plot_trials, since it's session (age) specific
-            signals.progress.emit('Loading normal data...', 0)
-            model_normaldata = normaldata._read_configured_model_normaldata(age)
+        @lru_cache(maxsize=None)
+        def _get_trials_dyn():
+            """All dynamic trials"""
+            return [tri for trials in _get_trials_dyn_dict().values() for tri in trials]
+
+        @lru_cache(maxsize=None)
+        def _get_trials_static():
+            """Static trials"""
+            signals.progress.emit('Loading static trials...', 0)
+            return [_load_trial(c3dfile) for c3dfile in c3ds_static]
+
+        # stuff that's needed to (re)create the figures; computed only if
+        # some figure actually needs to be created
+        @lru_cache(maxsize=None)
+        def _get_age():
+            """Subject age at session time"""
+            if info['hetu'] is None:
+                return None
+            session_dates = [
+                sessionutils.get_session_date(session) for session in sessions
+            ]
+            ages = [age_from_hetu(info['hetu'], d) for d in session_dates]
+            try:
+                return max(ages)
+            except TypeError:
+                return None
 
-            # make average trials for each session
-            avg_trials = [
-                AvgTrial.from_trials(trials_dyn_dict[session], sessionpath=session)
-                for session in sessions
+        @lru_cache(maxsize=None)
+        def _get_model_normaldata():
+            """Load normal data for gait models.
+
+            We have to do it here instead of leaving it up to plot_trials, since
+            it's session (age) specific.
+            """
+            signals.progress.emit('Loading normal data...', 0)
+            return normaldata._read_configured_model_normaldata(_get_age())
+
+        @lru_cache(maxsize=None)
+        def _get_avg_trials():
+            """Make average trials for each session"""
+            return [
+                AvgTrial.from_trials(trials, sessionpath=session)
+                for session, trials in _get_trials_dyn_dict().items()
             ]
 
-            # prepare for the curve-extracted value plots
+        @lru_cache(maxsize=None)
+        def _get_curve_vals():
+            """Extract values for the curve-extracted plots"""
             logger.debug('extracting values for curve-extracted plots...')
-            vardefs_dict = dict(cfg.report.vardefs)
             allvars = [
                 vardef[0] for vardefs in vardefs_dict.values() for vardef in vardefs
             ]
             from_models = set(models.model_from_var(var) for var in allvars)
             if None in from_models:
                 raise GaitDataError(f'unknown variables in extract list: {allvars}')
-            curve_vals = {
+            return {
                 session.name: _trials_extract_values(trials, from_models=from_models)
-                for session, trials in trials_dyn_dict.items()
+                for session, trials in _get_trials_dyn_dict().items()
             }
 
-            # in EMG layout, keep chs that are active in any of the trials
+        @lru_cache(maxsize=None)
+        def _get_emg_auto_layout():
+            """In EMG layout, keep chs that are active in any of the trials"""
             signals.progress.emit('Reading EMG data', 0)
             try:
-                emgs = [tr.emg for tr in trials_dyn]
+                emgs = [tr.emg for tr in _get_trials_dyn()]
                 emg_auto_layout = layouts._rm_dead_channels(emgs, cfg.layouts.std_emg)
-                if not emg_auto_layout:
-                    emg_auto_layout = None
+                return emg_auto_layout or None
             except GaitDataError:
-                emg_auto_layout = None
+                return None
+
+        # create Markdown text for patient info
+        patient_info_text = '##### %s ' % (
+            info['fullname'] if info['fullname'] else 'Name unknown'
+        )
+        if info['hetu']:
+            patient_info_text += f"({info['hetu']})"
+        patient_info_text += '\n\n'
+        # if age:
+        #     patient_info_text += 'Age at measurement time: %d\n\n' % age
+
+        vardefs_dict = dict(cfg.report.vardefs)
+
+        # for comparison report, include session info in plot legends and
+        # use session specific line style
+        emg_mode = None
+        if is_comparison:
+            legend_type = cfg.report.comparison_legend_type
+            style_by = cfg.report.comparison_style_by
+            color_by = cfg.report.comparison_color_by
+            if cfg.report.comparison_emg_as_envelope:
+                emg_mode = 'envelope'
+        else:
+            legend_type = cfg.report.legend_type
+            style_by = cfg.report.style_by
+            color_by = cfg.report.color_by
 
         # the layouts are specified as lists of tuples: (title, layout_spec)
         # where title is the page title, and layout_spec is either string or tuple.
@@ -399,205 +663,323 @@ def dash_report(
         # add supplementary data for normal layouts
         supplementary_default = dict()
 
-        dd_opts_multi_upper = list()
-        dd_opts_multi_lower = list()
+        config_digest = _figure_config_digest()
 
-        # loop through the layouts, create or load figures
-        report_data_new = dict()
-        for k, (page_label, layout_spec) in enumerate(page_layouts.items()):
-            signals.progress.emit(
-                f'Creating plot: {page_label}', 100 * k / len(page_layouts)
-            )
-            if signals.canceled:
-                return None
-            # for comparison report, include session info in plot legends and
-            # use session specific line style
-            emg_mode = None
-            if is_comparison:
-                legend_type = cfg.report.comparison_legend_type
-                style_by = cfg.report.comparison_style_by
-                color_by = cfg.report.comparison_color_by
-                if cfg.report.comparison_emg_as_envelope:
-                    emg_mode = 'envelope'
-            else:
-                legend_type = cfg.report.legend_type
-                style_by = cfg.report.style_by
-                color_by = cfg.report.color_by
+        def _figure_key(layout_spec):
+            """Compute the cache key for a figure.
 
-            try:
-                if saved_report_data:
-                    logger.debug(f'loading {page_label} from saved report data')
-                    if page_label not in saved_report_data:
-                        # will be caught, resulting in empty menu item
-                        raise RuntimeError
-                    else:
-                        figdata = saved_report_data[page_label]
+            The key is a digest of everything that affects the figure: the input
+            trials, the layout, the plotting options and config, and the normal
+            data.
+            """
+            if layout_spec == 'patient_info':
+                inputs = info['fullname'], info['hetu']
+            elif layout_spec == 'time_dist':
+                inputs = timedist_inputs, normaldata._normaldata_version()
+            else:
+                if layout_spec in ['static_kinematics', 'static_emg']:
+                    trial_keys = trial_keys_static
                 else:
-                    logger.debug(f'creating figure data for {page_label}')
-                    # the 'special' layouts are indicated by a string
-                    if isinstance(layout_spec, str):
-                        if layout_spec == 'time_dist':
-                            figdata = timedist.plot_comparison(
-                                sessions, big_fonts=False, backend='plotly'
-                            )
-                        elif layout_spec == 'patient_info':
-                            figdata = patient_info_text
-                        elif layout_spec == 'static_kinematics':
-                            layout_ = cfg.layouts.lb_kinematics
-                            figdata = plot_trials(
-                                trials_static,
-                                layout_,
-                                model_normaldata=False,
-                                cycles='unnormalized',
-                                legend_type='short_name_with_cyclename',
-                                style_by=style_by,
-                                color_by=color_by,
-                                big_fonts=True,
-                            )
-                        elif layout_spec == 'static_emg':
-                            layout_ = cfg.layouts.std_emg
-                            figdata = plot_trials(
-                                trials_static,
-                                layout_,
-                                model_normaldata=False,
-                                cycles='unnormalized',
-                                legend_type='short_name_with_cyclename',
-                                style_by=style_by,
-                                color_by=color_by,
-                                big_fonts=True,
-                            )
-                        elif layout_spec == 'emg_auto':
-                            if emg_auto_layout is None:  # no valid EMG channels
-                                raise RuntimeError
-                            else:
-                                figdata = plot_trials(
-                                    trials_dyn,
-                                    emg_auto_layout,
-                                    emg_mode=emg_mode,
-                                    legend_type=legend_type,
-                                    style_by=style_by,
-                                    color_by=color_by,
-                                    supplementary_data=supplementary_default,
-                                    big_fonts=True,
-                                )
-                        elif layout_spec == 'kinematics_average':
-                            layout_ = cfg.layouts.lb_kinematics
-                            figdata = plot_trials(
-                                avg_trials,
-                                layout_,
-                                style_by=style_by,
-                                color_by=color_by,
-                                model_normaldata=model_normaldata,
-                                big_fonts=True,
-                            )
-                        elif layout_spec == 'disabled':
-                            # exception will be caught in this loop, resulting in empty menu item
-                            raise RuntimeError
-                        else:  # unrecognized layout; this will cause an exception
-                            raise Exception(f'Invalid page layout: {str(layout_spec)}')
-
-                    # regular layouts and curve-extracted layouts are indicated by tuple
-                    elif isinstance(layout_spec, tuple):
-                        if layout_spec[0] in ['layout_name', 'layout']:
-                            if layout_spec[0] == 'layout_name':
-                                # get a configured layout by name
-                                layout = layouts.get_layout(layout_spec[1])
-                            else:
-                                # it's already a valid layout
-                                layout = layout_spec[1]
-                            # plot according to layout
-                            figdata = plot_trials(
-                                trials_dyn,
-                                layout,
-                                model_normaldata=model_normaldata,
-                                max_cycles=max_cycles,
-                                emg_mode=emg_mode,
-                                legend_type=legend_type,
-                                style_by=style_by,
-                                color_by=color_by,
-                                supplementary_data=supplementary_default,
-                                big_fonts=True,
-                            )
-                        elif layout_spec[0] == 'curve_extracted':
-                            the_vardefs = vardefs_dict[layout_spec[1]]
-                            figdata = plot_extracted_box(curve_vals, the_vardefs)
-                        else:
-                            raise Exception(f'Invalid page layout: {str(layout_spec)}')
+                    trial_keys = trial_keys_dyn
+                ndata_version = normaldata._normaldata_version()
+                inputs = trial_keys, _get_age(), ndata_version
+            if isinstance(layout_spec, str):
+                layout_name = _SPECIAL_LAYOUTS.get(layout_spec)
+                layout = layouts.get_layout(layout_name) if layout_name else None
+            elif layout_spec[0] == 'layout_name':
+                layout = layouts.get_layout(layout_spec[1])
+            else:
+                layout = None
+            plot_opts = legend_type, style_by, color_by, emg_mode, max_cycles
+            key = (
+                FIGURE_CACHE_VERSION,
+                [session.name for session in sessions],
+                layout_spec,
+                layout,
+                inputs,
+                plot_opts,
+                config_digest,
+            )
+            return hashlib.md5(repr(key).encode('utf-8')).hexdigest()
+
+        def _create_figdata(layout_spec):
+            """Create the figure data for a layout.
+
+            Returns the figure as a plotly JSON dict, or the Markdown text for the
+            patient info. Raises RuntimeError or GaitDataError if the figure
+            cannot be created.
+            """
+            # the 'special' layouts are indicated by a string
+            if isinstance(layout_spec, str):
+                if layout_spec == 'time_dist':
+                    figdata = timedist.plot_comparison(
+                        sessions, big_fonts=False, backend='plotly'
+                    )
+                elif layout_spec == 'patient_info':
+                    figdata = patient_info_text
+                elif layout_spec == 'static_kinematics':
+                    layout_ = cfg.layouts.lb_kinematics
+                    figdata = plot_trials(
+                        _get_trials_static(),
+                        layout_,
+                        model_normaldata=False,
+                        cycles='unnormalized',
+                        legend_type='short_name_with_cyclename',
+                        style_by=style_by,
+                        color_by=color_by,
+                        big_fonts=True,
+                    )
+                elif layout_spec == 'static_emg':
+                    layout_ = cfg.layouts.std_emg
+                    figdata = plot_trials(
+                        _get_trials_static(),
+                        layout_,
+                        model_normaldata=False,
+                        cycles='unnormalized',
+                        legend_type='short_name_with_cyclename',
+                        style_by=style_by,
+                        color_by=color_by,
+                        big_fonts=True,
+                    )
+                elif layout_spec == 'emg_auto':
+                    emg_auto_layout = _get_emg_auto_layout()
+                    if emg_auto_layout is None:  # no valid EMG channels
+                        raise RuntimeError('no valid EMG channels')
                     else:
-                        raise Exception(f'Invalid page layout: {str(layout_spec)}')
-
-                # save the newly created data
-                if not saved_report_data:
-                    if isinstance(figdata, go.Figure):
-                        # serialize go.Figures before saving
-                        # this makes them much faster for pickle to handle
-                        # apparently dcc.Graph can eat the serialized json directly,
-                        # so no need to do anything on load
-                        figdata_ = figdata.to_plotly_json()
+                        figdata = plot_trials(
+                            _get_trials_dyn(),
+                            emg_auto_layout,
+                            emg_mode=emg_mode,
+                            legend_type=legend_type,
+                            style_by=style_by,
+                            color_by=color_by,
+                            supplementary_data=supplementary_default,
+                            big_fonts=True,
+                        )
+                elif layout_spec == 'kinematics_average':
+                    layout_ = cfg.layouts.lb_kinematics
+                    figdata = plot_trials(
+                        _get_avg_trials(),
+                        layout_,
+                        style_by=style_by,
+                        color_by=color_by,
+                        model_normaldata=_get_model_normaldata(),
+                        big_fonts=True,
+                    )
+                elif layout_spec == 'disabled':
+                    # exception will be caught, resulting in empty menu item
+                    raise RuntimeError('layout disabled')
+                else:  # unrecognized layout; this will cause an exception
+                    raise Exception(f'Invalid page layout: {str(layout_spec)}')
+
+            # regular layouts and curve-extracted layouts are indicated by tuple
+            elif isinstance(layout_spec, tuple):
+                if layout_spec[0] in ['layout_name', 'layout']:
+                    if layout_spec[0] == 'layout_name':
+                        # get a configured layout by name
+                        layout = layouts.get_layout(layout_spec[1])
                     else:
-                        figdata_ = figdata
-                    report_data_new[page_label] = figdata_
-
-                # make the upper and lower panel graphs from figdata, depending
-                # on data type
-                def _is_base64(s):
-                    """Test for valid base64 encoding"""
+                        # it's already a valid layout
+                        layout = layout_spec[1]
+                    # plot according to layout
+                    figdata = plot_trials(
+                        _get_trials_dyn(),
+                        layout,
+                        model_normaldata=_get_model_normaldata(),
+                        max_cycles=max_cycles,
+                        emg_mode=emg_mode,
+                        legend_type=legend_type,
+                        style_by=style_by,
+                        color_by=color_by,
+                        supplementary_data=supplementary_default,
+                        big_fonts=True,
+                    )
+                elif layout_spec[0] == 'curve_extracted':
+                    the_vardefs = vardefs_dict[layout_spec[1]]
+                    figdata = plot_extracted_box(_get_curve_vals(), the_vardefs)
+                else:
+                    raise Exception(f'Invalid page layout: {str(layout_spec)}')
+            else:
+                raise Exception(f'Invalid page layout: {str(layout_spec)}')
+
+            if isinstance(figdata, go.Figure):
+                # serialize go.Figures before caching
+                # this makes them much faster for pickle to handle
+                # apparently dcc.Graph can eat the serialized json directly,
+                # so no need to do anything on load
+                figdata = figdata.to_plotly_json()
+            return figdata
+
+        # figure creation is serialized, since the shared data above is
+        # created on demand and the trial readers are not thread safe
+        create_lock = threading.Lock()
+
+        def _get_figdata(layout_spec):
+            """Get the figure data for a layout from the cache, or create it.
+
+            Figures that cannot be created are cached as None. Raises
+            _ReportCanceled if report creation is canceled while loading trials,
+            and _TrialLoadError if the trials cannot be loaded.
+            """
+            figkey = _figure_key(layout_spec)
+            if not recreate_plots:
+                try:
+                    return fig_cache.get(figkey)
+                except KeyError:
+                    pass
+            with create_lock:
+                try:
+                    figdata = _create_figdata(layout_spec)
+                except (RuntimeError, GaitDataError) as e:
+                    logger.warning(f'failed to create figure for {layout_spec}: {e}')
+                    figdata = None
+            fig_cache.put(figkey, figdata)
+            return figdata
+
+        page_indices = {page_label: k for k, page_label in enumerate(page_layouts)}
+
+        def _make_graphs(page_label, figdata):
+            """Make the upper and lower panel graphs from figdata, depending on
+            data type"""
+            k = page_indices[page_label]
+            if page_layouts[page_label] == 'patient_info':
+                graph_upper = dcc.Markdown(figdata)
+                graph_lower = graph_upper
+            else:
+                # plotly fig -> dcc.Graph
+                graph_upper = dcc.Graph(
+                    figure=figdata, id='gaitgraph%d' % k, style={'height': '100%'}
+                )
+                graph_lower = dcc.Graph(
+                    figure=figdata,
+                    id='gaitgraph%d' % (len(page_layouts) + k),
+                    style={'height': '100%'},
+                )
+            return graph_upper, graph_lower
+
+        if lazy:
+            # figure data is memoized as futures, so that a figure that is being
+            # prefetched is not created again when it gets selected
+            figdata_memo = dict()
+            memo_lock = threading.Lock()
+
+            def _get_figdata_memoized(page_label):
+                """Get figure data, creating it in the calling thread if needed.
+
+                Errors are not memoized, so that the figure can be retried.
+                """
+                with memo_lock:
+                    future = figdata_memo.get(page_label)
+                    is_owner = future is None
+                    if is_owner:
+                        future = figdata_memo[page_label] = Future()
+                if is_owner:
                     try:
-                        return base64.b64encode(base64.b64decode(s)) == s
-                    except Exception:
-                        return False
-
-                # this is for old style timedist figures that were in base64
-                # encoded svg
-                if layout_spec == 'time_dist' and _is_base64(figdata):
-                    graph_upper = html.Img(
-                        src=f'data:image/svg+xml;base64,{figdata}',
-                        id='gaitgraph%d' % k,
-                        style={'height': '100%'},
+                        future.set_result(_get_figdata(page_layouts[page_label]))
+                    except Exception as e:
+                        with memo_lock:
+                            del figdata_memo[page_label]
+                        future.set_exception(e)
+                return future.result()
+
+            def _get_panel_contents(page_label, panel):
+                """Get the graph for the upper or lower panel"""
+                try:
+                    figdata = _get_figdata_memoized(page_label)
+                except Exception as e:
+                    logger.warning(f'no figure for {page_label}: {e!r}')
+                    figdata = None
+                if figdata is None:
+                    return dcc.Markdown('Figure not available')
+                graph_upper, graph_lower = _make_graphs(page_label, figdata)
+                return graph_upper if panel == 'upper' else graph_lower
+
+            # disable the menu items for figures that are known to be
+            # unavailable; figures that turn out to be unavailable only when
+            # created are shown as a placeholder
+            opts_multi = list()
+            for page_label, layout_spec in page_layouts.items():
+                opt = {'label': page_label, 'value': page_label}
+                if layout_spec == 'disabled' or (
+                    not recreate_plots
+                    and fig_cache.is_unavailable(_figure_key(layout_spec))
+                ):
+                    opt['disabled'] = True
+                opts_multi.append(opt)
+
+            def _prefetch(page_label):
+                """Create figure data in the background"""
+                if not signals.canceled:
+                    _get_figdata_memoized(page_label)
+
+            # create the initially shown figure right away, and prefetch the
+            # rest in the background
+            if signals.canceled:
+                return None
+            if initial_page in page_layouts:
+                signals.progress.emit(f'Creating plot: {initial_page}', 0)
+                try:
+                    _get_figdata_memoized(initial_page)
+                except _ReportCanceled:
+                    return None
+                except _TrialLoadError as e:
+                    raise e.__cause__ from None
+            if signals.canceled:
+                return None
+            prefetch_executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix='gaitutils_report_prefetch'
+            )
+            for page_label in page_layouts:
+                prefetch_executor.submit(_prefetch, page_label)
+
+        else:
+            dd_opts_multi_upper = list()
+            dd_opts_multi_lower = list()
+
+            # loop through the layouts, create or load figures
+            for k, (page_label, layout_spec) in enumerate(page_layouts.items()):
+                signals.progress.emit(
+                    f'Creating plot: {page_label}', 100 * k / len(page_layouts)
+                )
+                if signals.canceled:
+                    return None
+                try:
+                    figdata = _get_figdata(layout_spec)
+                    if figdata is None:
+                        # will be caught, resulting in empty menu item
+                        raise RuntimeError('figure not available')
+                    graph_upper, graph_lower = _make_graphs(page_label, figdata)
+                    dd_opts_multi_upper.append(
+                        {'label': page_label, 'value': graph_upper}
                     )
-                    graph_lower = html.Img(
-                        src=f'data:image/svg+xml;base64,{figdata}',
-                        id='gaitgraph%d' % (len(page_layouts) + k),
-                        style={'height': '100%'},
+                    dd_opts_multi_lower.append(
+                        {'label': page_label, 'value': graph_lower}
                     )
-                elif layout_spec == 'patient_info':
-                    graph_upper = dcc.Markdown(figdata)
-                    graph_lower = graph_upper
-                else:
-                    # plotly fig -> dcc.Graph
-                    graph_upper = dcc.Graph(
-                        figure=figdata, id='gaitgraph%d' % k, style={'height': '100%'}
+
+                except _ReportCanceled:
+                    return None
+                except _TrialLoadError as e:
+                    raise e.__cause__ from None
+                except (RuntimeError, GaitDataError) as e:  # could not create a figure
+                    logger.warning(f'no figure for {page_label}: {e}')
+                    # insert the menu options but make them disabled
+                    dd_opts_multi_upper.append(
+                        {'label': page_label, 'value': page_label, 'disabled': True}
                     )
-                    graph_lower = dcc.Graph(
-                        figure=figdata,
-                        id='gaitgraph%d' % (len(page_layouts) + k),
-                        style={'height': '100%'},
+                    dd_opts_multi_lower.append(
+                        {'label': page_label, 'value': page_label, 'disabled': True}
                     )
-                dd_opts_multi_upper.append({'label': page_label, 'value': graph_upper})
-                dd_opts_multi_lower.append({'label': page_label, 'value': graph_lower})
-
-            except (RuntimeError, GaitDataError) as e:  # could not create a figure
-                logger.warning(f'failed to create figure for {page_label}: {e}')
-                # insert the menu options but make them disabled
-                dd_opts_multi_upper.append(
-                    {'label': page_label, 'value': page_label, 'disabled': True}
-                )
-                dd_opts_multi_lower.append(
-                    {'label': page_label, 'value': page_label, 'disabled': True}
-                )
-                continue
+                    continue
 
-        opts_multi, mapper_multi_upper = _make_dropdown_lists(dd_opts_multi_upper)
-        opts_multi, mapper_multi_lower = _make_dropdown_lists(dd_opts_multi_lower)
+            opts_multi, mapper_multi_upper = _make_dropdown_lists(dd_opts_multi_upper)
+            opts_multi, mapper_multi_lower = _make_dropdown_lists(dd_opts_multi_lower)
+            mappers_multi = {'upper': mapper_multi_upper, 'lower': mapper_multi_lower}
 
-        # if plots were newly created, save them to disk
-        if not saved_report_data:
-            logger.debug(f'saving report data into {data_fn}')
-            signals.progress.emit('Saving report data to disk...', 99)
-            with open(data_fn, 'wb') as f:
-                pickle.dump(report_data_new, f, protocol=-1)
+            def _get_panel_contents(page_label, panel):
+                """Get the graph for the upper or lower panel"""
+                return mappers_multi[panel][page_label]
 
-    def make_left_panel(split=True, upper_value='Kinematics', lower_value='Kinematics'):
+    def make_left_panel(split=True, upper_value=initial_page, lower_value=initial_page):
         """Helper to make the left graph panels. If split=True, make two stacked panels"""
 
         # the upper graph & dropdown
@@ -729,13 +1111,13 @@ def dash_report(
             Output('div-upper', 'children'), [Input('dd-vars-upper-multi', 'value')]
         )
         def update_contents_upper_multi(sel_var):
-            return mapper_multi_upper[sel_var]
+            return _get_panel_contents(sel_var, 'upper')
 
         @app.callback(
             Output('div-lower', 'children'), [Input('dd-vars-lower-multi', 'value')]
         )
         def update_contents_lower_multi(sel_var):
-            return mapper_multi_lower[sel_var]
+            return _get_panel_contents(sel_var, 'lower')
 
     def _video_elem(title, url, max_height):
         """Create a video element with title"""
@@ -780,6 +1162,8 @@ def dash_report(
     @app.server.route('/shutdown')
     def shutdown():
         logger.debug('Received shutdown request...')
+        if prefetch_executor is not None:
+            prefetch_executor.shutdown(wait=False, cancel_futures=True)
         _shutdown_server()
         return 'Server shutting down...'
 
@@ -15,7 +15,7 @@ import glob
 import re
 import logging
 
-from .eclipse import get_eclipse_keys
+from .eclipse import get_eclipse_keys, _get_enf_index
 from .config import cfg
 from .envutils import GaitDataError
 
@@ -224,28 +224,33 @@ def _get_session_enfs(sessionpath):
         yield Path(fp)
 
 
-def _filter_by_eclipse_keys(enfs, patterns, eclipse_keys):
-    """Filter for enfs whose Eclipse key values match given patterns."""
+def _filter_by_eclipse_keys(enfs, patterns, eclipse_keys, enf_keys=None):
+    """Filter for enfs whose Eclipse key values match given patterns.
+
+    If given, enf_keys is a dict of Eclipse keys for each enf (e.g. from the
+    session .enf index); otherwise the enfs are parsed.
+    """
     if not isinstance(patterns, list):
         patterns = [patterns]
     if not isinstance(eclipse_keys, list):
         eclipse_keys = [eclipse_keys]
     for enf in enfs:
-        ecldi = {key.upper(): val.upper() for key, val in get_eclipse_keys(enf).items()}
+        keys = get_eclipse_keys(enf) if enf_keys is None else enf_keys[enf]
+        ecldi = {key.upper(): val.upper() for key, val in keys.items() if val != ''}
         eclvals = [val for key, val in ecldi.items() if key in eclipse_keys]
         for pattern in patterns:
             if any(pattern.upper() in eclval for eclval in eclvals):
                 yield enf
 
 
-def _filter_by_tags(enfs, tags):
+def _filter_by_tags(enfs, tags, enf_keys=None):
     """Filter by given tags"""
-    return _filter_by_eclipse_keys(enfs, tags, cfg.eclipse.tag_keys)
+    return _filter_by_eclipse_keys(enfs, tags, cfg.eclipse.tag_keys, enf_keys)
 
 
-def _filter_by_type(enfs, trial_type):
+def _filter_by_type(enfs, trial_type, enf_keys=None):
     """Filter by trial type"""
-    return _filter_by_eclipse_keys(enfs, trial_type, 'TYPE')
+    return _filter_by_eclipse_keys(enfs, trial_type, 'TYPE', enf_keys)
 
 
 def _filter_to_c3ds(enfs):
@@ -282,11 +287,20 @@ def get_enfs(sessionpath, tags=None, trial_type=None, check_if_exists=True):
         List of enf files.
     """
 
-    enfs = _get_session_enfs(sessionpath)
+    if cfg.eclipse.use_enf_index and (tags or trial_type is not None):
+        # parses only the enfs that have changed since the last call
+        enf_keys = {
+            Path(sessionpath) / enf.name: keys
+            for enf, keys in _get_enf_index(sessionpath).scan().items()
+        }
+        enfs = iter(enf_keys)
+    else:
+        enf_keys = None
+        enfs = _get_session_enfs(sessionpath)
     if trial_type is not None:
-        enfs = _filter_by_type(enfs, trial_type)
+        enfs = _filter_by_type(enfs, trial_type, enf_keys)
     if tags:
-        enfs = _filter_by_tags(enfs, tags)
+        enfs = _filter_by_tags(enfs, tags, enf_keys)
     if check_if_exists:
         enfs = _filter_exists(enfs)
     return list(enfs)
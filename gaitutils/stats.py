@@ -11,12 +11,15 @@ import logging
 import numpy as np
 import scipy
 import itertools
+import os
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from copy import copy
 
 from .trial import Trial, Gaitcycle
 from . import models, numutils
 from .envutils import GaitDataError
-from .numutils import _get_local_max, _get_local_min
+from .numutils import _get_local_max_2d, _get_local_min_2d
 from .config import cfg
 from .emg import AvgEMG
 
@@ -46,22 +49,57 @@ class AvgTrial(Trial):
         reject_zeros=None,
         reject_outliers=None,
         use_medians=None,
+        streaming=False,
     ):
-        """Build AvgTrial from a list of trials"""
-        nfiles = len(trials)
-        data_all, cycles = collect_trial_data(trials)
+        """Build AvgTrial from a list of trials.
 
-        avgdata_model, stddata_model, ncycles_ok_analog = average_model_data(
-            data_all['model'],
-            reject_zeros=reject_zeros,
-            reject_outliers=reject_outliers,
-            use_medians=use_medians,
-        )
-        avgdata_emg, stddata_emg, ncycles_ok_emg = average_analog_data(
-            data_all['emg'],
-            reject_outliers=reject_outliers,
-            use_medians=use_medians,
-        )
+        If streaming is True, the trials are folded into the averages one at a
+        time, so that the curves of all trials are never held in memory at
+        once. In this mode, outlier rejection is not supported and medians are
+        approximate (see CurveAccumulator).
+        """
+        nfiles = len(trials)
+        if streaming:
+            if reject_outliers is not None and not use_medians:
+                raise ValueError('outlier rejection is not supported for streaming')
+            if reject_zeros is None:
+                reject_zeros = True
+            acc_model = CurveAccumulator(use_medians=use_medians)
+            acc_emg = CurveAccumulator(use_medians=use_medians)
+            trial_types = set()
+            for trial in trials:
+                # create Trial instance in case we got filenames as args
+                if not isinstance(trial, Trial):
+                    trial = Trial(trial)
+                trial_types.add(trial.is_static)
+                if len(trial_types) > 1:
+                    raise GaitDataError('Cannot mix dynamic and static trials')
+                data_trial, _ = collect_trial_data([trial])
+                data_model = data_trial['model']
+                if reject_zeros:
+                    data_model = {
+                        var: _reject_zero_rows(var, vardata)
+                        if vardata is not None
+                        else None
+                        for var, vardata in data_model.items()
+                    }
+                acc_model.add(data_model)
+                acc_emg.add(data_trial['emg'])
+            avgdata_model, stddata_model, ncycles_ok_model = acc_model.result()
+            avgdata_emg, stddata_emg, ncycles_ok_emg = acc_emg.result()
+        else:
+            data_all, cycles = collect_trial_data(trials)
+            avgdata_model, stddata_model, ncycles_ok_model = average_model_data(
+                data_all['model'],
+                reject_zeros=reject_zeros,
+                reject_outliers=reject_outliers,
+                use_medians=use_medians,
+            )
+            avgdata_emg, stddata_emg, ncycles_ok_emg = average_analog_data(
+                data_all['emg'],
+                reject_outliers=reject_outliers,
+                use_medians=use_medians,
+            )
 
         return cls(
             avgdata_model=avgdata_model,
@@ -148,6 +186,21 @@ class AvgTrial(Trial):
             data[:] = np.nan
         return self.t, data
 
+    def get_model_data_cycles(self, var, cycles):
+        """Get averaged model variable for several cycles.
+
+        The averaged data is the same for all cycles.
+
+        Parameters
+        ----------
+        var : str
+            The variable name.
+        cycles : list
+            List of cycles.
+        """
+        t, data = self.get_model_data(var)
+        return t, np.stack([data] * len(cycles))
+
     # XXX: why the cycle argument?
     def get_emg_data(self, ch, envelope=None, cycle=None):
         """Get averaged EMG RMS data.
@@ -175,26 +228,95 @@ class AvgTrial(Trial):
         raise GaitDataError('AvgTrial does not average marker data yet')
 
 
-def _robust_reject_rows(data, p_threshold):
-    """Reject rows (observations) from data based on robust Z-score"""
-    # a Bonferroni type correction for the p-threshold
-    p_threshold_corr = p_threshold / data.shape[1]
-    # when computing outliers, estimate median absolute deviation
-    # using all data, instead of a frame-based MAD estimates.
-    # this is necessary since frame-based MAD values
-    # can become really small especially in small datasets, causing
-    # the Z-score to blow up and data getting rejected unnecessarily.
-    outlier_inds = numutils.outliers(
-        data, axis=0, single_mad=False, p_threshold=p_threshold_corr
-    )
-    outlier_rows = np.unique(outlier_inds[0])
-    if outlier_rows.size > 0:
-        logger.info(
-            'rejected %d outlier(s) (corrected P=%g)'
-            % (outlier_rows.size, p_threshold_corr)
+def _robust_outlier_rows(data, p_threshold):
+    """Detect outlier rows (observations) based on robust Z-score.
+
+    Variables with identically shaped data are stacked and processed at once.
+
+    Parameters
+    ----------
+    data : dict
+        The data, keyed by variable. Values are (N, T) ndarrays.
+    p_threshold : float
+        The P value for false rejection.
+
+    Returns
+    -------
+    dict
+        Boolean (N,) ndarrays keyed by variable; True for outlier rows.
+    """
+    shape_groups = defaultdict(list)
+    for var, vardata in data.items():
+        shape_groups[vardata.shape].append(var)
+    outlier_rows = dict()
+    for (_, npts), vars_ in shape_groups.items():
+        # a Bonferroni type correction for the p-threshold
+        p_threshold_corr = p_threshold / npts
+        # when computing outliers, estimate median absolute deviation
+        # using all data, instead of a frame-based MAD estimates.
+        # this is necessary since frame-based MAD values
+        # can become really small especially in small datasets, causing
+        # the Z-score to blow up and data getting rejected unnecessarily.
+        is_outlier = numutils.outlier_mask(
+            np.stack([data[var] for var in vars_]),
+            axis=1,
+            single_mad=False,
+            p_threshold=p_threshold_corr,
         )
-        data = np.delete(data, outlier_rows, axis=0)
-    return data
+        for var, rows in zip(vars_, is_outlier.any(axis=2)):
+            if rows.any():
+                logger.info(
+                    '%s: rejected %d outlier(s) (corrected P=%g)'
+                    % (var, rows.sum(), p_threshold_corr)
+                )
+            outlier_rows[var] = rows
+    return outlier_rows
+
+
+def _average_curves(data, reject_outliers, use_medians):
+    """Average curves for each variable; see average_analog_data()"""
+    stddata = dict()
+    avgdata = dict()
+    ncycles_ok = dict()
+    data_ok = {
+        var: vardata
+        for var, vardata in data.items()
+        if vardata is not None and vardata.shape[0] > 0
+    }
+    if reject_outliers is not None and not use_medians:
+        outlier_rows = _robust_outlier_rows(data_ok, reject_outliers)
+        data_ok = {
+            var: vardata[~outlier_rows[var]] if outlier_rows[var].any() else vardata
+            for var, vardata in data_ok.items()
+        }
+    for var in data:
+        vardata = data_ok.get(var)
+        n_ok = 0 if vardata is None else vardata.shape[0]
+        if n_ok == 0:
+            stddata[var] = None
+            avgdata[var] = None
+        elif use_medians:
+            stddata[var] = numutils.mad(vardata, axis=0)
+            avgdata[var] = np.median(vardata, axis=0)
+        else:
+            stddata[var] = vardata.std(axis=0)
+            avgdata[var] = vardata.mean(axis=0)
+        ncycles_ok[var] = n_ok
+    if not avgdata:
+        logger.warning('nothing averaged')
+    return (avgdata, stddata, ncycles_ok)
+
+
+def _reject_zero_rows(var, vardata):
+    """Reject curves with zero values, except for kinetic vars"""
+    this_model = models.model_from_var(var)
+    if this_model.is_kinetic_var(var):
+        return vardata
+    rows_bad = np.where(np.any(vardata == 0, axis=1))[0]
+    if len(rows_bad) > 0:
+        logger.info('%s: rejecting %d curves with zero values' % (var, len(rows_bad)))
+        vardata = np.delete(vardata, rows_bad, axis=0)
+    return vardata
 
 
 def average_analog_data(data, reject_outliers=None, use_medians=None):
@@ -223,40 +345,9 @@ def average_analog_data(data, reject_outliers=None, use_medians=None):
     ncycles_ok : dict
         N of accepted cycles for each variable.
     """
-    stddata = dict()
-    avgdata = dict()
-    ncycles_ok = dict()
-
     if use_medians is None:
         use_medians = False
-
-    for var, vardata in data.items():
-        if vardata is None:
-            stddata[var] = None
-            avgdata[var] = None
-            ncycles_ok[var] = 0
-            continue
-        else:
-            n_ok = vardata.shape[0]
-            # do the outlier rejection
-            if n_ok > 0 and reject_outliers is not None and not use_medians:
-                logger.info('averaging %s (N=%d)' % (var, n_ok))
-                vardata = _robust_reject_rows(vardata, reject_outliers)
-            n_ok = vardata.shape[0]
-            if n_ok == 0:
-                stddata[var] = None
-                avgdata[var] = None
-            elif use_medians:
-                stddata[var] = numutils.mad(vardata, axis=0)
-                avgdata[var] = np.median(vardata, axis=0)
-            else:
-                stddata[var] = vardata.std(axis=0) if n_ok > 0 else None
-                avgdata[var] = vardata.mean(axis=0) if n_ok > 0 else None
-            ncycles_ok[var] = n_ok
-
-    if not avgdata:
-        logger.warning('nothing averaged')
-    return (avgdata, stddata, ncycles_ok)
+    return _average_curves(data, reject_outliers, use_medians)
 
 
 def average_model_data(data, reject_zeros=None, reject_outliers=None, use_medians=None):
@@ -288,55 +379,352 @@ def average_model_data(data, reject_zeros=None, reject_outliers=None, use_median
     ncycles_ok : dict
         N of accepted cycles for each variable.
     """
-    stddata = dict()
-    avgdata = dict()
-    ncycles_ok = dict()
-
     if use_medians is None:
         use_medians = False
 
     if reject_zeros is None:
         reject_zeros = True
 
-    for var, vardata in data.items():
-        if vardata is None:
-            stddata[var] = None
-            avgdata[var] = None
-            ncycles_ok[var] = 0
-            continue
-        else:
-            Ntot = vardata.shape[0]
-            if reject_zeros:
-                this_model = models.model_from_var(var)
-                if not this_model.is_kinetic_var(var):
-                    rows_bad = np.where(np.any(vardata == 0, axis=1))[0]
-                    if len(rows_bad) > 0:
-                        logger.info(
-                            '%s: rejecting %d curves with zero values'
-                            % (var, len(rows_bad))
-                        )
-                        vardata = np.delete(vardata, rows_bad, axis=0)
-            n_ok = vardata.shape[0]
-            # do the outlier rejection
-            if n_ok > 0 and reject_outliers is not None and not use_medians:
-                logger.info(f'{var}:')
-                vardata = _robust_reject_rows(vardata, reject_outliers)
-            n_ok = vardata.shape[0]
-            if n_ok == 0:
-                stddata[var] = None
-                avgdata[var] = None
-            elif use_medians:
-                stddata[var] = numutils.mad(vardata, axis=0)
-                avgdata[var] = np.median(vardata, axis=0)
+    if reject_zeros:
+        data = {
+            var: _reject_zero_rows(var, vardata) if vardata is not None else None
+            for var, vardata in data.items()
+        }
+    return _average_curves(data, reject_outliers, use_medians)
+
+
+class _RunningMeanStd:
+    """Running mean and standard deviation of curves.
+
+    Uses Welford's algorithm, generalized to batches of curves. Two instances
+    can be merged, so partial results can be computed in parallel.
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.mean = None
+        self._m2 = None  # sum of squared deviations from the mean
+
+    def add(self, curves):
+        """Add a (N, T) array of curves"""
+        n_new = curves.shape[0]
+        if n_new == 0:
+            return
+        other = _RunningMeanStd()
+        other.n = n_new
+        other.mean = curves.mean(axis=0)
+        other._m2 = ((curves - other.mean) ** 2).sum(axis=0)
+        self.merge(other)
+
+    def merge(self, other):
+        """Merge another instance into this one"""
+        if other.n == 0:
+            return
+        if self.n == 0:
+            self.n, self.mean, self._m2 = other.n, other.mean.copy(), other._m2.copy()
+            return
+        n = self.n + other.n
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * other.n / n
+        self._m2 = self._m2 + other._m2 + delta ** 2 * self.n * other.n / n
+        self.n = n
+
+    def result(self):
+        """Return tuple of (mean, std)"""
+        # population stddev, as ndarray.std() by default
+        return self.mean, np.sqrt(self._m2 / self.n)
+
+
+class _RunningMedianMad:
+    """Approximate running median and MAD of curves.
+
+    Uses the extended P² algorithm (Jain & Chlamtac 1985, Raatikainen 1987) to
+    track the quartiles of each curve sample using a fixed number of markers.
+    The median is given by the middle marker. The MAD is estimated as half of
+    the interquartile range, which is exact for symmetric distributions. Until
+    enough curves have been seen, the curves are buffered and exact values are
+    computed.
+    """
+
+    # marker probabilities; the quartiles and the midpoints between them
+    _probs = np.linspace(0, 1, 9)
+
+    def __init__(self):
+        self.n = 0
+        self._buffer = list()
+        self._q = None  # marker heights, shape (n_markers, T)
+        self._pos = None  # marker positions (1-based), shape (n_markers, T)
+
+    @property
+    def _n_markers(self):
+        return len(self._probs)
+
+    def add(self, curves):
+        """Add a (N, T) array of curves"""
+        for curve in curves:
+            self._add_1(np.asarray(curve, dtype=float))
+
+    def _add_1(self, curve):
+        self.n += 1
+        if self._q is None:
+            self._buffer.append(curve)
+            if len(self._buffer) == self._n_markers:
+                self._q = np.sort(np.array(self._buffer), axis=0)
+                self._pos = np.tile(
+                    np.arange(1.0, self._n_markers + 1)[:, None], (1, curve.size)
+                )
+                self._buffer = list()
+            return
+        q, pos = self._q, self._pos
+        # find the cell that the new observation falls into, and update the
+        # extreme markers
+        k = np.clip((curve >= q).sum(axis=0) - 1, 0, self._n_markers - 2)
+        q[0] = np.minimum(q[0], curve)
+        q[-1] = np.maximum(q[-1], curve)
+        pos += np.arange(self._n_markers)[:, None] > k
+        # adjust the heights of the middle markers, if necessary
+        desired = 1 + (self.n - 1) * self._probs
+        for i in range(1, self._n_markers - 1):
+            d = desired[i] - pos[i]
+            move = ((d >= 1) & (pos[i + 1] - pos[i] > 1)) | (
+                (d <= -1) & (pos[i - 1] - pos[i] < -1)
+            )
+            if not move.any():
+                continue
+            ds = np.sign(d)
+            q_parab = q[i] + ds / (pos[i + 1] - pos[i - 1]) * (
+                (pos[i] - pos[i - 1] + ds) * (q[i + 1] - q[i]) / (pos[i + 1] - pos[i])
+                + (pos[i + 1] - pos[i] - ds) * (q[i] - q[i - 1]) / (pos[i] - pos[i - 1])
+            )
+            # fall back to linear prediction if the parabolic one is not monotonic
+            ds_int = ds.astype(int)
+            cols = np.arange(q.shape[1])
+            q_nb = q[i + ds_int, cols]
+            pos_nb = pos[i + ds_int, cols]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                q_lin = q[i] + ds * (q_nb - q[i]) / (pos_nb - pos[i])
+            parab_ok = (q[i - 1] < q_parab) & (q_parab < q[i + 1])
+            q[i] = np.where(move, np.where(parab_ok, q_parab, q_lin), q[i])
+            pos[i] = np.where(move, pos[i] + ds, pos[i])
+
+    def merge(self, other):
+        """Merge another instance into this one.
+
+        The merged quartiles are approximated from the piecewise linear
+        distribution functions defined by the markers of both instances.
+        """
+        if other._q is None:
+            for curve in other._buffer:
+                self._add_1(curve)
+            return
+        if self._q is None:
+            buffer = self._buffer
+            self.n, self._q, self._pos = other.n, other._q.copy(), other._pos.copy()
+            self._buffer = list()
+            for curve in buffer:
+                self._add_1(curve)
+            return
+        n = self.n + other.n
+        q = np.empty_like(self._q)
+        for col in range(q.shape[1]):
+            xs = np.sort(np.concatenate([self._q[:, col], other._q[:, col]]))
+            cdf = (
+                self.n * self._cdf(xs, self._q[:, col], self._pos[:, col], self.n)
+                + other.n * self._cdf(xs, other._q[:, col], other._pos[:, col], other.n)
+            ) / n
+            q[:, col] = np.interp(self._probs, cdf, xs)
+        self._q = q
+        self._pos = np.tile(np.round(1 + (n - 1) * self._probs)[:, None], (1, q.shape[1]))
+        self.n = n
+
+    @staticmethod
+    def _cdf(x, q, pos, n):
+        return np.interp(x, q, (pos - 1) / (n - 1))
+
+    def result(self):
+        """Return tuple of (median, MAD)"""
+        if self._q is None:
+            curves = np.array(self._buffer)
+            return np.median(curves, axis=0), numutils.mad(curves, axis=0)
+        # the middle marker is the median, the quartiles are at 1/4 and 3/4
+        iqr = self._q[6] - self._q[2]
+        return self._q[4].copy(), 1.4826 * iqr / 2
+
+
+class CurveAccumulator:
+    """Accumulate statistics of curves without keeping the curves in memory.
+
+    Curves can be added in batches (e.g. one trial at a time), and the memory
+    use is constant per variable. Accumulators from e.g. parallel workers can
+    be merged.
+
+    Parameters
+    ----------
+    use_medians : bool
+        Compute (approximate) median and MAD instead of mean and stddev. See
+        average_model_data() for details.
+    """
+
+    def __init__(self, use_medians=None):
+        self.use_medians = bool(use_medians)
+        self._stats = dict()
+
+    def _new_stats(self):
+        return _RunningMedianMad() if self.use_medians else _RunningMeanStd()
+
+    def add(self, data):
+        """Add curves.
+
+        Parameters
+        ----------
+        data : dict
+            Curves keyed by variable, as returned by collect_trial_data(). The
+            values are (N, T) ndarrays or None.
+        """
+        for var, vardata in data.items():
+            if var not in self._stats:
+                self._stats[var] = self._new_stats()
+            if vardata is not None:
+                self._stats[var].add(vardata)
+
+    def merge(self, other):
+        """Merge another accumulator into this one"""
+        if other.use_medians != self.use_medians:
+            raise ValueError('cannot merge accumulators of different type')
+        for var, stats in other._stats.items():
+            if var not in self._stats:
+                self._stats[var] = self._new_stats()
+            self._stats[var].merge(stats)
+
+    def result(self):
+        """Return the accumulated statistics.
+
+        Returns
+        -------
+        tuple
+            Tuple of (avgdata, stddata, ncycles_ok), as returned by
+            average_model_data().
+        """
+        avgdata, stddata, ncycles_ok = dict(), dict(), dict()
+        for var, stats in self._stats.items():
+            ncycles_ok[var] = stats.n
+            if stats.n == 0:
+                avgdata[var], stddata[var] = None, None
             else:
-                stddata[var] = vardata.std(axis=0) if n_ok > 0 else None
-                avgdata[var] = vardata.mean(axis=0) if n_ok > 0 else None
-            logger.debug('%s: averaged %d/%d curves' % (var, n_ok, Ntot))
-            ncycles_ok[var] = n_ok
+                avgdata[var], stddata[var] = stats.result()
+        return avgdata, stddata, ncycles_ok
 
-    if not avgdata:
-        logger.warning('nothing averaged')
-    return (avgdata, stddata, ncycles_ok)
+
+def _collect_1_trial(
+    trial,
+    collect_types,
+    fp_cycles_only,
+    force_collect_all_cycles,
+    analog_len,
+    analog_envelope,
+):
+    """Collect cycle-normalized data from a single Trial instance.
+
+    Returns a dict with keys 'model' and 'emg'. The values are dicts keyed by
+    variable, with values of (cycles, data) where cycles is a list of Gaitcycle
+    instances and data is a NxT ndarray of the corresponding curves.
+    """
+    models_to_collect = models.models_all if 'model' in collect_types else list()
+    if 'emg' in collect_types:
+        emg_chs_to_collect = cfg.emg.channel_labels.keys()
+    else:
+        emg_chs_to_collect = list()
+
+    cycles = [None] if trial.is_static else trial.cycles
+
+    # first find the (variable, cycle) pairs to collect, so that the output
+    # arrays can be preallocated
+    to_collect = {'model': defaultdict(list), 'emg': defaultdict(list)}
+    for cycle in cycles:
+
+        # model data
+        for model in models_to_collect:
+            for var in model.varnames:
+                if not trial.is_static:
+                    # pick data only if var context matches cycle context
+                    # FIXME: should implement context() for models
+                    # (and a filter for context?)
+                    if var[0] != cycle.context:
+                        continue
+
+                    if not force_collect_all_cycles:
+                        # don't collect kinetics if cycle is not on forceplate
+                        if (
+                            model.is_kinetic_var(var) or fp_cycles_only
+                        ) and not cycle.on_forceplate:
+                            continue
+                to_collect['model'][var].append(cycle)
+
+        # EMG data
+        for ch in emg_chs_to_collect:
+            # check whether cycle matches channel context
+            if not trial.is_static and not trial.emg.context_ok(ch, cycle.context):
+                continue
+
+            if not force_collect_all_cycles:
+                if fp_cycles_only and not cycle.on_forceplate:
+                    continue
+            to_collect['emg'][ch].append(cycle)
+
+    trial_data = {'model': dict(), 'emg': dict()}
+
+    # collect model data
+    for var, var_cycles in to_collect['model'].items():
+        if trial.is_static:
+            _, data = trial.get_model_data(var, cycle=None)
+            data_var = data[None, :]
+        else:
+            # normalize to all cycles at once
+            _, data_var = trial.get_model_data_cycles(var, var_cycles)
+        rows_nan = np.all(np.isnan(data_var.reshape(len(var_cycles), -1)), axis=1)
+        if rows_nan.any():
+            logger.debug(f'no data for {trial.trialname}/{var}')
+        cycles_ok = [cyc for cyc, is_nan in zip(var_cycles, rows_nan) if not is_nan]
+        if cycles_ok:
+            trial_data['model'][var] = (cycles_ok, data_var[~rows_nan])
+
+    # collect EMG data
+    for ch, ch_cycles in to_collect['emg'].items():
+        data_ch, cycles_ok = np.empty((len(ch_cycles), analog_len)), list()
+        for cycle in ch_cycles:
+            # get data on analog sampling grid
+            try:
+                logger.debug(f'collecting EMG channel {ch} from {cycle}')
+                _, data = trial.get_emg_data(ch, cycle=cycle, envelope=analog_envelope)
+            except (KeyError, GaitDataError):
+                logger.warning(f'no channel {ch} for {trial}')
+                continue
+            # resample to requested grid
+            data_ch[len(cycles_ok)] = scipy.signal.resample(data, analog_len)
+            cycles_ok.append(cycle)
+        if cycles_ok:
+            trial_data['emg'][ch] = (cycles_ok, data_ch[: len(cycles_ok)])
+
+    return trial_data
+
+
+def _collect_trial_worker(trialfile, *args):
+    """Collect data from a trial file in a worker process.
+
+    Returns (is_static, collected_data), where the cycles are detached from the
+    trial instance (cycle.trial is None), so that they can be pickled.
+    """
+    trial = Trial(trialfile)
+    logger.info(f'collecting data for {trial.trialname}')
+    trial_data = _collect_1_trial(trial, *args)
+    for vardata in trial_data.values():
+        for var, (cycles, data) in vardata.items():
+            cycles_ = [copy(cyc) for cyc in cycles]
+            for cyc in cycles_:
+                if cyc is not None:
+                    cyc.trial = None
+            vardata[var] = (cycles_, data)
+    return trial.is_static, trial_data
 
 
 def collect_trial_data(
@@ -346,6 +734,8 @@ def collect_trial_data(
     force_collect_all_cycles=None,
     analog_len=None,
     analog_envelope=None,
+    n_jobs=None,
+    chunksize=None,
 ):
     """Read model and analog cycle-normalized data from trials into numpy arrays.
 
@@ -370,6 +760,15 @@ def collect_trial_data(
     analog_envelope : bool
         Whether to compute envelope of analog data or return raw data. By
         default the data will be enveloped.
+    n_jobs : int | None
+        Number of worker processes for loading trials given as filenames. None
+        or 1 loads the trials in the calling process, -1 uses all CPUs. Trial
+        instances are always processed in the calling process. The output
+        ordering does not depend on n_jobs. Note that the worker processes read
+        the config from file, so runtime changes to cfg are not seen by them.
+    chunksize : int | None
+        Number of trials submitted to a worker at a time. By default, the
+        trials are divided evenly between the workers.
 
     Returns
     -------
@@ -383,6 +782,8 @@ def collect_trial_data(
             cycles_all : dict
                 Nested dict of the collected cycles. First key is the variable type,
                 second key is the variable name. The values are Gaitcycle instances.
+                For trials loaded in worker processes, the cycles are detached
+                from the trial (cycle.trial is None).
 
         Example: you can obtain all collected curves for LKneeAnglesX as
         data_all['model']['LKneeAnglesX']. This will be a Nx101 ndarray. You can obtain
@@ -407,101 +808,112 @@ def collect_trial_data(
     if analog_envelope is None:
         analog_envelope = True
 
+    if n_jobs is None:
+        n_jobs = 1
+    elif n_jobs == -1:
+        n_jobs = os.cpu_count()
+
     if not trials:
         return None, None
 
     if not isinstance(trials, list):
         trials = [trials]
 
-    if 'model' in collect_types:
-        data_all['model'] = defaultdict(lambda: None)
-        cycles_all['model'] = defaultdict(list)
-        models_to_collect = models.models_all
-    else:
-        models_to_collect = list()
-
-    if 'emg' in collect_types:
-        data_all['emg'] = defaultdict(lambda: None)
-        cycles_all['emg'] = defaultdict(list)
-        emg_chs_to_collect = cfg.emg.channel_labels.keys()
-    else:
-        emg_chs_to_collect = list()
+    for datatype in ['model', 'emg']:
+        if datatype in collect_types:
+            data_all[datatype] = defaultdict(lambda: None)
+            cycles_all[datatype] = defaultdict(list)
+
+    collect_args = (
+        collect_types,
+        fp_cycles_only,
+        force_collect_all_cycles,
+        analog_len,
+        analog_envelope,
+    )
 
-    trial_types = list()
-    for trial_ in trials:
+    def _collect_serial(trial_):
         # create Trial instance in case we got filenames as args
         trial = trial_ if isinstance(trial_, Trial) else Trial(trial_)
         logger.info(f'collecting data for {trial.trialname}')
-        trial_types.append(trial.is_static)
+        return trial.is_static, _collect_1_trial(trial, *collect_args)
+
+    # filenames can be handed to worker processes; Trial instances cannot
+    trialfiles = [tr for tr in trials if not isinstance(tr, Trial)]
+    if n_jobs > 1 and len(trialfiles) > 1:
+        n_workers = min(n_jobs, len(trialfiles))
+        if chunksize is None:
+            chunksize = max(1, len(trialfiles) // n_workers)
+        logger.info(f'collecting {len(trialfiles)} trials using {n_workers} workers')
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            results_files = executor.map(
+                _collect_trial_worker,
+                trialfiles,
+                *[itertools.repeat(arg) for arg in collect_args],
+                chunksize=chunksize,
+            )
+            # results are yielded in the order of the input
+            results = [
+                _collect_serial(tr) if isinstance(tr, Trial) else next(results_files)
+                for tr in trials
+            ]
+    else:
+        results = (_collect_serial(tr) for tr in trials)
+
+    # merge the per-trial arrays
+    trial_types = list()
+    data_parts = {datatype: defaultdict(list) for datatype in data_all}
+    for is_static, trial_data in results:
+        trial_types.append(is_static)
         if any(trial_types) and not all(trial_types):
             raise GaitDataError('Cannot mix dynamic and static trials')
+        for datatype in data_all:
+            for var, (cycles, data) in trial_data[datatype].items():
+                cycles_all[datatype][var].extend(cycles)
+                data_parts[datatype][var].append(data)
+    # copy the parts into a single array per variable
+    for datatype, parts in data_parts.items():
+        for var, vardata in parts.items():
+            data_all[datatype][var] = np.concatenate(vardata)
 
-        cycles = [None] if trial.is_static else trial.cycles
-
-        for cycle in cycles:
-
-            # collect model data
-            for model in models_to_collect:
-                for var in model.varnames:
-                    if not trial.is_static:
-                        # pick data only if var context matches cycle context
-                        # FIXME: should implement context() for models
-                        # (and a filter for context?)
-                        if var[0] != cycle.context:
-                            continue
-
-                        if not force_collect_all_cycles:
-                            # don't collect kinetics if cycle is not on forceplate
-                            if (
-                                model.is_kinetic_var(var) or fp_cycles_only
-                            ) and not cycle.on_forceplate:
-                                continue
-
-                    _, data = trial.get_model_data(var, cycle=cycle)
-                    if np.all(np.isnan(data)):
-                        logger.debug(f'no data for {trial.trialname}/{var}')
-                    else:
-                        cycles_all['model'][var].append(cycle)
-                        if var not in data_all['model']:
-                            data_all['model'][var] = data[None, :]
-                        else:
-                            data_all['model'][var] = np.concatenate(
-                                [data_all['model'][var], data[None, :]]
-                            )
-
-            # collect EMG data
-            for ch in emg_chs_to_collect:
-                # check whether cycle matches channel context
-                if not trial.is_static and not trial.emg.context_ok(ch, cycle.context):
-                    continue
-
-                if not force_collect_all_cycles:
-                    if fp_cycles_only and not cycle.on_forceplate:
-                        continue
-
-                # get data on analog sampling grid
-                try:
-                    logger.debug(f'collecting EMG channel {ch} from {cycle}')
-                    _, data = trial.get_emg_data(
-                        ch, cycle=cycle, envelope=analog_envelope
-                    )
-                except (KeyError, GaitDataError):
-                    logger.warning(f'no channel {ch} for {trial}')
-                    continue
-                # resample to requested grid
-                data_cyc = scipy.signal.resample(data, analog_len)
-                cycles_all['emg'][ch].append(cycle)
-                if ch not in data_all['emg']:
-                    data_all['emg'][ch] = data_cyc[None, :]
-                else:
-                    data_all['emg'][ch] = np.concatenate(
-                        [data_all['emg'][ch], data_cyc[None, :]]
-                    )
     logger.info('collected %d trials' % len(trials))
     return data_all, cycles_all
 
 
-def curve_extract_values(curves, toeoffs):
+_PHASES = ['overall', 'stance', 'swing']
+# dtype for the values returned by curve_extract_values(); the nested fields
+# allow indexing as results['peaks']['swing']['max'], as for dicts
+_EXTRACTED_VALUES_DTYPE = np.dtype(
+    [
+        ('contact', float),
+        ('toeoff', float),
+        (
+            'extrema',
+            [
+                (phase, [('min', float), ('argmin', int), ('max', float), ('argmax', int)])
+                for phase in _PHASES
+            ],
+        ),
+        (
+            'peaks',
+            # peak indices are nan if there's no peak
+            [
+                (phase, [('min', float), ('argmin', float), ('max', float), ('argmax', float)])
+                for phase in _PHASES
+            ],
+        ),
+    ]
+)
+
+
+def _structured_to_dict(arr):
+    """Convert a structured array into a nested dict of lists"""
+    if arr.dtype.names is None:
+        return arr.tolist()
+    return {name: _structured_to_dict(arr[name]) for name in arr.dtype.names}
+
+
+def curve_extract_values(curves, toeoffs, as_array=False):
     """Extract values from gait curves.
 
     This extracts values such as swing phase maximum from a set of gait curves.
@@ -515,10 +927,12 @@ def curve_extract_values(curves, toeoffs):
     toeoffs : ndarray
         Nx1 array of toeoff frame indices, one for each curve. This frame
         separates the contact phase from the swing phase.
+    as_array : bool
+        If True, return the results as a structured ndarray instead of a dict.
 
     Returns
     -------
-    dict
+    dict | ndarray
         Dictionary of results, with following keys:
             'contact' : list of curve values at initial foot contact (frame 0)
             'toeoff' : list of curve values at toeoff
@@ -527,78 +941,51 @@ def curve_extract_values(curves, toeoffs):
         The nested dicts have keys:
             1: 'overall', 'swing', or 'stance' : the phase of the gait curve
             2: 'min', 'argmin', 'max', or 'argmax' : the values and indices
+        If as_array is True, a structured array of shape (N,) with the same
+        (nested) field names is returned instead.
 
     Thus, to get maximum peak values at swing phase, use
     results['peaks']['swing']['max'].
     """
-
-    if isinstance(curves, list):
-        curves = np.array(curves)
-    if isinstance(toeoffs, list):
-        toeoffs = np.array(toeoffs)
-    if curves.shape[0] != toeoffs.shape[0]:
+    curves = np.asarray(curves, dtype=float)
+    toeoffs = np.asarray(toeoffs, dtype=int).reshape(-1)
+    if curves.ndim != 2 or curves.shape[0] != toeoffs.shape[0]:
         raise ValueError('invalid shape of arguments')
-    # use defaultdict to reduct dict initialization boilerplate
-    results = defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
-    results['contact'] = list()
-    results['toeoff'] = list()
-
-    for curve, toeoff in zip(curves, toeoffs):
-
-        # extract stance and swing phases; swing phase begins at the toeoff frame
-        curve_stance, curve_swing = np.split(curve, [toeoff])
-
-        # get the simple extrema
-        results['extrema']['overall']['min'].append(curve.min())
-        results['extrema']['overall']['argmin'].append(curve.argmin())
-        results['extrema']['overall']['max'].append(curve.max())
-        results['extrema']['overall']['argmax'].append(curve.argmax())
-
-        results['extrema']['stance']['min'].append(curve_stance.min())
-        results['extrema']['stance']['argmin'].append(curve_stance.argmin())
-        results['extrema']['stance']['max'].append(curve_stance.max())
-        results['extrema']['stance']['argmax'].append(curve_stance.argmax())
-
-        # swing phase indices need to be offset by the toeff frame
-        results['extrema']['swing']['min'].append(curve_swing.min())
-        results['extrema']['swing']['argmin'].append(curve_swing.argmin() + toeoff)
-        results['extrema']['swing']['max'].append(curve_swing.max())
-        results['extrema']['swing']['argmax'].append(curve_swing.argmax() + toeoff)
-
+    ncurves, npts = curves.shape
+    if np.any((toeoffs <= 0) | (toeoffs >= npts)):
+        raise ValueError('toeoff frames must be inside the curves')
+    results = np.empty(ncurves, dtype=_EXTRACTED_VALUES_DTYPE)
+    rows = np.arange(ncurves)
+    results['contact'] = curves[:, 0]
+    results['toeoff'] = curves[rows, toeoffs]
+
+    # stance phase ends and swing phase begins at the toeoff frame
+    frames = np.arange(npts)
+    in_stance = frames < toeoffs[:, None]
+    phase_masks = {'overall': None, 'stance': in_stance, 'swing': ~in_stance}
+    segments = {
+        'overall': (None, None),
+        'stance': (None, toeoffs),
+        'swing': (toeoffs, None),
+    }
+    for phase in _PHASES:
+        # get the simple extrema; samples outside the phase are masked with
+        # infinities, while nans inside the phase still propagate
+        mask = phase_masks[phase]
+        extrema = results['extrema'][phase]
+        curves_min = curves if mask is None else np.where(mask, curves, np.inf)
+        curves_max = curves if mask is None else np.where(mask, curves, -np.inf)
+        extrema['min'] = curves_min.min(axis=1)
+        extrema['argmin'] = curves_min.argmin(axis=1)
+        extrema['max'] = curves_max.max(axis=1)
+        extrema['argmax'] = curves_max.argmax(axis=1)
         # get the peaks (local extrema)
-        ind, val = _get_local_min(curve)
-        results['peaks']['overall']['argmin'].append(ind)
-        results['peaks']['overall']['min'].append(val)
-        ind, val = _get_local_max(curve)
-        results['peaks']['overall']['argmax'].append(ind)
-        results['peaks']['overall']['max'].append(val)
-
-        ind, val = _get_local_min(curve_stance)
-        results['peaks']['stance']['argmin'].append(ind)
-        results['peaks']['stance']['min'].append(val)
-        ind, val = _get_local_max(curve_stance)
-        results['peaks']['stance']['argmax'].append(ind)
-        results['peaks']['stance']['max'].append(val)
-
-        ind, val = _get_local_min(curve_swing)
-        results['peaks']['swing']['argmin'].append(ind + toeoff)
-        results['peaks']['swing']['min'].append(val)
-        ind, val = _get_local_max(curve_swing)
-        results['peaks']['swing']['argmax'].append(ind + toeoff)
-        results['peaks']['swing']['max'].append(val)
-
-        # get some single values
-        results['contact'].append(curve[0])
-        results['toeoff'].append(curve[toeoff])
-
-        # if needed, we can finally return a regular dict
-        # results = dict(results)
-        # for k in 'extrema', 'peaks':
-        #     results[k] = dict(results[k])
-        #     for x, v in results[k].items():
-        #         results[k][x] = dict(v)
-
-    return results
+        start, stop = segments[phase]
+        peaks = results['peaks'][phase]
+        peaks['argmin'], peaks['min'] = _get_local_min_2d(curves, start, stop)
+        peaks['argmax'], peaks['max'] = _get_local_max_2d(curves, start, stop)
+
+    return results if as_array else _structured_to_dict(results)
 
 
 def _trials_extract_values(trials, from_models=None):
@@ -615,8 +1002,8 @@ def _trials_extract_values(trials, from_models=None):
     Returns
     -------
     dict
-        Dict keyed by variable. The values are dicts as returned by
-        curve_extract_values().
+        Dict keyed by variable. The values are structured arrays as returned
+        by curve_extract_values(as_array=True).
     """
     if from_models is None:
         from_models = [
@@ -634,7 +1021,7 @@ def _trials_extract_values(trials, from_models=None):
         data_var = data['model'][var]
         toeoffs_var = [cyc.toeoffn for cyc in cycles['model'][var]]
         if data_var is not None and toeoffs_var is not None:
-            vals[var] = curve_extract_values(data_var, toeoffs_var)
+            vals[var] = curve_extract_values(data_var, toeoffs_var, as_array=True)
         else:
             logger.info(f'no data for {var}')
     return vals
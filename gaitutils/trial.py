@@ -8,9 +8,10 @@ Read gait trials.
 """
 
 
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+from functools import lru_cache
 import numpy as np
-from scipy.interpolate import interp1d
+from scipy.interpolate import make_interp_spline
 import re
 import logging
 from pathlib import Path
@@ -66,6 +67,107 @@ def nexus_trial(from_c3d=False):
         return Trial(nexus.viconnexus())
 
 
+@lru_cache(maxsize=512)
+def _normalization_matrix(npts, npts_out=101):
+    """Return a matrix that resamples npts frames onto the 0..100% grid.
+
+    The matrix W (npts_out x npts) implements quadratic spline interpolation,
+    i.e. W @ y gives the same result as
+    interp1d(t, y, kind='quadratic')(tn), since the interpolating spline is
+    linear in y. The matrix is computed by interpolating the identity matrix.
+    Matrices are cached by cycle length.
+    """
+    t = np.linspace(0, 100, npts)
+    tn = np.linspace(0, 100, npts_out)
+    W = make_interp_spline(t, np.eye(npts), k=2)(tn)
+    W.flags.writeable = False
+    return W
+
+
+def normalize_to_cycles(data, cycles):
+    """Normalize frame-based data to several gait cycles in one call.
+
+    The result agrees with Gaitcycle.normalize() and with the previously used
+    interp1d(kind='quadratic') interpolation to within floating point rounding
+    (relative error < 1e-12).
+
+    Parameters
+    ----------
+    data : ndarray
+        NxM array of frame-based data, where N is the number of frames and M is
+        the number of variables. 1-D data is accepted as well.
+    cycles : list
+        List of Gaitcycle instances.
+
+    Returns
+    -------
+    tuple
+        A tuple of (tn, ndata) where tn is the normalized time (0..100%) and
+        ndata is a (n_cycles, 101, M) ndarray of the normalized data, or
+        (n_cycles, 101) for 1-D input data.
+    """
+    tn = np.linspace(0, 100, 101)
+    squeeze = data.ndim == 1
+    if squeeze:
+        data = data[:, np.newaxis]
+    ndata = np.empty((len(cycles), len(tn), data.shape[1]))
+    # cycles of equal length share the interpolation matrix, so process them
+    # in groups
+    inds_by_len = defaultdict(list)
+    for ind, cycle in enumerate(cycles):
+        if cycle.end > data.shape[0]:
+            raise GaitDataError('Cycle frame numbers exceed the available data')
+        inds_by_len[cycle.len].append(ind)
+    for npts, inds in inds_by_len.items():
+        W = _normalization_matrix(npts, len(tn))
+        blocks = np.stack([data[cycles[ind].start : cycles[ind].end] for ind in inds])
+        ndata[inds] = np.matmul(W, blocks)
+    if squeeze:
+        ndata = ndata[:, :, 0]
+    return tn, ndata
+
+
+class _CurveCache:
+    """A memory-bounded LRU cache for normalized curves.
+
+    The cached arrays are shared between callers, so they are made read-only.
+
+    Parameters
+    ----------
+    max_bytes : int | None
+        Memory budget for the cache. None for no limit.
+    """
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes
+        self._curves = OrderedDict()
+        self._nbytes = 0
+
+    def get(self, key):
+        """Return a cached curve, or None if not cached"""
+        curve = self._curves.get(key)
+        if curve is not None:
+            self._curves.move_to_end(key)
+        return curve
+
+    def put(self, key, curve):
+        """Store a curve, evicting least recently used curves if necessary"""
+        if self.max_bytes is not None and curve.nbytes > self.max_bytes:
+            return
+        curve.flags.writeable = False
+        if key in self._curves:
+            self._nbytes -= self._curves.pop(key).nbytes
+        self._curves[key] = curve
+        self._nbytes += curve.nbytes
+        while self.max_bytes is not None and self._nbytes > self.max_bytes:
+            _, curve_old = self._curves.popitem(last=False)
+            self._nbytes -= curve_old.nbytes
+
+    def clear(self):
+        self._curves.clear()
+        self._nbytes = 0
+
+
 class Noncycle:
     """Used in place of Gaitcycle when requesting unnormalized data.
 
@@ -181,16 +283,9 @@ class Gaitcycle:
         """
         if self.end > var.shape[0]:
             raise GaitDataError('Cycle frame numbers exceed the available data')
-        # convert 1D arrays to 2D
-        if len(var.shape) == 1:
-            var = var[:, np.newaxis]
-        ncols = var.shape[1]
-        idata = np.array(
-            [
-                interp1d(self.t, var[self.start : self.end, k], kind='quadratic')(self.tn)
-                for k in range(ncols)
-            ]
-        ).T
+        # quadratic spline interpolation, see _normalization_matrix()
+        W = _normalization_matrix(self.len, len(self.tn))
+        idata = W @ var[self.start : self.end]
         return self.tn, np.squeeze(idata)
 
     def crop_analog(self, var):
@@ -261,6 +356,8 @@ class Trial:
         self.source = source
         self._source_is_nexus = nexus._is_vicon_instance(source)
         meta = read_data.get_metadata(source)
+        # the unmodified metadata is kept for forceplate event detection
+        self._metadata = meta
         # to avoid boilerplate, insert the metadata directly as instance
         # attributes
         self.__dict__.update(meta)
@@ -281,7 +378,7 @@ class Trial:
         self.enfpath = enfpath
         if self.enfpath.is_file():
             logger.debug(f'reading Eclipse info from {self.enfpath}')
-            edata = eclipse.get_eclipse_keys(self.enfpath)
+            edata = eclipse._get_eclipse_keys_indexed(self.enfpath)
             # for convenience, eclipse_data returns '' for nonexistent keys
             self.eclipse_data = defaultdict(lambda: '', edata)
         else:
@@ -323,6 +420,18 @@ class Trial:
             self.cycles = list()
         self.ncycles = len(self.cycles)
 
+    @property
+    def cycles(self):
+        """The gait cycles of the trial (list of Gaitcycle instances)."""
+        return self._cycles
+
+    @cycles.setter
+    def cycles(self, cycles):
+        self._cycles = cycles
+        # normalized data depends on the cycles, so start with an empty cache
+        mb = cfg.trial.curve_cache_size
+        self._curve_cache = _CurveCache(None if mb is None else int(mb * 2**20))
+
     def _check_nexus_trial_still_valid(self):
         """Check if Nexus still has the original trial loaded.
 
@@ -393,6 +502,39 @@ class Trial:
             s += ')'
         return s
 
+    def _get_cycle(self, cycle):
+        """Resolve a cycle index into the corresponding Gaitcycle"""
+        if isinstance(cycle, int):
+            if cycle >= len(self.cycles) or cycle < 0:
+                raise ValueError('No such cycle')
+            cycle = self.cycles[cycle]
+        return cycle
+
+    def _get_normalized_data(self, key, get_data, cycle, analog=False):
+        """Return data normalized to a gait cycle, using the curve cache.
+
+        Normalized data (or cropped data, if analog=True) is cached under key
+        and the cycle frames. Including the frames in the cache key ensures
+        that modified cycles or events never return stale data. get_data is a
+        function returning the unnormalized data; it is only called on a cache
+        miss. Unnormalized data is not cached.
+        """
+        cycle = self._get_cycle(cycle)
+        if not isinstance(cycle, Gaitcycle):
+            if analog:
+                return self.normalize_analog_to_cycle(get_data(), cycle)
+            return self.normalize_to_cycle(get_data(), cycle)
+        key = key + (cycle.start, cycle.end)
+        ndata = self._curve_cache.get(key)
+        if ndata is None:
+            if analog:
+                # copy the cropped data, so that it does not keep the full data alive
+                ndata = np.array(cycle.crop_analog(get_data())[1])
+            else:
+                _, ndata = cycle.normalize(get_data())
+            self._curve_cache.put(key, ndata)
+        return (cycle.tn_analog if analog else cycle.tn), ndata
+
     def normalize_to_cycle(self, data, cycle):
         """Normalize frame-based data to a gait cycle.
 
@@ -404,10 +546,7 @@ class Trial:
             The gait cycle to normalize to. If Noncycle or None, returns unnormalized
             data. If int, return nth cycle from the trial cycles list.
         """
-        if isinstance(cycle, int):
-            if cycle >= len(self.cycles) or cycle < 0:
-                raise ValueError('No such cycle')
-            cycle = self.cycles[cycle]
+        cycle = self._get_cycle(cycle)
         if isinstance(cycle, Gaitcycle):
             t, data = cycle.normalize(data)
         elif cycle is None or isinstance(cycle, Noncycle):
@@ -428,10 +567,7 @@ class Trial:
             The gait cycle to normalize to. If Noncycle or None, returns unnormalized
             data. If int, return nth cycle from the trial cycles list.
         """
-        if isinstance(cycle, int):
-            if cycle >= len(self.cycles) or cycle < 0:
-                raise ValueError('No such cycle')
-            cycle = self.cycles[cycle]
+        cycle = self._get_cycle(cycle)
         if isinstance(cycle, Gaitcycle):
             t, data = cycle.crop_analog(data)
         elif cycle is None or isinstance(cycle, Noncycle):
@@ -441,6 +577,15 @@ class Trial:
             raise ValueError('invalid type for cycle argument')
         return t, data
 
+    @property
+    def _full_forceplate_data(self):
+        """Return the forceplate data of all plates."""
+        if self._forceplate_data is None:
+            if self._source_is_nexus:
+                self._check_nexus_trial_still_valid()
+            self._forceplate_data = read_data.get_forceplate_data(self.source)
+        return self._forceplate_data
+
     @property
     def _full_marker_data(self):
         """Return the full marker data dict."""
@@ -479,8 +624,39 @@ class Trial:
             Tuple of (t, data) where t is the time axis as 1-dim ndarray, and data
             is the model variable data as 1-dim ndarray.
         """
+        return self._get_normalized_data(
+            ('model', var), lambda: self._get_modelvar(var), cycle
+        )
+
+    def get_model_data_cycles(self, var, cycles):
+        """Return model variable data normalized to several gait cycles.
+
+        Parameters
+        ----------
+        var : string
+            The name of the model variable (e.g. 'LHipMomentX')
+        cycles : list
+            List of Gaitcycle instances to normalize to.
+
+        Returns
+        -------
+        t_data : tuple
+            Tuple of (t, data) where t is the normalized time axis and data is a
+            (n_cycles, 101) ndarray of the normalized data.
+        """
         data = self._get_modelvar(var)
-        return self.normalize_to_cycle(data, cycle)
+        keys = [('model', var, cyc.start, cyc.end) for cyc in cycles]
+        ndata = [self._curve_cache.get(key) for key in keys]
+        # normalize the cycles that were not cached in a single batch
+        missing = [k for k, curve in enumerate(ndata) if curve is None]
+        if missing:
+            _, ndata_missing = normalize_to_cycles(data, [cycles[k] for k in missing])
+            for k, curve in zip(missing, ndata_missing):
+                ndata[k] = curve.copy()
+                self._curve_cache.put(keys[k], ndata[k])
+        if not ndata:
+            return self.tn, np.empty((0, len(self.tn)) + data.shape[1:])
+        return self.tn, np.stack(ndata)
 
     def get_emg_data(self, ch, cycle=None, envelope=False):
         """Return trial data for an EMG channel.
@@ -505,8 +681,13 @@ class Trial:
             Tuple of (t, data) where t is the time axis as 1-dim ndarray, and
             data is the EMG data as 1-dim ndarray.
         """
-        data = self.emg.get_channel_data(ch, envelope=envelope)
-        return self.normalize_analog_to_cycle(data, cycle)
+        key = ('emg', ch) + self.emg._processing_key(envelope)
+        return self._get_normalized_data(
+            key,
+            lambda: self.emg.get_channel_data(ch, envelope=envelope),
+            cycle,
+            analog=True,
+        )
 
     def get_marker_data(self, marker, cycle=None):
         """Return position data for a given marker.
@@ -522,8 +703,9 @@ class Trial:
             Tuple of (t, data) where t is the time axis as (Nt,) -shape ndarray, and data
             is the marker data as a (Nt, 3) ndarray.
         """
-        data = self._full_marker_data[marker]
-        return self.normalize_to_cycle(data, cycle)
+        return self._get_normalized_data(
+            ('marker', marker), lambda: self._full_marker_data[marker], cycle
+        )
 
     def get_forceplate_data(self, nplate, kind='force', cycle=None):
         """Return forceplate data.
@@ -543,18 +725,15 @@ class Trial:
             Tuple of (t, data) where t is the time axis as (Nt,) -shape ndarray,
             and data is the marker data as a (Nt, 3) ndarray.
         """
-        if not self._forceplate_data:
-            if self._source_is_nexus:
-                self._check_nexus_trial_still_valid()
-            self._forceplate_data = read_data.get_forceplate_data(self.source)
-        if nplate < 0 or nplate >= len(self._forceplate_data):
+        fpdata = self._full_forceplate_data
+        if nplate < 0 or nplate >= len(fpdata):
             raise GaitDataError('Invalid plate index %d' % nplate)
         if kind == 'force':
-            data = self._forceplate_data[nplate]['F']
+            data = fpdata[nplate]['F']
         elif kind == 'moment':
-            data = self._forceplate_data[nplate]['M']
+            data = fpdata[nplate]['M']
         elif kind == 'cop':
-            data = self._forceplate_data[nplate]['CoP']
+            data = fpdata[nplate]['CoP']
         else:
             raise ValueError('Invalid kind of forceplate data requested')
         return self.normalize_analog_to_cycle(data, cycle)
@@ -564,15 +743,25 @@ class Trial:
         raise NotImplementedError
 
     def _get_fp_events(self):
-        """Read the forceplate events."""
+        """Detect the forceplate events.
+
+        Uses the data already read by the trial, so that the source is not
+        read again.
+        """
         try:
             if cfg.trial.use_eclipse_fp_info and self.use_eclipse_fp_info:
                 fp_info = eclipse._eclipse_forceplate_keys(self.eclipse_data)
             else:
                 fp_info = None
-            marker_data = self._full_marker_data
-            return utils.detect_forceplate_events(
-                self.source, marker_data=marker_data, eclipse_fp_info=fp_info
+            fpdata = self._full_forceplate_data
+            if not fpdata:
+                logger.warning('no forceplates')
+                return GaitEvents()
+            return utils._detect_forceplate_events(
+                self._metadata,
+                fpdata,
+                self._full_marker_data,
+                eclipse_fp_info=fp_info,
             )
         except GaitDataError:
             logger.warning('Could not detect forceplate events')
@@ -6,8 +6,8 @@ Utility functions for processing gait data.
 @author: Jussi (jnu@iki.fi)
 """
 
+from collections import defaultdict
 from scipy import signal
-from matplotlib import path
 import matplotlib.pyplot as plt
 import numpy as np
 import logging
@@ -20,6 +20,10 @@ from .events import GaitEvent, GaitEvents
 
 logger = logging.getLogger(__name__)
 
+# foot codes returned by _leading_foot()
+_FOOT_GAP, _FOOT_LEFT, _FOOT_RIGHT = -1, 0, 1
+_FOOT_CONTEXTS = {_FOOT_LEFT: 'L', _FOOT_RIGHT: 'R'}
+
 
 def get_contexts(right_first=False):
     """Return the usual contexts and their names as pairs.
@@ -111,6 +115,54 @@ def _step_width(source):
     return sw
 
 
+class _MarkerData(dict):
+    """Marker data dict that caches averaged data.
+
+    Behaves as a normal dict of marker data (see read_data.get_marker_data()).
+    In addition, avg_markerdata() caches its results in the instance. A cached
+    result is only used if the dict still holds the same marker arrays.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._avg_cache = dict()
+
+
+def _avg_markerdata(mkrdata, markers, roi, avg_velocity):
+    """Compute averaged marker data in a single pass over all markers.
+
+    Returns a tuple of (avg, gap_markers), where avg is the average of the
+    markers without gaps inside the ROI (None if there are no such markers) and
+    gap_markers lists the markers with gaps. See avg_markerdata() for details.
+    """
+    # shape (n_markers, n_frames, 3)
+    mdata = np.stack([mkrdata[marker] for marker in markers])
+    if avg_velocity:
+        mdata = np.gradient(mdata, axis=1)
+    # gap frames are all-zero frames, excluding leading and trailing gaps
+    # (see marker_gaps())
+    nonzero = np.any(mdata, axis=2)
+    nframes = nonzero.shape[1]
+    first = np.argmax(nonzero, axis=1)
+    last = nframes - 1 - np.argmax(nonzero[:, ::-1], axis=1)
+    frames = np.arange(nframes)
+    gaps = np.logical_and(frames >= first[:, None], frames <= last[:, None])
+    gaps &= ~nonzero
+    # markers that are all zero do not have gaps
+    gaps &= np.any(nonzero, axis=1)[:, None]
+    if roi is None:
+        roi = [0, nframes]
+    roi_start, roi_end = max(int(roi[0]), 0), max(int(roi[1]), 0)
+    has_gaps = np.any(gaps[:, roi_start:roi_end], axis=1)
+    gap_markers = [marker for marker, gap in zip(markers, has_gaps) if gap]
+    if np.all(has_gaps):
+        return None, gap_markers
+    ok_data = mdata[~has_gaps]
+    avg = np.sum(ok_data, axis=0, dtype=float) / len(ok_data)
+    avg.flags.writeable = False
+    return avg, gap_markers
+
+
 def avg_markerdata(mkrdata, markers, roi=None, fail_on_gaps=True, avg_velocity=False):
     """Average marker data.
 
@@ -131,34 +183,32 @@ def avg_markerdata(mkrdata, markers, roi=None, fail_on_gaps=True, avg_velocity=F
     Returns
     -------
     ndarray
-        The averaged data (Nx3).
+        The averaged data (Nx3). The array is read-only, since it may be
+        cached in the marker data dict.
     """
-    data_shape = mkrdata[markers[0]].shape
-    mdata_avg = np.zeros(data_shape)
-    if roi is None:
-        roi = [0, data_shape[0]]
-    roi_frames = np.arange(roi[0], roi[1])
-    n_ok = 0
-    for marker in markers:
-        mdata = mkrdata[marker]
-        if avg_velocity:
-            mdata = np.gradient(mdata)[0]
-        gap_frames = marker_gaps(mdata)
-        if np.intersect1d(roi_frames, gap_frames).size > 0:
-            if fail_on_gaps:
-                raise GaitDataError(f'Averaging data for {marker} has gaps')
-            else:
-                logger.warning(
-                    f'marker {marker} cannot be included in average due to gaps'
-                )
-                continue
-        else:
-            mdata_avg += mdata
-            n_ok += 1
-    if n_ok == 0:
-        raise GaitDataError('all markers have gaps, cannot average')
+    markers = list(markers)
+    roi_key = None if roi is None else tuple(roi)
+    key = (tuple(markers), roi_key, bool(avg_velocity))
+    cache = getattr(mkrdata, '_avg_cache', None)
+    mdata_arrays = [mkrdata[marker] for marker in markers]
+    if cache is not None and key in cache:
+        cached_arrays, result = cache[key]
+        if any(a is not b for a, b in zip(cached_arrays, mdata_arrays)):
+            result = None  # marker data has been replaced
     else:
-        return mdata_avg / n_ok
+        result = None
+    if result is None:
+        result = _avg_markerdata(mkrdata, markers, roi, avg_velocity)
+        if cache is not None:
+            cache[key] = mdata_arrays, result
+    mdata_avg, gap_markers = result
+    for marker in gap_markers:
+        if fail_on_gaps:
+            raise GaitDataError(f'Averaging data for {marker} has gaps')
+        logger.warning(f'marker {marker} cannot be included in average due to gaps')
+    if mdata_avg is None:
+        raise GaitDataError('all markers have gaps, cannot average')
+    return mdata_avg
 
 
 # FIXME: marker sets could be moved into models.py?
@@ -307,28 +357,32 @@ def _normalize(V):
         return V / Vn[:, np.newaxis]
 
 
-def _get_foot_points(mkrdata, context, footlen=None):
+def _get_foot_points(mkrdata, context, footlen=None, frames=None):
     """Estimate points in the xy plane enclosing the foot.
 
     Foot is modeled as a triangle with three points: heel, lateral leading edge
-    (small toe) and medial leading edge (hallux)"""
+    (small toe) and medial leading edge (hallux). If frames is given, the points
+    are computed only at those frames (the foot length estimate still uses all
+    frames)."""
     # marker data as N x 3 matrices
     heeP = mkrdata[context + 'HEE']
     toeP = mkrdata[context + 'TOE']
     ankP = mkrdata[context + 'ANK']
-    # heel - toe vectors
-    htV = toeP - heeP
-    htVn = _normalize(htV)
-    # heel - ankle vectors
-    haV = ankP - heeP
-    ha_len = np.linalg.norm(haV, axis=1)
     # end point of foot (just beyond 2nd toe)
     if footlen is None:
         # rough estimate based on marker distances
         logger.debug('using estimated foot length')
+        ha_len = np.linalg.norm(ankP - heeP, axis=1)
         # a lot of zero entries (gaps) can throw off the median computation
         ha_len_nonzero = ha_len[np.where(ha_len > 0)]
         footlen = np.median(ha_len_nonzero) * cfg.autoproc.foot_relative_len
+    if frames is not None:
+        heeP, toeP, ankP = heeP[frames], toeP[frames], ankP[frames]
+    # heel - toe vectors
+    htV = toeP - heeP
+    htVn = _normalize(htV)
+    # heel - ankle vectors
+    haV = ankP - heeP
     foot_end = heeP + htVn * footlen
     # projection of HEE-ANK to HEE-TOE line
     ha_htV = htVn * np.sum(haV * htVn, axis=1)[:, np.newaxis]
@@ -351,11 +405,13 @@ def _get_foot_points(mkrdata, context, footlen=None):
     return {'heel': heel_edge, 'lateral': lat_edge, 'medial': med_edge, 'toe': foot_end}
 
 
-def _leading_foot(mkrdata, roi=None):
+def _leading_foot(mkrdata, roi=None, frames=None):
     """Determine which foot is leading (ahead in the direction of gait).
-    Returns n-length list of 'R' or 'L' correspondingly (n = number of
-    frames). Gaps are indicated as None. mkrdata must include foot and
-    pelvis markers"""
+
+    Returns an int8 array of foot codes (_FOOT_RIGHT or _FOOT_LEFT) for each
+    frame. Gaps are indicated as _FOOT_GAP. If frames is given, the codes are
+    computed for those frames only, and frames outside the data are indicated
+    as gaps. mkrdata must include foot and pelvis markers"""
     subj_pos = avg_markerdata(
         mkrdata, cfg.autoproc.track_markers, roi=roi, fail_on_gaps=False
     )
@@ -375,10 +431,16 @@ def _leading_foot(mkrdata, roi=None):
     rfoot = avg_markerdata(
         mkrdata, cfg.autoproc.right_foot_markers, roi=roi, fail_on_gaps=False
     )[:, gait_dim]
-    return [
-        None if R == 0.0 or L == 0.0 else ('R' if cmpfun(R, L) else 'L')
-        for R, L in zip(rfoot, lfoot)
-    ]
+    if frames is not None:
+        frames = np.asarray(frames, dtype=int)
+        frames_ok = np.logical_and(frames >= 0, frames < len(rfoot))
+        # frames outside the data will read as zeros, i.e. gaps
+        frames_ = np.where(frames_ok, frames, 0)
+        lfoot = np.where(frames_ok, lfoot[frames_], 0.0)
+        rfoot = np.where(frames_ok, rfoot[frames_], 0.0)
+    codes = np.where(cmpfun(rfoot, lfoot), _FOOT_RIGHT, _FOOT_LEFT).astype(np.int8)
+    codes[np.logical_or(rfoot == 0.0, lfoot == 0.0)] = _FOOT_GAP
+    return codes
 
 
 def _trial_median_velocity(source, return_curve=False):
@@ -410,12 +472,74 @@ def _trial_median_velocity(source, return_curve=False):
         return vel_ms
 
 
+def _points_in_convex_polys(points, polys):
+    """Test whether points are inside convex polygons in the xy plane.
+
+    Parameters
+    ----------
+    points : ndarray
+        The points, shape (..., 2) or (..., 3). The 3rd dim is ignored.
+    polys : ndarray
+        The ordered vertices (clockwise or counterclockwise) of P convex
+        polygons, shape (P, V, 2) or (P, V, 3). The 3rd dim is ignored.
+
+    Returns
+    -------
+    ndarray
+        Booleans of shape (..., P), True where a point is strictly inside a
+        polygon. Points with nan coordinates are not inside any polygon.
+    """
+    verts = np.asarray(polys, dtype=float)[..., :2]
+    edges = np.roll(verts, -1, axis=-2) - verts
+    # vectors from each vertex to each point, shape (..., P, V, 2)
+    pts = np.asarray(points, dtype=float)[..., np.newaxis, np.newaxis, :2]
+    rel = pts - verts
+    # a point is inside a convex polygon iff it is on the same side of each edge
+    cross = edges[..., 0] * rel[..., 1] - edges[..., 1] * rel[..., 0]
+    return np.all(cross > 0, axis=-1) | np.all(cross < 0, axis=-1)
+
+
 def _point_in_poly(poly, pt):
-    """Point-in-polygon. poly is ordered nx3 array of vertices and P is mx3
-    array of points. Returns mx3 array of booleans. 3rd dim is currently
-    ignored"""
-    p = path.Path(poly[:, :2])
-    return p.contains_point(pt)
+    """Point-in-polygon for a convex polygon. poly is ordered nx3 array of
+    vertices and pt is a point (3 elements). 3rd dim is currently ignored"""
+    return bool(_points_in_convex_polys(pt, poly[np.newaxis])[0])
+
+
+def _foot_plate_contacts(mkrdata, plate_corners, checks):
+    """Check foot contacts with forceplates.
+
+    checks is a list of (frame, context, footlen) tuples. The foot points are
+    computed only at the checked frames, and all of them are tested against all
+    the plates (given by their corners) at once. Returns an array of shape
+    (len(checks), n_plates) with values 0, 1, 2 for: foot completely outside
+    plate, partially outside plate, inside plate, respectively.
+    """
+    contacts = np.zeros((len(checks), len(plate_corners)), dtype=int)
+    if not checks or not plate_corners:
+        return contacts
+    # compute the foot points per foot and foot length
+    check_inds = defaultdict(list)
+    for check_ind, (frame, context, footlen) in enumerate(checks):
+        check_inds[context, footlen].append(check_ind)
+    foot_points = np.empty((len(checks), 4, 2))
+    for (context, footlen), inds in check_inds.items():
+        frames = [checks[check_ind][0] for check_ind in inds]
+        pts = _get_foot_points(mkrdata, context, footlen, frames=frames)
+        foot_points[inds] = np.stack([pts_[:, :2] for pts_ in pts.values()], axis=1)
+    # shape (n_checks, n_foot_points, n_plates)
+    pts_ok = _points_in_convex_polys(foot_points, np.stack(plate_corners))
+    contacts[np.any(pts_ok, axis=1)] = 1
+    contacts[np.all(pts_ok, axis=1)] = 2
+    return contacts
+
+
+def _event_detection_markers():
+    """Markers required for marker-based event detection"""
+    return (
+        cfg.autoproc.right_foot_markers
+        + cfg.autoproc.left_foot_markers
+        + cfg.autoproc.track_markers
+    )
 
 
 def detect_forceplate_events(
@@ -438,29 +562,43 @@ def detect_forceplate_events(
     If roi is given e.g. [100, 300], all marker data checks will be restricted
     to roi.
     """
+    from . import read_data
 
-    def _foot_plate_check(fpdata, marker_data, fr0, context, footlen):
-        """Helper for foot-plate check.
+    logger.debug(f'detecting forceplate events from {source}')
+    info = read_data.get_metadata(source)
+    fpdata = read_data.get_forceplate_data(source)
+    if not fpdata:
+        logger.warning('no forceplates')
+        return GaitEvents()
+    if marker_data is None:  # not supplied as parameter
+        marker_data = read_data.get_marker_data(source, _event_detection_markers())
+    return _detect_forceplate_events(
+        info,
+        fpdata,
+        marker_data,
+        eclipse_fp_info=eclipse_fp_info,
+        roi=roi,
+        return_nplates=return_nplates,
+    )
 
-        Returns 0, 1, 2 for: completely outside plate, partially outside plate,
-        inside plate, respectively.
-        """
-        foot_points = _get_foot_points(marker_data, context, footlen)
-        plate_corners = fpdata['plate_corners']
-        # logger.debug(f'{plate_corners=}')
-        pts_ok = list()
-        for label, pts in foot_points.items():
-            foot_point = pts[fr0, :]
-            # logger.debug(f'{foot_point=}')
-            pt_ok = _point_in_poly(plate_corners, foot_point)
-            logger.debug(f"{label} point {'' if pt_ok else 'not '}on plate")
-            pts_ok.append(pt_ok)
-        if all(pts_ok):
-            return 2
-        elif any(pts_ok):
-            return 1
-        else:
-            return 0
+
+def _detect_forceplate_events(
+    info,
+    fpdata,
+    marker_data,
+    eclipse_fp_info=None,
+    roi=None,
+    events_marker=None,
+    return_nplates=False,
+):
+    """Detect forceplate events from already loaded data.
+
+    Does the work of detect_forceplate_events(), but does not read anything
+    from the data source. info is the trial metadata and fpdata the forceplate
+    data (see read_data.get_metadata() and read_data.get_forceplate_data()).
+    If events_marker (marker-based gait events) is not given, it is computed
+    from marker_data.
+    """
 
     def _threshold_forceplate(fp, bodymass=None):
         """Get candidate foot strike and toeoff frames by considering force only"""
@@ -532,14 +670,7 @@ def detect_forceplate_events(
             detect_context = True
         return context, detect_context
 
-    from . import read_data
-
-    logger.debug(f'detecting forceplate events from {source}')
     results = GaitEvents()
-
-    # get subject info
-    info = read_data.get_metadata(source)
-    fpdata = read_data.get_forceplate_data(source)
     if not fpdata:
         logger.warning('no forceplates')
         return results
@@ -556,24 +687,22 @@ def detect_forceplate_events(
     else:
         logger.debug('foot length parameter not set')
     bodymass = info['subj_params']['Bodymass']
-    req_markers = (
-        cfg.autoproc.right_foot_markers
-        + cfg.autoproc.left_foot_markers
-        + cfg.autoproc.track_markers
-    )
-    if marker_data is None:  # not supplied as parameter
-        marker_data = read_data.get_marker_data(source, req_markers)
-    if not all(mkr in marker_data for mkr in req_markers):
+    if not all(mkr in marker_data for mkr in _event_detection_markers()):
         logger.warning('required markers missing, cannot detect forceplate contacts')
         return results
 
     datalen = info['length']
 
-    logger.debug('acquiring marker-based gait events')
-    events_marker = automark_events(source, mkrdata=marker_data, roi=roi)
+    if events_marker is None:
+        logger.debug('acquiring marker-based gait events')
+        events_marker = _automark_events(marker_data, info['framerate'], roi=roi)
 
-    # loop over the plates; our internal forceplate index is 0-based
-    for plate_ind, fpdata_this in enumerate(fpdata):
+    # allows foot to settle for 50 ms after strike
+    settle_fr = int(50 / 1000 * info['framerate'])
+    # first pass over the plates (our internal forceplate index is 0-based):
+    # detect strikes from the force data
+    plates = list()
+    for fpdata_this in fpdata:
         eclipse_key = fpdata_this['eclipse_key']
         logger.debug(f'analyzing plate {eclipse_key}')
         context, detect_context = _context_from_eclipse(eclipse_fp_info, eclipse_key)
@@ -582,74 +711,88 @@ def detect_forceplate_events(
         )
         if not force_checks_ok:
             context = None
+        plates.append(
+            {
+                'eclipse_key': eclipse_key,
+                'context': context,
+                'detect_context': force_checks_ok and detect_context,
+                'strike_fr': strike_fr,
+                'toeoff_fr': toeoff_fr,
+                # required foot-plate contacts as (index into foot_checks,
+                # result), where the result is 0, 1 or 2 for foot completely
+                # outside plate, partially outside plate or inside plate
+                'required_contacts': list(),
+            }
+        )
 
-        # check foot markers (or points) to determine context and validity
-        if force_checks_ok and detect_context:
-            logger.debug('autodetecting context')
-            # allows foot to settle for 50 ms after strike
-            settle_fr = int(50 / 1000 * info['framerate'])
-            fr0 = strike_fr + settle_fr
-            # context is determined by leading foot at strike time
-            this_context = _leading_foot(marker_data, roi=roi)[fr0]
-            if this_context is None:
-                raise GaitDataError('cannot determine leading foot from marker data')
-            footlen = rfootlen if this_context == 'R' else lfootlen
-            logger.debug(f'checking contact for leading foot: {this_context}')
-            foot_contacts_ok = (
-                _foot_plate_check(fpdata_this, marker_data, fr0, this_context, footlen)
-                == 2
-            )
-            # to eliminate double contacts, check that contralateral foot is not on plate
-            # this needs marker-based events
-            if foot_contacts_ok and events_marker is not None:
-                contra_context = 'R' if this_context == 'L' else 'L'
-                contra_strikes = [
-                    ev.frame
-                    for ev in events_marker.get_events('strike', contra_context)
-                ]
-                contra_strikes = np.array(contra_strikes)
-                contra_strikes_next = contra_strikes[
-                    np.where(contra_strikes > strike_fr)
-                ]
-                if contra_strikes_next.size == 0:
-                    logger.debug('no subsequent contralateral strike')
-                else:
-                    fr0 = contra_strikes_next[0] + settle_fr
-                    if fr0 > datalen:  # data overrun
-                        logger.debug('no subsequent contralateral strike (overrun)')
-                    else:
-                        logger.debug(
-                            'checking the subsequent contralateral strike '
-                            '(at frame %d)' % fr0
-                        )
-                        contra_next_ok = (
-                            _foot_plate_check(
-                                fpdata_this, marker_data, fr0, contra_context, footlen
-                            )
-                            == 0
-                        )
-                        foot_contacts_ok &= contra_next_ok
-                contra_strikes_prev = contra_strikes[
-                    np.where(contra_strikes < strike_fr)
-                ]
-                if contra_strikes_prev.size == 0:
-                    logger.debug('no previous contralateral strike')
+    # check foot markers (or points) to determine context and validity
+    detect_plates = [plate for plate in plates if plate['detect_context']]
+    leading_feet = list()
+    if detect_plates:
+        # context is determined by leading foot at strike time
+        leading_feet = _leading_foot(
+            marker_data,
+            roi=roi,
+            frames=[plate['strike_fr'] + settle_fr for plate in detect_plates],
+        )
+    foot_checks = list()  # (frame, context, footlen) for each check
+    for plate, leading_foot in zip(detect_plates, leading_feet):
+        logger.debug(f"autodetecting context for {plate['eclipse_key']}")
+        strike_fr = plate['strike_fr']
+        this_context = _FOOT_CONTEXTS.get(leading_foot)
+        if this_context is None:
+            raise GaitDataError('cannot determine leading foot from marker data')
+        footlen = rfootlen if this_context == 'R' else lfootlen
+        logger.debug(f'checking contact for leading foot: {this_context}')
+        plate['required_contacts'].append((len(foot_checks), 2))
+        foot_checks.append((strike_fr + settle_fr, this_context, footlen))
+        # to eliminate double contacts, check that contralateral foot is not on plate
+        # this needs marker-based events
+        if events_marker is not None:
+            contra_context = 'R' if this_context == 'L' else 'L'
+            contra_strikes = [
+                ev.frame for ev in events_marker.get_events('strike', contra_context)
+            ]
+            contra_strikes = np.array(contra_strikes)
+            contra_strikes_next = contra_strikes[np.where(contra_strikes > strike_fr)]
+            if contra_strikes_next.size == 0:
+                logger.debug('no subsequent contralateral strike')
+            else:
+                fr0 = contra_strikes_next[0] + settle_fr
+                if fr0 >= datalen:  # data overrun
+                    logger.debug('no subsequent contralateral strike (overrun)')
                 else:
-                    fr0 = contra_strikes_prev[-1] + settle_fr
                     logger.debug(
-                        'checking previous contact for contralateral '
-                        'foot (at frame %d)' % fr0
-                    )
-                    contra_prev_ok = (
-                        _foot_plate_check(
-                            fpdata_this, marker_data, fr0, contra_context, footlen
-                        )
-                        == 0
+                        'checking the subsequent contralateral strike '
+                        '(at frame %d)' % fr0
                     )
-                    foot_contacts_ok &= contra_prev_ok
-            context = this_context if foot_contacts_ok else None
-
-        if context:
+                    plate['required_contacts'].append((len(foot_checks), 0))
+                    foot_checks.append((fr0, contra_context, footlen))
+            contra_strikes_prev = contra_strikes[np.where(contra_strikes < strike_fr)]
+            if contra_strikes_prev.size == 0:
+                logger.debug('no previous contralateral strike')
+            else:
+                fr0 = contra_strikes_prev[-1] + settle_fr
+                logger.debug(
+                    'checking previous contact for contralateral '
+                    'foot (at frame %d)' % fr0
+                )
+                plate['required_contacts'].append((len(foot_checks), 0))
+                foot_checks.append((fr0, contra_context, footlen))
+        plate['context'] = this_context
+
+    # do all the foot-plate checks at once
+    plate_corners = [fpdata_this['plate_corners'] for fpdata_this in fpdata]
+    contacts = _foot_plate_contacts(marker_data, plate_corners, foot_checks)
+
+    for plate_ind, plate in enumerate(plates):
+        eclipse_key, context = plate['eclipse_key'], plate['context']
+        foot_contacts_ok = all(
+            contacts[check_ind, plate_ind] == result
+            for check_ind, result in plate['required_contacts']
+        )
+        if context and foot_contacts_ok:
+            strike_fr, toeoff_fr = plate['strike_fr'], plate['toeoff_fr']
             logger.debug(f'{eclipse_key}: {context} strike at frame {strike_fr}')
             strike_ev = GaitEvent(
                 strike_fr, 'strike', context, forceplate_index=plate_ind
@@ -707,10 +850,30 @@ def automark_events(
         Plot velocity curves and events using matplotlib. Mostly for debug purposes.
     """
 
-    from .read_data import get_metadata, get_marker_data
+    from . import read_data
+
+    info = read_data.get_metadata(source)
+    if mkrdata is None:
+        # FIXME: missing markers are not detected here?
+        mkrdata = read_data.get_marker_data(source, _event_detection_markers())
+    return _automark_events(
+        mkrdata,
+        info['framerate'],
+        events_range=events_range,
+        vel_thresholds=vel_thresholds,
+        roi=roi,
+        plot=plot,
+    )
+
 
-    info = get_metadata(source)
-    frate = info['framerate']
+def _automark_events(
+    mkrdata, frate, events_range=None, vel_thresholds=None, roi=None, plot=False
+):
+    """Mark events from already loaded marker data.
+
+    Does the work of automark_events(), but does not read anything from the
+    data source. frate is the frame rate of the marker data.
+    """
 
     # TODO: move into config
     # marker data is assumed to be in mm
@@ -734,15 +897,6 @@ def automark_events(
             'R_toeoff': None,
         }
 
-    if mkrdata is None:
-        # FIXME: missing markers are not detected here?
-        reqd_markers = (
-            cfg.autoproc.right_foot_markers
-            + cfg.autoproc.left_foot_markers
-            + cfg.autoproc.track_markers
-        )
-        mkrdata = get_marker_data(source, reqd_markers)
-
     rfootctrv_ = avg_markerdata(
         mkrdata,
         cfg.autoproc.right_foot_markers,
@@ -813,23 +967,18 @@ def automark_events(
         strikes = cross[np.logical_and(cind_min, cind_max)]
 
         # check for foot swing (velocity maximum) between consecutive strikes
-        # if no swing, keep deleting the latter event until swing is found
-        bad = []
-        for sind in range(len(strikes)):
-            if sind in bad:
-                continue
-            for sind2 in range(sind + 1, len(strikes)):
-                swing_max_vel = footctrv[strikes[sind] : strikes[sind2]].max()
-                # logger.debug('check %d-%d' % (strikes[sind], strikes[sind2]))
-                if swing_max_vel < maxv * MIN_SWING_VELOCITY:
-                    logger.debug(
-                        'no swing between strikes %d-%d, deleting %d'
-                        % (strikes[sind], strikes[sind2], strikes[sind2])
-                    )
-                    bad.append(sind2)
-                else:
-                    break
-        strikes = np.delete(strikes, bad)
+        # if no swing, keep deleting the latter event until swing is found;
+        # since there is no swing between a deleted strike and the previous
+        # kept one, a strike is kept iff there is swing between it and the
+        # strike just before it
+        if len(strikes) > 1:
+            # maximum velocity from each strike up to the next one
+            interval_max_vel = np.maximum.reduceat(footctrv, strikes)[:-1]
+            swing_ok = ~(interval_max_vel < maxv * MIN_SWING_VELOCITY)
+            strikes_ok = np.concatenate([[True], swing_ok])
+            for strike in strikes[~strikes_ok]:
+                logger.debug(f'no swing before strike {strike}, deleting it')
+            strikes = strikes[strikes_ok]
 
         if len(strikes) == 0:
             raise GaitDataError('No valid foot strikes detected')
@@ -850,14 +999,21 @@ def automark_events(
         if len(toeoffs) == 0:
             raise GaitDataError('Could not detect any toe-off events')
 
-        # check for multiple toeoffs
-        for s1, s2 in list(zip(strikes, np.roll(strikes, -1)))[:-1]:
-            to_this = np.where(np.logical_and(toeoffs > s1, toeoffs < s2))[0]
-            if len(to_this) > 1:
-                logger.debug(
-                    '%d toeoffs during cycle, keeping the last one' % len(to_this)
-                )
-                toeoffs = np.delete(toeoffs, to_this[:-1])
+        # check for multiple toeoffs between consecutive strikes
+        # index of the next strike for each toeoff
+        next_strike = np.searchsorted(strikes, toeoffs)
+        in_cycle = np.logical_and(next_strike > 0, next_strike < len(strikes))
+        in_cycle &= ~np.isin(toeoffs, strikes)
+        cycle_inds = np.flatnonzero(in_cycle)
+        # keep the last toeoff of each cycle (toeoffs are in increasing order)
+        cycles = next_strike[cycle_inds]
+        not_last = cycles[:-1] == cycles[1:]
+        if np.any(not_last):
+            logger.debug(
+                '%d extra toeoffs during cycles, keeping the last ones'
+                % np.count_nonzero(not_last)
+            )
+            toeoffs = np.delete(toeoffs, cycle_inds[:-1][not_last])
 
         logger.debug(f'autodetected strike events: {strikes}')
         logger.debug(f'autodetected toeoff events: {toeoffs}')
@@ -12,6 +12,7 @@ console_entries = [
     'nexus_autoproc_session=gaitutils.autoprocess:autoproc_session',
     'nexus_autoproc_trial=gaitutils.autoprocess:autoproc_trial',
     'nexus_automark_trial=gaitutils.autoprocess:automark_trial',
+    'gaitutils_batch_report=gaitutils.report.batch:main',
     'gaitmenu_make_shortcut=gaitutils.envutils:_make_gaitutils_shortcut',
 ]
 
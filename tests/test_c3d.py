@@ -11,7 +11,7 @@ import numpy as np
 from numpy.testing import assert_allclose, assert_equal
 import logging
 
-from gaitutils import read_data, utils, events
+from gaitutils import read_data, utils, events, c3d, c3dstore, cfg
 from gaitutils.utils import detect_forceplate_events, marker_gaps
 from utils import _trial_path, _c3d_path, _file_path
 
@@ -48,6 +48,53 @@ def test_c3d_marker_data():
     assert_allclose(mkrdata['LHEE'], lhee_data, rtol=1e-4)
 
 
+def test_c3d_point_data():
+    """Test bulk point data reads from c3d"""
+    c3dfile = _c3d_path('double_contact.c3d')
+    data, index = c3d._get_point_data(c3dfile)
+    assert data.shape[1:] == (442, 3)
+    assert data.shape[0] >= len(index)
+    mkrset = list(utils._pig_markerset().keys())
+    mkrdata = read_data.get_marker_data(c3dfile, mkrset)
+    for mkr in mkrset:
+        assert_equal(mkrdata[mkr], data[index[mkr]])
+        # marker data should be returned as read-only views
+        assert not mkrdata[mkr].flags.writeable
+        assert np.shares_memory(mkrdata[mkr], data)
+
+
+def test_c3d_store(tmp_path):
+    """Test reads via the memory-mapped c3d store"""
+    c3dfile = _c3d_path('double_contact.c3d')
+    cfg.general.c3d_store_dir = tmp_path
+    mkrset = list(utils._pig_markerset().keys())
+    try:
+        for _ in range(2):  # build the store, then read from it
+            c3dstore._get_store.cache_clear()
+            mkrdata = c3dstore._get_marker_data(c3dfile, mkrset)
+            mkrdata_ = c3d._get_marker_data(c3dfile, mkrset)
+            for mkr in mkrset:
+                assert_equal(mkrdata[mkr], mkrdata_[mkr])
+            meta = c3dstore._get_metadata(c3dfile)
+            meta_ = c3d._get_metadata(c3dfile)
+            assert meta['length'] == meta_['length']
+            assert meta['trialname'] == meta_['trialname']
+            assert repr(meta['events']) == repr(meta_['events'])
+            fpdata = c3dstore._get_forceplate_data(c3dfile)
+            fpdata_ = c3d._get_forceplate_data(c3dfile)
+            assert len(fpdata) == len(fpdata_)
+            for fp, fp_ in zip(fpdata, fpdata_):
+                assert fp['eclipse_key'] == fp_['eclipse_key']
+                assert_allclose(fp['CoP'], fp_['CoP'])
+            emgdata = c3dstore._get_emg_data(c3dfile)
+            emgdata_ = c3d._get_emg_data(c3dfile)
+            assert emgdata['data'].keys() == emgdata_['data'].keys()
+        assert len(list(tmp_path.glob('*.npz'))) == 1
+    finally:
+        cfg.general.c3d_store_dir = None
+        c3dstore._get_store.cache_clear()
+
+
 def test_c3d_analysis_data():
     """Test analysis var reads from c3d"""
     c3dfile = _c3d_path('double_contact.c3d')
@@ -135,3 +182,28 @@ def test_c3d_fp_detection():
     evs, nplates = detect_forceplate_events(c3dfile, return_nplates=True)
     _, coded = events.get_forceplate_info(evs, nplates)
     assert coded == 'RLXX'
+
+
+def test_c3d_fp_detection_loaded_data():
+    """Test forceplate contact detection from already loaded data"""
+
+    def _evs_tuples(evs):
+        return [
+            (ev.frame, ev.event_type, ev.context, ev.forceplate_index)
+            for ev in evs.get_events()
+        ]
+
+    c3dfile = _trial_path('adult_3fp', 'astrid_080515_02.c3d')
+    evs = _evs_tuples(detect_forceplate_events(c3dfile))
+    assert evs
+    info = read_data.get_metadata(c3dfile)
+    fpdata = read_data.get_forceplate_data(c3dfile)
+    mkrdata = read_data.get_marker_data(c3dfile, utils._event_detection_markers())
+    evs_loaded = utils._detect_forceplate_events(info, fpdata, mkrdata)
+    assert _evs_tuples(evs_loaded) == evs
+    # precomputed marker-based events should give the same result
+    evs_marker = utils.automark_events(c3dfile, mkrdata=mkrdata)
+    evs_loaded = utils._detect_forceplate_events(
+        info, fpdata, mkrdata, events_marker=evs_marker
+    )
+    assert _evs_tuples(evs_loaded) == evs
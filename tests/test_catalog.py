@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+
+Test the session catalog.
+
+@author: Jussi (jnu@iki.fi)
+"""
+
+import logging
+import tempfile
+import time
+from pathlib import Path
+
+from gaitutils import catalog, sessionutils, cfg
+
+logger = logging.getLogger(__name__)
+
+
+def _write_session(sessiondir, trials, hetu=None):
+    """Create a synthetic session. trials is a dict of
+    enf name: (TYPE, DESCRIPTION, c3d exists)"""
+    sessiondir.mkdir(parents=True)
+    for fn, (trial_type, desc, has_c3d) in trials.items():
+        with open(sessiondir / fn, 'w') as f:
+            f.write(f'[TRIAL_INFO]\nTYPE={trial_type}\nDESCRIPTION={desc}\n')
+        if has_c3d:
+            sessionutils.enf_to_trialfile(sessiondir / fn, 'c3d').touch()
+    if hetu is not None:
+        info = sessionutils.default_info()
+        info['hetu'] = hetu
+        sessionutils.save_info(sessiondir, info)
+
+
+def test_catalog():
+    """Test cataloging and querying of sessions"""
+    root = Path(tempfile.mkdtemp())
+    trials = {
+        'trial01.Trial.enf': ('Dynamic', 'E1 forward', True),
+        'trial02.Trial.enf': ('Dynamic', 'backward', True),
+        'trial03.Trial.enf': ('Dynamic', 'E2', False),
+        'static.Trial.enf': ('Static', '', True),
+    }
+    # patient born 2014-01-01
+    hetu = '010114A1231'
+    session1 = root / 'D0001_AB' / '2019_03_01_preOp_AB'
+    session2 = root / 'D0001_AB' / '2021_05_01_postOp_AB'
+    _write_session(session1, trials, hetu=hetu)
+    _write_session(session2, trials, hetu=hetu)
+    _write_session(root / 'D0002_CD' / '2021_06_01_CD', trials)
+    (root / 'empty_dir').mkdir()
+    db_file = root / 'catalog.sqlite'
+    with catalog.SessionCatalog(db_file) as cat:
+        assert cat.update(root) == 3
+        assert cat.get_sessions(age=(6, 10)) == [session2]
+        assert cat.get_sessions(patient_code='AB') == [session1, session2]
+        assert len(cat.get_sessions(since='2021-01-01')) == 2
+        enfs = cat.get_enfs(tags=['E1', 'E2'], trial_type='dynamic')
+        assert len(enfs) == 6
+        c3ds = cat.get_c3ds(
+            tags=['E1', 'E2'], trial_type='dynamic', age=(6, 10), since='2020-01-01'
+        )
+        assert c3ds == [session2 / 'trial01.c3d']
+        assert len(cat.get_c3ds(trial_type='static')) == 3
+        # nothing changed, so nothing should be reindexed
+        assert cat.update(root) == 0
+        # modified, new and removed files should be picked up
+        time.sleep(0.01)
+        with open(session2 / 'trial02.Trial.enf', 'w') as f:
+            f.write('[TRIAL_INFO]\nTYPE=Dynamic\nDESCRIPTION=E1\n')
+        (session2 / 'trial03.c3d').touch()
+        (session1 / 'static.Trial.enf').unlink()
+        assert cat.update(root) == 2
+        c3ds = cat.get_c3ds(tags=['E1', 'E2'], trial_type='dynamic', age=(6, 10))
+        assert set(c3d.name for c3d in c3ds) == {
+            'trial01.c3d',
+            'trial02.c3d',
+            'trial03.c3d',
+        }
+        assert len(cat.get_enfs(trial_type='static')) == 2
+    # the catalog should persist, and removed sessions should be dropped
+    for fn in session1.iterdir():
+        fn.unlink()
+    session1.rmdir()
+    with catalog.SessionCatalog(db_file) as cat:
+        assert cat.update(root) == 0
+        assert cat.get_sessions(patient_code='AB') == [session2]
+
+
+def test_catalog_broken_enf():
+    """Test cataloging sessions with an .enf file without trial info"""
+    use_enf_index = cfg.eclipse.use_enf_index
+    try:
+        for use_index in [True, False]:
+            cfg.eclipse.use_enf_index = use_index
+            root = Path(tempfile.mkdtemp())
+            trials = {'trial01.Trial.enf': ('Dynamic', 'E1', True)}
+            session1 = root / 'D0001_AB' / '2019_03_01_AB'
+            session2 = root / 'D0002_CD' / '2021_06_01_CD'
+            _write_session(session1, trials)
+            _write_session(session2, trials)
+            with open(session2 / 'broken.Trial.enf', 'w') as f:
+                f.write('[NODE_INFORMATION]\nTYPE=Dynamic\n')
+            with catalog.SessionCatalog(root / 'catalog.sqlite') as cat:
+                assert cat.update(root) == 2
+                assert cat.get_sessions() == [session1, session2]
+                # the broken trial is skipped
+                enfs = cat.get_enfs(trial_type='dynamic')
+                assert set(enfs) == {
+                    session1 / 'trial01.Trial.enf',
+                    session2 / 'trial01.Trial.enf',
+                }
+    finally:
+        cfg.eclipse.use_enf_index = use_enf_index
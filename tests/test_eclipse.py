@@ -9,6 +9,8 @@ Misc unit tests.
 import pytest
 from shutil import copyfile
 import logging
+from pathlib import Path
+import tempfile
 
 from gaitutils import eclipse
 from utils import _file_path
@@ -47,3 +49,26 @@ def test_enf_writer():
     assert edi['DESCRIPTION'] == 'testing'
     with pytest.raises(IOError):
         eclipse.set_eclipse_keys('no.enf', {})
+
+
+def test_enf_fast_parser():
+    """Test the fast TRIAL_INFO parser against ConfigObj"""
+    texts = [
+        '[NODEINFORMATION]\nTYPE=TRIAL\n[TRIAL_INFO]\nTYPE=Dynamic\nNOTES=\nFP1=Left\n',
+        '[TRIAL_INFO]\n=\nDESCRIPTION=E1, forward # comment\n\n[OTHER]\nTYPE=x\n',
+        '[NODEINFORMATION]\nTYPE=Dynamic\n[TRIAL_INFO]\nTYPE=Dynamic\n"KEY" = "val"\n',
+    ]
+    for text in texts:
+        trial_info = eclipse._parse_trial_info(text)
+        assert trial_info == dict(eclipse._enf_reader(None, text=text)['TRIAL_INFO'])
+    # a duplicate line from another section is dropped by the prefilter
+    assert 'TYPE' not in eclipse._parse_trial_info(texts[2].replace('"KEY"', 'X'))
+    # multiline values are left for ConfigObj
+    assert eclipse._parse_trial_info('[TRIAL_INFO]\nA="""x\ny"""\n') is None
+    with pytest.raises(eclipse.GaitDataError):
+        eclipse._parse_trial_info('[NODEINFORMATION]\nTYPE=TRIAL\n')
+    # latin-1 encoded file
+    fn = Path(tempfile.gettempdir()) / 'latin1.enf'
+    with open(fn, 'wb') as f:
+        f.write('[TRIAL_INFO]\r\nDESCRIPTION=äö\r\n'.encode('latin-1'))
+    assert eclipse.get_eclipse_keys(fn)['DESCRIPTION'] == 'äö'
@@ -10,8 +10,10 @@ import logging
 import tempfile
 import tempfile
 from pathlib import Path
+import numpy as np
+from numpy.testing import assert_allclose
 
-from gaitutils import emg, cfg
+from gaitutils import emg, numutils, cfg
 from utils import _file_path
 
 logger = logging.getLogger(__name__)
@@ -102,3 +104,28 @@ def test_emg_get_data():
         assert chdata.shape == (1000,)
         chdata = e.get_channel_data(chname, envelope=True)
         assert chdata.shape == (1000,)
+
+
+def test_emg_processed_cache():
+    """Test batched processing and caching of the EMG data"""
+    fn = r'2018_12_17_preOp_RR04.c3d'
+    fpath = sessiondir_abs / fn
+    e = emg.EMG(fpath)
+    filt = e.get_channel_data('RGas')
+    assert not filt.flags.writeable
+    filt_all = e._get_processed_data(envelope=False)
+    assert e._get_processed_data(envelope=False) is filt_all
+    assert np.shares_memory(filt, filt_all)
+    # batched filtering must match filtering of a single channel
+    ch = e._match_name('RGas')
+    filt_1 = numutils._filtfilt(e.data[ch], e.passband, e.sfrate)
+    assert_allclose(filt, filt_1)
+    env = e.get_channel_data('RGas', envelope=True)
+    assert_allclose(env, numutils.envelope(e.data[ch], e.sfrate))
+    # changing the passband must discard the cached data
+    e.passband = [30, 300]
+    filt2 = e.get_channel_data('RGas')
+    assert not np.shares_memory(filt2, filt_all)
+    assert (filt2 != filt).any()
+    e.passband = None
+    assert (e.get_channel_data('RGas') == e.data[ch]).all()
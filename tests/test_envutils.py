@@ -6,9 +6,11 @@ Unit tests for envutils.py misc functions.
 @author: jussi (jnu@iki.fi)
 """
 
-from gaitutils import envutils
-
+from pathlib import Path
 import logging
+import os
+
+from gaitutils import envutils
 
 
 logger = logging.getLogger(__name__)
@@ -24,3 +26,56 @@ def test_named_tempfile():
     tmp = envutils._named_tempfile(suffix='.tmp')
     assert tmp.suffix == '.tmp'
     assert tmp.parent.is_dir()
+
+
+def test_lru_cache_checkfile(tmp_path):
+    """Test the file-validated cache"""
+    calls = list()
+
+    @envutils.lru_cache_checkfile(max_bytes=10)
+    def _read(fn):
+        calls.append(fn)
+        return Path(fn).read_bytes()
+
+    fn1, fn2 = tmp_path / 'f1.dat', tmp_path / 'f2.dat'
+    fn1.write_bytes(b'12345')
+    fn2.write_bytes(b'1234567')
+    assert _read(fn1) == b'12345'
+    assert _read(fn1) == b'12345'
+    assert len(calls) == 1
+    info = _read.cache_info()
+    assert (info.hits, info.misses, info.entries, info.nbytes) == (1, 1, 1, 5)
+    # change of file size invalidates the entry
+    fn1.write_bytes(b'1234')
+    assert _read(fn1) == b'1234'
+    assert len(calls) == 2
+    assert _read.cache_info().invalidations == 1
+    # exceeding the byte budget evicts the least recently used entry
+    _read(fn2)
+    info = _read.cache_info()
+    assert info.evictions == 1
+    assert info.entries == 1
+    assert _read.cache_invalidate(fn2)
+    assert not _read.cache_invalidate(fn2)
+    _read.cache_clear()
+    assert _read.cache_info().entries == 0
+
+
+def test_lru_cache_checkfile_digest(tmp_path):
+    """Test the file-validated cache in digest mode"""
+    calls = list()
+
+    @envutils.lru_cache_checkfile(check_digest=True)
+    def _read(fn):
+        calls.append(fn)
+        return Path(fn).read_bytes()
+
+    fn = tmp_path / 'f.dat'
+    fn.write_bytes(b'abc')
+    st = os.stat(fn)
+    _read(fn)
+    # same size and mtime, but different contents
+    fn.write_bytes(b'xyz')
+    os.utime(fn, ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert _read(fn) == b'xyz'
+    assert len(calls) == 2
@@ -11,7 +11,15 @@ import numpy as np
 from numpy.testing import assert_allclose
 import logging
 
-from gaitutils.numutils import _segment_angles, digitize_array, rms
+from gaitutils.numutils import (
+    _segment_angles,
+    digitize_array,
+    rms,
+    _filtfilt,
+    _butter_sos,
+    _get_local_max,
+    _get_local_max_2d,
+)
 
 # from utils import _file_path, cfg
 
@@ -71,3 +79,40 @@ def test_rms():
     )
     assert_allclose(rms(np.arange(10), win=3), arms)
     # XXX: still needs a proper 2-d computation for completeness
+
+
+def test_filtfilt():
+    """Test the forward-backward filter"""
+    sfrate = 2000.0
+    t = np.arange(10000) / sfrate
+    x_lo = np.sin(2 * np.pi * 1 * t)
+    x_hi = np.sin(2 * np.pi * 200 * t)
+    # low cutoff at high sampling rate, e.g. the linear envelope lowpass
+    y = _filtfilt(x_lo + x_hi, [0, 5], sfrate)
+    assert_allclose(y[1000:-1000], x_lo[1000:-1000], atol=1e-2)
+    # bandpass, filtering along an axis
+    X = np.stack([x_lo + x_hi, 2 * (x_lo + x_hi)])
+    Y = _filtfilt(X, [100, 300], sfrate, axis=1)
+    assert_allclose(Y[0, 1000:-1000], x_hi[1000:-1000], atol=1e-2)
+    assert_allclose(Y[1], 2 * Y[0])
+    assert _filtfilt(x_lo, None, sfrate) is x_lo
+    # filter designs are cached
+    assert _butter_sos(5, (0, 5), sfrate) is _butter_sos(5, (0, 5), sfrate)
+
+
+def test_get_local_max_2d():
+    """Test the vectorized peak finder against the 1-D one"""
+    rng = np.random.default_rng(0)
+    # rounding creates flat peaks
+    data = np.round(rng.standard_normal((50, 101)).cumsum(axis=1))
+    data[rng.random(data.shape) < 0.02] = np.nan
+    stops = rng.integers(1, 101, 50)
+    inds, vals = _get_local_max_2d(data, stop=stops)
+    for row, stop, ind, val in zip(data, stops, inds, vals):
+        ind_, val_ = _get_local_max(row[:stop])
+        assert_allclose([ind, val], [ind_, val_])
+    # segments not starting at zero
+    inds, vals = _get_local_max_2d(data, start=stops - 1)
+    for row, start, ind, val in zip(data, stops - 1, inds, vals):
+        ind_, val_ = _get_local_max(row[start:])
+        assert_allclose([ind, val], [ind_ + start, val_])
@@ -8,10 +8,13 @@ Test reporting functions.
 
 import pytest
 import logging
+import os
+import sys
 import tempfile
 from pathlib import Path
 
-from gaitutils.report import pdf, web
+from gaitutils import cfg
+from gaitutils.report import pdf, web, batch
 from utils import _file_path
 
 logger = logging.getLogger(__name__)
@@ -44,6 +47,44 @@ def test_pdf_report():
     assert timedist_path.is_file()
 
 
+def test_batch_report():
+    """Test the batch report manifest and skipping of unchanged sessions"""
+    root = Path(tempfile.mkdtemp())
+    sessions = [root / 'session1', root / 'session2']
+    for session in sessions:
+        session.mkdir()
+        (session / 'trial01.Trial.enf').write_text('[TRIAL_INFO]\nTYPE=Dynamic\n')
+    manifest_fn = root / 'manifest.json'
+    # the sessions have no tagged trials, so reports should fail
+    results = batch.batch_report(
+        [str(root / 'session*')], n_jobs=2, manifest=manifest_fn
+    )
+    assert set(results) == set(str(session) for session in sessions)
+    assert all(res['status'] == 'failed' for res in results.values())
+    assert manifest_fn.is_file()
+    batch._report_path(sessions[0], None).touch()
+
+    def _fake_success():
+        """Pretend that the report for the first session succeeded"""
+        manifest = batch._load_manifest(manifest_fn)
+        manifest['sessions'][str(sessions[0])]['status'] = 'ok'
+        batch._save_manifest(manifest_fn, manifest)
+
+    _fake_success()
+    results = batch.batch_report(sessions, n_jobs=1, manifest=manifest_fn)
+    assert results[str(sessions[0])]['status'] == 'skipped'
+    assert results[str(sessions[1])]['status'] == 'failed'
+    # changed inputs or force=True should recreate the report
+    (sessions[0] / 'trial01.c3d').touch()
+    results = batch.batch_report(sessions[:1], n_jobs=1, manifest=manifest_fn)
+    assert results[str(sessions[0])]['status'] == 'failed'
+    _fake_success()
+    results = batch.batch_report(
+        sessions[:1], n_jobs=1, manifest=manifest_fn, force=True
+    )
+    assert results[str(sessions[0])]['status'] == 'failed'
+
+
 @pytest.mark.slow
 def test_pdf_comparison_report():
     """Test creation of pdf comparison report"""
@@ -75,6 +116,10 @@ def test_web_report():
     app = web.dash_report([sessiondir_abs], info=None, signals=foo, recreate_plots=True)
     assert app
 
+    # single session, lazy figure creation
+    app = web.dash_report([sessiondir_abs], info=None, signals=foo, lazy=True)
+    assert app
+
     # video-only
     app = web.dash_report(
         [sessiondir_abs],
@@ -103,3 +148,72 @@ def test_web_report():
     )
 
     assert app
+
+
+def test_figure_cache():
+    """Test the web report figure cache"""
+    cache = web._FigureCache(Path(tempfile.mkdtemp()) / 'cache', max_bytes=None)
+    with pytest.raises(KeyError):
+        cache.get('foo')
+    figdata = {'data': [{'x': list(range(100))}]}
+    cache.put('foo', figdata)
+    cache.put('bar', None)  # unavailable figures are cached as None
+    assert cache.get('foo') == figdata
+    assert cache.get('bar') is None
+    assert cache.is_unavailable('bar')
+    assert not cache.is_unavailable('foo')
+    assert not cache.is_unavailable('baz')
+    # a corrupted file should be a cache miss
+    cache._path('bar').write_bytes(b'garbage')
+    with pytest.raises(KeyError):
+        cache.get('bar')
+    # eviction should remove the least recently used figures
+    for key in ['fig1', 'fig2']:
+        cache.put(key, figdata)
+    for fn in cache.cache_dir.glob('*.pkl'):
+        os.utime(fn, ns=(10**9, 10**9))  # make the figures old
+    cache.get('fig1')
+    cache.max_bytes = 2 * cache._path('foo').stat().st_size
+    cache.put('fig3', figdata)
+    assert set(fn.stem for fn in cache.cache_dir.glob('*.pkl')) == {'fig1', 'fig3'}
+
+
+def test_figure_cache_file_digests():
+    """Test the file digest index of the web report figure cache"""
+    tmpdir_ = Path(tempfile.mkdtemp())
+    cache = web._FigureCache(tmpdir_ / 'cache')
+    files = [tmpdir_ / 'foo.c3d', tmpdir_ / 'bar.c3d']
+    for k, fn in enumerate(files):
+        fn.write_bytes(bytes([k]) * 100)
+    digests = cache.file_digests(files)
+    assert digests[files[0]] != digests[files[1]]
+    # the digests should be read from the index, unless the files change
+    index_fn = cache.cache_dir / cache.DIGESTS_FILENAME
+    assert index_fn.is_file()
+    mtime = index_fn.stat().st_mtime_ns
+    assert cache.file_digests(files) == digests
+    assert index_fn.stat().st_mtime_ns == mtime
+    files[0].write_bytes(bytes([1]) * 100)
+    assert cache.file_digests(files)[files[0]] == digests[files[1]]
+
+
+def test_web_report_broken_trial():
+    """Test that a broken trial does not mark report figures as unavailable"""
+    sessiondir = Path(tempfile.mkdtemp()) / '2021_06_01_AB'
+    sessiondir.mkdir()
+    with open(sessiondir / 'trial01.Trial.enf', 'w') as f:
+        f.write('[TRIAL_INFO]\nTYPE=Dynamic\nDESCRIPTION=E1\n')
+    (sessiondir / 'trial01.c3d').write_bytes(b'garbage')
+    info = {'fullname': None, 'hetu': None}
+    browser_path = cfg.general.browser_path
+    cfg.general.browser_path = sys.executable
+    try:
+        for lazy in [False, True]:
+            # the error should stop the report
+            with pytest.raises(Exception):
+                web.dash_report([sessiondir], info=info, lazy=lazy)
+            cache = web._FigureCache(web._figure_cache_dir([sessiondir]))
+            figkeys = [fn.stem for fn in cache.cache_dir.glob('*.pkl')]
+            assert not any(cache.is_unavailable(figkey) for figkey in figkeys)
+    finally:
+        cfg.general.browser_path = browser_path
@@ -11,7 +11,7 @@ import logging
 import tempfile
 from pathlib import Path
 
-from gaitutils import sessionutils, GaitDataError
+from gaitutils import sessionutils, eclipse, GaitDataError
 from utils import _file_path
 
 logger = logging.getLogger(__name__)
@@ -98,3 +98,58 @@ def test_load_info():
     for key in ['hetu', 'fullname', 'session_description']:
         assert key in info
         assert info[key]
+
+
+def test_enf_index():
+    """Test the session .enf index"""
+    sessiondir = Path(tempfile.mkdtemp())
+    trials = {
+        'trial01.Trial.enf': ('Dynamic', 'E1 forward'),
+        'trial02.Trial.enf': ('Dynamic', 'backward'),
+        'static.Trial.enf': ('Static', ''),
+    }
+    for fn, (trial_type, desc) in trials.items():
+        with open(sessiondir / fn, 'w') as f:
+            f.write(f'[TRIAL_INFO]\nTYPE={trial_type}\nDESCRIPTION={desc}\n')
+    index = eclipse._get_enf_index(sessionpath=sessiondir)
+    enfs = sessionutils.get_enfs(sessiondir, trial_type='dynamic')
+    assert set(enf.name for enf in enfs) == {'trial01.Trial.enf', 'trial02.Trial.enf'}
+    assert len(sessionutils.get_enfs(sessiondir, tags=['E1'])) == 1
+    assert (sessiondir / index.INDEX_FILENAME).is_file()
+    # a fresh instance should read the keys from the index file
+    index_ = eclipse._EnfIndex(sessiondir)
+    assert index_._entries.keys() == trials.keys()
+    # changes to the files should be picked up
+    eclipse.set_eclipse_keys(
+        sessiondir / 'trial02.Trial.enf', {'DESCRIPTION': 'E1'}, update_existing=True
+    )
+    (sessiondir / 'static.Trial.enf').unlink()
+    assert len(sessionutils.get_enfs(sessiondir, tags=['E1'])) == 2
+    assert len(sessionutils.get_enfs(sessiondir)) == 2
+    keys = eclipse._get_eclipse_keys_indexed(sessiondir / 'trial02.Trial.enf')
+    assert keys == eclipse.get_eclipse_keys(sessiondir / 'trial02.Trial.enf')
+
+
+def test_enf_index_broken_enf():
+    """Test the session .enf index with an .enf file without trial info"""
+    sessiondir = Path(tempfile.mkdtemp())
+    for fn in ['trial01.Trial.enf', 'trial02.Trial.enf']:
+        with open(sessiondir / fn, 'w') as f:
+            f.write('[TRIAL_INFO]\nTYPE=Dynamic\nDESCRIPTION=E1\n')
+    with open(sessiondir / 'broken.Trial.enf', 'w') as f:
+        f.write('[NODE_INFORMATION]\nTYPE=Dynamic\n')
+    # unfiltered listing does not need to parse the files
+    assert len(sessionutils.get_enfs(sessiondir)) == 3
+    # the broken file cannot match the filters
+    assert len(sessionutils.get_enfs(sessiondir, trial_type='dynamic')) == 2
+    assert len(sessionutils.get_enfs(sessiondir, tags=['E1'])) == 2
+    # the error is kept in the index until the file changes
+    index = eclipse._get_enf_index(sessionpath=sessiondir)
+    assert index._entries['broken.Trial.enf']['keys'] is None
+    with pytest.raises(GaitDataError):
+        eclipse._get_eclipse_keys_indexed(sessiondir / 'broken.Trial.enf')
+    with open(sessiondir / 'broken.Trial.enf', 'w') as f:
+        f.write('[TRIAL_INFO]\nTYPE=Dynamic\nDESCRIPTION=fixed\n')
+    assert len(sessionutils.get_enfs(sessiondir, trial_type='dynamic')) == 3
+    # no temporary files are left behind
+    assert not list(sessiondir.glob('*.tmp'))
@@ -7,9 +7,11 @@ Tests for trial stats
 """
 
 import numpy as np
+from numpy.testing import assert_allclose
 import logging
+import pytest
 
-from gaitutils import sessionutils, stats, models
+from gaitutils import sessionutils, stats, models, numutils, GaitDataError
 from utils import _file_path, cfg
 
 
@@ -81,6 +83,20 @@ def test_collect_trial_data():
     assert all(data.shape[1] == 501 for data in data_emg.values())
 
 
+def test_collect_trial_data_parallel():
+    """Test collection of trial data using worker processes"""
+    c3ds = sessionutils.get_c3ds(sessiondir_abs, trial_type='dynamic')
+    data_all, cycles_all = stats.collect_trial_data(c3ds)
+    data_all_, cycles_all_ = stats.collect_trial_data(c3ds, n_jobs=2, chunksize=1)
+    for datatype in data_all:
+        assert set(data_all[datatype].keys()) == set(data_all_[datatype].keys())
+        for var in data_all[datatype]:
+            assert_allclose(data_all[datatype][var], data_all_[datatype][var])
+            starts = [cyc.start for cyc in cycles_all[datatype][var]]
+            starts_ = [cyc.start for cyc in cycles_all_[datatype][var]]
+            assert starts == starts_
+
+
 def test_average_model_data():
     """Test averaging of model data"""
     c3ds = sessionutils.get_c3ds(sessiondir_abs, trial_type='dynamic')
@@ -119,6 +135,87 @@ def test_average_model_data():
     assert any(ncycles_ok_reject[var] < ncycles_ok[var] for var in ncycles_ok)
 
 
+def test_robust_outlier_rows():
+    """Test the batched outlier detection"""
+    rng = np.random.default_rng(0)
+    data = {
+        'var1': rng.standard_normal((20, 101)),
+        'var2': rng.standard_normal((20, 101)),
+        'var3': rng.standard_normal((15, 101)),
+    }
+    data['var1'][3] += 10
+    data['var3'][[0, 5]] -= 10
+    outlier_rows = stats._robust_outlier_rows(data, 1e-3)
+    for var, vardata in data.items():
+        outlier_inds = numutils.outliers(
+            vardata, axis=0, single_mad=False, p_threshold=1e-3 / 101
+        )
+        rows = np.zeros(vardata.shape[0], dtype=bool)
+        rows[outlier_inds[0]] = True
+        assert (outlier_rows[var] == rows).all()
+    assert outlier_rows['var1'][3]
+    assert outlier_rows['var3'][[0, 5]].all()
+
+
+def test_curve_accumulator():
+    """Test the streaming averager"""
+    rng = np.random.default_rng(0)
+    data = rng.standard_normal((400, 101)) + np.linspace(0, 10, 101)
+    # mean and stddev should be exact, also when merging partial results
+    acc1 = stats.CurveAccumulator()
+    acc2 = stats.CurveAccumulator()
+    for k in range(0, 150, 10):
+        acc1.add({'var': data[k : k + 10], 'nodata': None})
+    acc2.add({'var': data[150:]})
+    acc1.merge(acc2)
+    avgdata, stddata, ncycles_ok = acc1.result()
+    assert ncycles_ok == {'var': 400, 'nodata': 0}
+    assert avgdata['nodata'] is None and stddata['nodata'] is None
+    assert_allclose(avgdata['var'], data.mean(axis=0))
+    assert_allclose(stddata['var'], data.std(axis=0))
+    # medians are approximate
+    acc1 = stats.CurveAccumulator(use_medians=True)
+    acc2 = stats.CurveAccumulator(use_medians=True)
+    acc1.add({'var': data[:100]})
+    acc2.add({'var': data[100:]})
+    acc1.merge(acc2)
+    avgdata, stddata, ncycles_ok = acc1.result()
+    assert ncycles_ok['var'] == 400
+    assert_allclose(avgdata['var'], np.median(data, axis=0), atol=0.2)
+    assert_allclose(stddata['var'], numutils.mad(data, axis=0), atol=0.2)
+    # exact for small N
+    acc1 = stats.CurveAccumulator(use_medians=True)
+    acc1.add({'var': data[:5]})
+    avgdata, stddata, ncycles_ok = acc1.result()
+    assert_allclose(avgdata['var'], np.median(data[:5], axis=0))
+
+
+def test_avgtrial_streaming():
+    """Test creating an AvgTrial in streaming mode"""
+    c3ds = sessionutils.get_c3ds(sessiondir_abs, trial_type='dynamic')
+    atrial = stats.AvgTrial.from_trials(c3ds, sessionpath=sessiondir_abs)
+    atrial_stream = stats.AvgTrial.from_trials(
+        c3ds, sessionpath=sessiondir_abs, streaming=True
+    )
+    for var in models.pig_lowerbody.varnames:
+        if 'ForeFoot' in var:
+            continue
+        assert_allclose(
+            atrial_stream.get_model_data(var)[1], atrial.get_model_data(var)[1]
+        )
+
+
+def test_avgtrial_mixed_trial_types():
+    """Test that dynamic and static trials are not averaged together"""
+    c3ds = sessionutils.get_c3ds(sessiondir_abs, trial_type='dynamic')
+    c3ds += sessionutils.get_c3ds(sessiondir_abs, trial_type='static')
+    for streaming in [False, True]:
+        with pytest.raises(GaitDataError):
+            stats.AvgTrial.from_trials(
+                c3ds, sessionpath=sessiondir_abs, streaming=streaming
+            )
+
+
 def test_avgtrial():
     """Test the AvgTrial class"""
     # create from trials
@@ -199,6 +296,13 @@ def test_curve_extract_values():
             },
         },
     }
+    # the structured array version
+    res_arr = stats.curve_extract_values([curve], [toeoff], as_array=True)
+    assert res_arr.shape == (1,)
+    assert res_arr['peaks']['swing']['argmin'][0] == 80
+    assert res_arr['extrema']['stance']['argmax'][0] == 50
+    assert_allclose(res_arr['peaks']['swing']['max'], [1.9])
+    assert_allclose(res_arr['toeoff'], [-0.4])
 
 
 def test_trials_extract_values():
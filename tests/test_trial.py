@@ -8,10 +8,11 @@ Test trial related functionality
 
 import numpy as np
 from numpy.testing import assert_allclose, assert_equal
+from scipy.interpolate import interp1d
 import logging
 
 from gaitutils import models
-from gaitutils.trial import Trial
+from gaitutils.trial import Trial, Gaitcycle, normalize_to_cycles
 from gaitutils.utils import _pig_markerset
 from utils import _trial_path
 
@@ -126,3 +127,54 @@ def test_trial_data_read():
             )
             assert_allclose(data[:15], data_truth)
     # read EMG data
+
+
+def test_trial_curve_cache():
+    """Test caching of normalized curves"""
+    c3dfile = _trial_path('girl6v', '2015_10_22_girl6v_IN02.c3d')
+    tr = Trial(c3dfile)
+    _, data = tr.get_model_data('RHipAnglesX', 0)
+    _, data_ = tr.get_model_data('RHipAnglesX', tr.cycles[0])
+    assert data is data_
+    # cached curves are shared, so they should not be writable
+    assert not data.flags.writeable
+    _, data_cycles = tr.get_model_data_cycles('RHipAnglesX', tr.cycles)
+    assert data_cycles.shape == (len(tr.cycles), 101)
+    assert_allclose(data_cycles[0], data)
+    _, emgdata = tr.get_emg_data('RGas', 0)
+    _, emgdata_ = tr.get_emg_data('RGas', 0)
+    assert emgdata is emgdata_
+    # changing the filter passband should not return the cached data
+    tr.emg.passband = [30, 300]
+    _, emgdata_ = tr.get_emg_data('RGas', 0)
+    assert emgdata is not emgdata_
+    # new cycles should clear the cache
+    tr.cycles = tr._scan_cycles()
+    _, data_ = tr.get_model_data('RHipAnglesX', 0)
+    assert data is not data_
+    assert_allclose(data, data_)
+
+
+def test_normalize_to_cycles():
+    """Test batched cycle normalization against quadratic interp1d"""
+    rng = np.random.default_rng(0)
+    data = np.cumsum(rng.standard_normal((500, 4)), axis=0)
+    cycles = [
+        Gaitcycle(start, start + length, start + length // 2, 'R', False, None, 10)
+        for start, length in [(0, 120), (30, 97), (200, 120), (350, 3)]
+    ]
+    tn, ndata = normalize_to_cycles(data, cycles)
+    assert ndata.shape == (4, 101, 4)
+    for cyc, ndata_cyc in zip(cycles, ndata):
+        data_cyc = data[cyc.start : cyc.end]
+        idata = np.array(
+            [
+                interp1d(cyc.t, data_cyc[:, k], kind='quadratic')(tn)
+                for k in range(data.shape[1])
+            ]
+        ).T
+        assert_allclose(ndata_cyc, idata, rtol=1e-12, atol=1e-12)
+        assert_allclose(cyc.normalize(data)[1], idata, rtol=1e-12, atol=1e-12)
+    # 1-D data
+    _, ndata_1d = normalize_to_cycles(data[:, 0], cycles)
+    assert_allclose(ndata_1d, ndata[:, :, 0])
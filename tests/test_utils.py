@@ -9,14 +9,23 @@ Unit tests for utils.py misc functions.
 import numpy as np
 import logging
 import pytest
-from numpy.testing import assert_allclose
+from numpy.testing import assert_allclose, assert_equal
 
+from gaitutils import cfg, GaitDataError
 from gaitutils.utils import (
     is_plugingait_set,
     _point_in_poly,
+    _points_in_convex_polys,
     _pig_markerset,
     _check_markers_flipped,
+    _leading_foot,
+    _MarkerData,
+    avg_markerdata,
+    _FOOT_GAP,
+    _FOOT_LEFT,
+    _FOOT_RIGHT,
     marker_gaps,
+    _automark_events,
 )
 from utils import _file_path
 
@@ -41,6 +50,31 @@ def test_marker_gaps():
     assert 0 in gaps
 
 
+def test_avg_markerdata():
+    """Test avg_markerdata"""
+    mdata1 = np.random.randn(100, 3)
+    mdata2 = np.random.randn(100, 3)
+    mdata2[50:60, :] = 0
+    mkrdata = _MarkerData(M1=mdata1, M2=mdata2)
+    with pytest.raises(GaitDataError):
+        avg_markerdata(mkrdata, ['M1', 'M2'])
+    # marker with gaps is left out of the average
+    avg = avg_markerdata(mkrdata, ['M1', 'M2'], fail_on_gaps=False)
+    assert_allclose(avg, mdata1)
+    # gaps outside the roi are ignored
+    avg = avg_markerdata(mkrdata, ['M1', 'M2'], roi=[0, 50])
+    assert_allclose(avg, (mdata1 + mdata2) / 2)
+    avg = avg_markerdata(mkrdata, ['M1'], avg_velocity=True)
+    assert_allclose(avg, np.gradient(mdata1, axis=0))
+    # results are cached, unless the marker data is replaced
+    assert avg_markerdata(mkrdata, ['M1'], avg_velocity=True) is avg
+    mdata3 = np.random.randn(100, 3)
+    mkrdata['M1'] = mdata3
+    avg3 = avg_markerdata(mkrdata, ['M1'], avg_velocity=True)
+    assert avg3 is not avg
+    assert_allclose(avg3, np.gradient(mdata3, axis=0))
+
+
 def test_is_plugingait_set():
     pig = _pig_markerset()
     assert is_plugingait_set(pig)
@@ -75,9 +109,80 @@ def test_check_plugingait_set():
     assert list(_check_markers_flipped(mkrdata))
 
 
+def test_leading_foot():
+    # subject walks in the -x direction, left foot leads during first half
+    n = 100
+    x_pelvis = -100 - np.arange(n, dtype=float)
+    x_left = x_pelvis - np.where(np.arange(n) < n // 2, 10, -10)
+    mkrdata = dict()
+    for mkr in cfg.autoproc.track_markers:
+        mkrdata[mkr] = np.column_stack([x_pelvis, np.ones(n), np.ones(n)])
+    for mkr in cfg.autoproc.left_foot_markers:
+        mkrdata[mkr] = np.column_stack([x_left, np.ones(n), np.ones(n)])
+    for mkr in cfg.autoproc.right_foot_markers:
+        mkrdata[mkr] = np.column_stack([x_pelvis, np.ones(n), np.ones(n)])
+    # a trailing gap in the right foot markers (ignored by the averaging)
+    for mkr in cfg.autoproc.right_foot_markers:
+        mkrdata[mkr][95:] = 0
+    codes = _leading_foot(mkrdata)
+    assert codes.dtype == np.int8
+    assert_equal(codes[: n // 2], _FOOT_LEFT)
+    assert_equal(codes[n // 2 : 95], _FOOT_RIGHT)
+    assert_equal(codes[95:], _FOOT_GAP)
+    codes = _leading_foot(mkrdata, frames=[10, 60, 97, n])
+    assert_equal(codes, [_FOOT_LEFT, _FOOT_RIGHT, _FOOT_GAP, _FOOT_GAP])
+
+
+def test_automark_events():
+    """Test _automark_events on synthetic foot velocity data"""
+    # foot velocity (mm/frame): four strides with swing peaks at 40
+    # the 2nd stride has two toeoff threshold crossings (a swing with a dip)
+    # the 3rd stride is followed by a spurious strike with no swing before it
+    knots = list()
+    for k in range(4):
+        s = 25 + 100 * k
+        if k == 1:
+            knots += [(s + 50, 2), (s + 54, 25), (s + 56, 25), (s + 58, 12)]
+            knots += [(s + 62, 40), (s + 70, 40), (s + 80, 2)]
+        else:
+            knots += [(s + 50, 2), (s + 60, 40), (s + 70, 40), (s + 80, 2)]
+        if k == 2:
+            knots += [(s + 90, 2), (s + 95, 15), (s + 100, 2)]
+    frames, vels = zip(*knots)
+    footvel = np.interp(np.arange(450), frames, vels)
+    # markers move along the x axis with the given velocity
+    x = np.cumsum(footvel)
+    mdata = np.column_stack([x, np.ones_like(x), np.ones_like(x)])
+    mkrdata = _MarkerData()
+    for mkr in cfg.autoproc.right_foot_markers + cfg.autoproc.left_foot_markers:
+        mkrdata[mkr] = mdata.copy()
+    events = _automark_events(mkrdata, 100)
+    for context in 'RL':
+        strikes = [ev.frame for ev in events.get_events('strike', context)]
+        toeoffs = [ev.frame for ev in events.get_events('toeoff', context)]
+        # spurious strike at frame 323 is deleted
+        assert strikes == [103, 203, 303, 403]
+        # the last toeoff of the 2nd stride is kept
+        assert toeoffs == [184, 279, 379]
+
+
 def test_point_in_poly():
     poly = np.array([[1, 1, 0], [1, 0, 0], [0, 0, 0], [0, 1, 0]])
     pt = np.array([1.0001, 1.0001, 0])
     assert not _point_in_poly(poly, pt)
     pt = np.array([0.5, 0.5, 0])
     assert _point_in_poly(poly, pt)
+
+
+def test_points_in_convex_polys():
+    # unit square (clockwise) and a shifted square (counterclockwise)
+    poly1 = np.array([[1, 1, 0], [1, 0, 0], [0, 0, 0], [0, 1, 0]])
+    poly2 = poly1[::-1] + [2, 0, 0]
+    pts = np.array(
+        [[[0.5, 0.5, 0], [2.5, 0.5, 0]], [[1.5, 0.5, 0], [np.nan, np.nan, np.nan]]]
+    )
+    res = _points_in_convex_polys(pts, np.stack([poly1, poly2]))
+    assert res.shape == (2, 2, 2)
+    assert_equal(res[0, 0], [True, False])
+    assert_equal(res[0, 1], [False, True])
+    assert not res[1].any()